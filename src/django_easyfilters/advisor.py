@@ -0,0 +1,254 @@
+"""
+Proposes database indexes for the queries that a FilterSet does, used by the
+easyfilters_index_advisor management command.
+
+Each field of the FilterSet is followed through its relations (as
+get_model_field does), and indexes are proposed for:
+
+* the column that is grouped on and filtered by, on the model it ends at;
+* ManyToMany through tables, with the column of the related model first, for
+  filtering by a related object and joining back;
+* pairs of an equality column (ForeignKey, choices, boolean) and a range
+  column (date, number) of the main model, for date and numeric facets
+  computed within a chosen value.
+
+Indexes that are the leading columns of another proposed or existing index
+are left out.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import time
+
+from django.db import models
+from django.http import QueryDict
+
+from .utils import LOOKUP_SEP
+from .utils import RelatedObject
+
+RANGE_TYPES = ('DateField', 'DateTimeField', 'DecimalField', 'FloatField',
+               'IntegerField', 'PositiveIntegerField', 'BigIntegerField')
+
+
+class IndexProposal(object):
+
+    def __init__(self, table, columns, reason):
+        self.table = table
+        self.columns = tuple(columns)
+        self.reason = reason
+
+    def __repr__(self):
+        return '<IndexProposal %s(%s)>' % (self.table, ', '.join(self.columns))
+
+    def __eq__(self, other):
+        return (isinstance(other, IndexProposal) and
+                (self.table, self.columns) == (other.table, other.columns))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.table, self.columns))
+
+    @property
+    def name(self):
+        name = 'easyfilters_%s_%s' % (self.table, '_'.join(self.columns))
+        if len(name) > 30:
+            # Short enough for all databases, but still unique.
+            digest = hashlib.md5(name.encode('utf-8')).hexdigest()[:8]
+            name = '%s_%s' % (name[:21], digest)
+        return name
+
+    def create_sql(self, connection):
+        qn = connection.ops.quote_name
+        template = getattr(getattr(connection, 'SchemaEditorClass', None),
+                           'sql_create_index',
+                           'CREATE INDEX %(name)s ON %(table)s '
+                           '(%(columns)s)%(extra)s')
+        return template % {'name': qn(self.name),
+                           'table': qn(self.table),
+                           'columns': ', '.join(qn(c) for c in self.columns),
+                           'extra': ''}
+
+    def drop_sql(self, connection):
+        qn = connection.ops.quote_name
+        template = getattr(getattr(connection, 'SchemaEditorClass', None),
+                           'sql_delete_index', 'DROP INDEX %(name)s')
+        return template % {'name': qn(self.name), 'table': qn(self.table)}
+
+
+def field_hops(model, path):
+    """
+    Follows the field path from model, returning a list of (model, field,
+    m2m) for each step, where field is a Field or RelatedObject.
+    """
+    hops = []
+    for name in path.split(LOOKUP_SEP):
+        field, _model, direct, m2m = model._meta.get_field_by_name(name)
+        hops.append((model, field, m2m))
+        if isinstance(field, RelatedObject):
+            model = field.model
+        elif field.rel is not None:
+            model = field.rel.to
+    return hops
+
+
+def through_columns(field, model):
+    """
+    For a ManyToManyField (or its RelatedObject), reached from model, returns
+    (through table, column for model, column for the other model).
+    """
+    m2m_field = field.field if isinstance(field, RelatedObject) else field
+    through = m2m_field.rel.through
+    fks = [f for f in through._meta.fields if f.rel is not None]
+    this = [f for f in fks if f.rel.to is model][0]
+    other = [f for f in fks if f is not this][0]
+    return through._meta.db_table, this.column, other.column
+
+
+def propose_indexes(filterset_class, model):
+    """
+    Returns a list of IndexProposals for the queries of filterset_class, used
+    with a QuerySet of model.
+    """
+    fs = filterset_class(model._default_manager.all(), QueryDict(''))
+    table = model._meta.db_table
+    proposals = []
+
+    def propose(table, columns, reason):
+        proposal = IndexProposal(table, columns, reason)
+        if proposal not in proposals:
+            proposals.append(proposal)
+
+    equality_columns = []
+    range_columns = []
+    for f in fs.filters:
+        hops = field_hops(model, f.field)
+        for hop_model, field, m2m in hops:
+            if m2m:
+                through_table, this, other = through_columns(field, hop_model)
+                propose(through_table, [other, this],
+                        "filtering %s by %s" % (f.field, other))
+        last_model, last_field, m2m = hops[-1]
+        if isinstance(last_field, RelatedObject) or m2m:
+            continue
+        propose(last_model._meta.db_table, [last_field.column],
+                "grouping and filtering by %s" % f.field)
+        if len(hops) == 1:
+            if (last_field.rel is not None or last_field.choices or
+                    isinstance(last_field, (models.BooleanField,
+                                            models.NullBooleanField))):
+                equality_columns.append(last_field.column)
+            elif last_field.get_internal_type() in RANGE_TYPES:
+                range_columns.append(last_field.column)
+    for eq in equality_columns:
+        for rng in range_columns:
+            propose(table, [eq, rng],
+                    "ranges of %s within a choice of %s" % (rng, eq))
+    # An index also serves for its leading columns.
+    return [p for p in proposals
+            if not any(other is not p and other.table == p.table and
+                       other.columns[:len(p.columns)] == p.columns
+                       for other in proposals)]
+
+
+def existing_indexes(connection, table):
+    """
+    Returns a list of the tuples of columns indexed on table.
+    """
+    cursor = connection.cursor()
+    try:
+        introspection = connection.introspection
+        if hasattr(introspection, 'get_constraints'):
+            return [tuple(c['columns'])
+                    for c in introspection.get_constraints(cursor,
+                                                           table).values()
+                    if (c.get('index') or c.get('unique') or
+                        c.get('primary_key')) and c['columns']]
+        return [(column,) for column in
+                introspection.get_indexes(cursor, table)]
+    finally:
+        cursor.close()
+
+
+def missing_indexes(connection, proposals):
+    """
+    Leaves out the proposals that are covered by an existing index.
+    """
+    existing = {}
+    out = []
+    for p in proposals:
+        if p.table not in existing:
+            existing[p.table] = existing_indexes(connection, p.table)
+        if not any(tuple(cols[:len(p.columns)]) == p.columns
+                   for cols in existing[p.table]):
+            out.append(p)
+    return out
+
+
+MIGRATION_TEMPLATE = '''\
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+%(dependencies)s
+    ]
+
+    operations = [
+%(operations)s
+    ]
+'''
+
+
+def migration_source(connection, proposals, dependencies):
+    """
+    Returns the source of a migration that creates the indexes, with
+    RunSQL operations so that it can be applied as is.
+    """
+    operations = []
+    for p in proposals:
+        operations.append('        # %s\n'
+                          '        migrations.RunSQL(\n'
+                          '            %r,\n'
+                          '            %r,\n'
+                          '        ),' % (p.reason,
+                                          str(p.create_sql(connection)),
+                                          str(p.drop_sql(connection))))
+    return MIGRATION_TEMPLATE % {
+        'dependencies': '\n'.join('        (%r, %r),' % (str(app), str(name))
+                                  for app, name in dependencies),
+        'operations': '\n'.join(operations),
+    }
+
+
+def benchmark(filterset_class, queryset, repeat=3):
+    """
+    Returns the best time, in seconds, of computing the choices of all the
+    filters, with nothing chosen and with the first choice of each filter
+    chosen in turn.
+    """
+    fs = filterset_class(queryset, QueryDict(''))
+    all_params = [QueryDict('')]
+    for f in fs.filters:
+        for choice in fs.get_filter_choices_uncached(f.field):
+            if choice.params is not None:
+                all_params.append(choice.params)
+                break
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        for params in all_params:
+            fs = filterset_class(queryset, params)
+            for f in fs.filters:
+                # Not from the shared cache, and not stored there.
+                fs.get_filter_choices_uncached(f.field)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
@@ -0,0 +1,538 @@
+"""
+Backends that compute the counts and values that filters need to build their
+choices.
+
+Filters never query for counts directly, but call the methods of their
+backend, so that a FilterSet can use a faster engine (in-memory indexes,
+precomputed rollups etc.) by setting its ``backend_class``, without any
+changes to the filter classes.
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+
+from django.db import connections
+from django.db import models
+from django.db.models.sql.datastructures import EmptyResultSet
+
+from .queries import conditional_counts
+from .queries import date_counts
+from .queries import numeric_range_counts
+from .queries import value_counts
+from .utils import LOOKUP_SEP
+from .utils import get_model_field
+from .utils import get_through_fields
+
+# The lookup types that filters use, and that in-memory indexes must support.
+LOOKUP_TYPES = ('exact', 'isnull', 'in', 'gt', 'gte', 'lt', 'lte')
+
+# The number of values counted by each query of SQLBackend.capped_counts,
+# which keeps the number of parameters within the limits of databases.
+CAPPED_COUNTS_BATCH_SIZE = 50
+
+
+def split_lookup(key, fields):
+    """
+    Splits a filter() keyword argument into one of fields and a lookup type,
+    returning (None, None) if it doesn't match any of the fields.
+    """
+    for f in fields:
+        if key == f:
+            return f, 'exact'
+        if key.startswith(f + LOOKUP_SEP):
+            lookup_type = key[len(f) + len(LOOKUP_SEP):]
+            if lookup_type in LOOKUP_TYPES:
+                return f, lookup_type
+    return None, None
+
+
+def queryset_sql(queryset):
+    """
+    Returns the SQL of queryset, for checking whether an index was built from
+    the same QuerySet, or None if it has no SQL.
+    """
+    try:
+        return str(queryset.query)
+    except Exception:
+        # e.g. EmptyResultSet
+        return None
+
+
+def chosen_lookups(filterset):
+    """
+    Yields the (key, value) filter() keyword arguments that the filters of
+    filterset apply to its QuerySet. The values chosen for a multiselect
+    filter are OR'd, so are yielded as one 'in' lookup; ValueError is raised
+    if they aren't all exact lookups of the field (e.g. NULL or a range).
+    """
+    for f in filterset.filters:
+        if f.multiselect and len(f.chosen) > 1:
+            lookups = [f.lookup_from_choice(choice) for choice in f.chosen]
+            if any(list(lookup.keys()) != [f.field] or lookup[f.field] is None
+                   for lookup in lookups):
+                raise ValueError("The choices of %s can't be combined into "
+                                 "one lookup" % f.field)
+            yield (f.field + LOOKUP_SEP + 'in',
+                   [lookup[f.field] for lookup in lookups])
+            continue
+        for choice in f.chosen:
+            for item in f.lookup_from_choice(choice).items():
+                yield item
+
+
+class FacetBackend(object):
+    """
+    The interface that filters use to get counts.
+
+    ``qs`` is always the QuerySet that the filter was asked for choices for
+    (normally ``FilterSet.qs``), and ``fieldname`` the filter's field.
+    """
+
+    def __init__(self, filterset=None):
+        # The FilterSet the backend is used for, if any.
+        self.filterset = filterset
+        # The database alias for facet queries, or None for that of the
+        # QuerySet.
+        self.using = (filterset.get_facet_using()
+                      if filterset is not None else None)
+
+    def route(self, qs):
+        """
+        Returns qs on the database that facet queries should use.
+        """
+        if self.using is None:
+            return qs
+        return qs.using(self.using)
+
+    def value_counts(self, qs, fieldname):
+        """
+        Returns an OrderedDict of {value: count}, sorted by value, with the
+        count of NULLs (if any) first, under the key None.
+        """
+        raise NotImplementedError()
+
+    def distinct_values(self, qs, fieldname):
+        """
+        Returns the list of distinct values (including None) sorted by value.
+        """
+        raise NotImplementedError()
+
+    def distinct_count(self, qs, fieldname):
+        """
+        Returns the number of distinct values, with NULL counting as one.
+        """
+        raise NotImplementedError()
+
+    def null_count(self, qs, fieldname):
+        raise NotImplementedError()
+
+    def value_range(self, qs, fieldname):
+        """
+        Returns a tuple (minimum, maximum) of the values, or (None, None).
+        """
+        raise NotImplementedError()
+
+    def numeric_range_counts(self, qs, fieldname, ranges):
+        """
+        Returns an OrderedDict of {range: count} for the list of ranges
+        (lower, upper), where the lower bound is exclusive apart from for the
+        first range, and the upper bound is inclusive.
+        """
+        raise NotImplementedError()
+
+    def date_counts(self, qs, fieldname, kind, limit=None):
+        """
+        Returns a list of (date, count), sorted by date, where kind is
+        'year', 'month' or 'day' and the dates are truncated accordingly.
+        If limit is given, only the first limit dates are returned.
+        """
+        raise NotImplementedError()
+
+    def date_bucket_counts(self, qs, fieldname, kind, first, bucketsize):
+        """
+        Returns a list of (bucket number, count), sorted by bucket number,
+        counting the dates in buckets of bucketsize years, months or days (as
+        kind), where the year, month or day first starts bucket 0. Buckets
+        with no dates are left out.
+        """
+        raise NotImplementedError()
+
+    def m2m_value_counts(self, qs, fieldname, exclude=()):
+        """
+        For a ManyToManyField, returns an OrderedDict of {related pk: count},
+        of the number of items in qs related to each object, leaving out the
+        related objects in exclude.
+        """
+        raise NotImplementedError()
+
+    def conditional_counts(self, qs, conditions):
+        """
+        Returns a list of counts for conditions, as defined by
+        queries.conditional_counts.
+        """
+        raise NotImplementedError()
+
+    def capped_counts(self, qs, fieldname, values, cap):
+        """
+        Returns an OrderedDict of {value: count} for the list of values (where
+        None stands for NULL), in the same order, leaving out values with no
+        items. Counts greater than cap are given as cap + 1, so that counting
+        can stop there.
+        """
+        raise NotImplementedError()
+
+    def related_objects(self, rel_model, fieldname, values):
+        """
+        Returns the instances of rel_model whose field fieldname has one of the
+        values, in the model's default ordering. This is used to get the
+        objects to display for ForeignKey and ManyToMany values.
+        """
+        raise NotImplementedError()
+
+    def capped_values(self, qs, fieldname, limit, exclude=()):
+        """
+        Returns a list of at most limit of the distinct values (including
+        None) of the field in qs, sorted by value with None first, leaving out
+        those in exclude, for counting with capped_counts. Which values are
+        returned when there are more is not defined. For ManyToMany fields,
+        the values are primary keys.
+        """
+        raise NotImplementedError()
+
+
+class SQLBackend(FacetBackend):
+    """
+    The default backend, which does aggregation queries using the Django ORM.
+    """
+
+    def value_counts(self, qs, fieldname):
+        return value_counts(self.route(qs), fieldname)
+
+    def distinct_values(self, qs, fieldname):
+        return [val for val, in self.route(qs).values_list(fieldname)
+                .order_by(fieldname).distinct()]
+
+    def distinct_count(self, qs, fieldname):
+        return self.route(qs).values_list(fieldname).distinct().count()
+
+    def null_count(self, qs, fieldname):
+        return self.route(qs).filter(**{fieldname + '__isnull': True}).count()
+
+    def value_range(self, qs, fieldname):
+        val_range = self.route(qs).aggregate(lower=models.Min(fieldname),
+                                             upper=models.Max(fieldname))
+        return val_range['lower'], val_range['upper']
+
+    def numeric_range_counts(self, qs, fieldname, ranges):
+        return numeric_range_counts(self.route(qs), fieldname, ranges)
+
+    def date_counts(self, qs, fieldname, kind, limit=None):
+        return date_counts(self.route(qs), fieldname, kind, limit=limit)
+
+    def date_bucket_counts(self, qs, fieldname, kind, first, bucketsize):
+        return date_counts(self.route(qs), fieldname, kind,
+                           buckets=(kind, first, bucketsize))
+
+    def m2m_value_counts(self, qs, fieldname, exclude=()):
+        qs = self.route(qs)
+        # It is easiest to base queries around the intermediate table, in order
+        # to get counts.
+        field_obj, m2m = get_model_field(qs.model, fieldname)
+        through, fkey_this, fkey_other = get_through_fields(field_obj,
+                                                            qs.model)
+
+        # We need to limit items by what is in the main QuerySet (which might
+        # already be filtered).
+        m2m_objs = through.objects.using(qs.db).filter(
+            **{fkey_this.name + '__in': qs})
+
+        # We need to exclude items in other table that we have already filtered
+        # on, because they are not interesting.
+        m2m_objs = m2m_objs.exclude(**{fkey_other.name + '__in': exclude})
+
+        # Now get counts:
+        return value_counts(m2m_objs, fkey_other.name)
+
+    def conditional_counts(self, qs, conditions):
+        return conditional_counts(self.route(qs), conditions)
+
+    def capped_counts(self, qs, fieldname, values, cap):
+        # Each value is counted by a subquery that fetches at most cap + 1
+        # rows, so no count scans more rows than that.
+        qs = self.route(qs)
+        connection = connections[qs.db]
+        counts = OrderedDict()
+        for start in range(0, len(values), CAPPED_COUNTS_BATCH_SIZE):
+            batch = values[start:start + CAPPED_COUNTS_BATCH_SIZE]
+            selects = []
+            params = []
+            for i, val in enumerate(batch):
+                if val is None:
+                    lookup = {fieldname + '__isnull': True}
+                else:
+                    lookup = {fieldname: val}
+                subquery = (qs.filter(**lookup).order_by()
+                            .values_list('pk')[:cap + 1])
+                try:
+                    sql, sub_params = subquery.query.get_compiler(
+                        connection=connection).as_sql()
+                except EmptyResultSet:
+                    selects.append('0')
+                    continue
+                selects.append('(SELECT COUNT(*) FROM (%s) capped_%d)' %
+                               (sql, i))
+                params.extend(sub_params)
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT ' + ', '.join(selects), params)
+                row = cursor.fetchone()
+            finally:
+                cursor.close()
+            for val, count in zip(batch, row):
+                if count:
+                    counts[val] = count
+        return counts
+
+    def related_objects(self, rel_model, fieldname, values):
+        return list(rel_model.objects.using(self.using)
+                    .filter(**{fieldname + '__in': values}))
+
+    def capped_values(self, qs, fieldname, limit, exclude=()):
+        qs = self.route(qs)
+        field_obj, m2m = get_model_field(qs.model, fieldname)
+        if m2m:
+            # From the intermediate table, as for m2m_value_counts.
+            through, fkey_this, fkey_other = get_through_fields(field_obj,
+                                                                qs.model)
+            values = (through.objects.using(qs.db)
+                      .filter(**{fkey_this.name + '__in': qs})
+                      .exclude(**{fkey_other.name + '__in': exclude})
+                      .values_list(fkey_other.name, flat=True))
+        else:
+            values = qs.values_list(fieldname, flat=True)
+            if exclude:
+                values = values.exclude(**{fieldname + '__in': exclude})
+        # Without an ORDER BY, the database can stop once it has enough, so
+        # they are sorted here instead.
+        return sorted(values.order_by().distinct()[:limit],
+                      key=lambda val: (val is not None, val))
+
+
+class IndexBackend(SQLBackend):
+    """
+    Base class for backends that compute counts from an in-memory index of the
+    FilterSet's QuerySet.
+
+    If the FilterSet is used with a QuerySet other than the one indexed, or
+    some of the chosen filters (or the field being counted) aren't in the
+    index, it falls back to SQL.
+
+    Subclasses implement get_index, which returns an object with the following
+    methods, where 'rows' is some representation of a set of rows that
+    supports '&':
+
+    * covers(qs): True if the index has the same rows as the QuerySet qs
+    * all_rows(): all the rows in the index
+    * lookup(key, value): the rows matching the filter() keyword argument, or
+      None if that can't be answered from the index
+    * has_field(fieldname)
+    * counts(fieldname, rows): a list of (value, count), sorted by value with
+      NULL first, leaving out values with no rows, or None to use SQL
+    * count(rows)
+    * get_related_objects(rel_model): a list of all instances of rel_model in
+      default order, or None
+    """
+
+    def __init__(self, filterset=None):
+        super(IndexBackend, self).__init__(filterset)
+        self.index = self.get_index()
+        self._rows = (None, None)
+
+    def get_index(self):
+        raise NotImplementedError()
+
+    def get_rows(self, qs):
+        """
+        Returns the rows of the index that are in qs, or None.
+        """
+        fs = self.filterset
+        if self.index is None or fs is None or qs is not fs.qs:
+            return None
+        cached_qs, rows = self._rows
+        if cached_qs is qs:
+            return rows
+        rows = None
+        if self.index.covers(fs.base_qs):
+            rows = self.index.all_rows()
+            try:
+                for key, value in chosen_lookups(fs):
+                    matching = self.index.lookup(key, value)
+                    if matching is None:
+                        rows = None
+                        break
+                    rows = rows & matching
+            except ValueError:
+                # The chosen lookups can't be combined in the index.
+                rows = None
+        self._rows = (qs, rows)
+        return rows
+
+    def get_counts(self, qs, fieldname):
+        rows = self.get_rows(qs)
+        if rows is None or not self.index.has_field(fieldname):
+            return None
+        return self.index.counts(fieldname, rows)
+
+    def value_counts(self, qs, fieldname):
+        counts = self.get_counts(qs, fieldname)
+        if counts is None:
+            return super(IndexBackend, self).value_counts(qs, fieldname)
+        return OrderedDict(counts)
+
+    def distinct_values(self, qs, fieldname):
+        counts = self.get_counts(qs, fieldname)
+        if counts is None:
+            return super(IndexBackend, self).distinct_values(qs, fieldname)
+        return [val for val, count in counts]
+
+    def distinct_count(self, qs, fieldname):
+        counts = self.get_counts(qs, fieldname)
+        if counts is None:
+            return super(IndexBackend, self).distinct_count(qs, fieldname)
+        return len(counts)
+
+    def null_count(self, qs, fieldname):
+        counts = self.get_counts(qs, fieldname)
+        if counts is None:
+            return super(IndexBackend, self).null_count(qs, fieldname)
+        return dict(counts).get(None, 0)
+
+    def value_range(self, qs, fieldname):
+        counts = self.get_counts(qs, fieldname)
+        if counts is None:
+            return super(IndexBackend, self).value_range(qs, fieldname)
+        values = [val for val, count in counts if val is not None]
+        if not values:
+            return None, None
+        return values[0], values[-1]
+
+    def numeric_range_counts(self, qs, fieldname, ranges):
+        counts = self.get_counts(qs, fieldname)
+        if counts is None:
+            return super(IndexBackend, self).numeric_range_counts(
+                qs, fieldname, ranges)
+        count_dict = OrderedDict()
+        for i, r in enumerate(ranges):
+            count = sum(count for val, count in counts
+                        if val is not None and
+                        (r[0] < val or (i == 0 and r[0] == val)) and
+                        val <= r[1])
+            if count:
+                count_dict[r] = count
+        return count_dict
+
+    def date_counts(self, qs, fieldname, kind, limit=None):
+        counts = self.get_counts(qs, fieldname)
+        if counts is None:
+            return super(IndexBackend, self).date_counts(qs, fieldname, kind,
+                                                         limit=limit)
+        buckets = OrderedDict()
+        for val, count in counts:
+            if val is None:
+                continue
+            dt = truncate_date(val, kind)
+            buckets[dt] = buckets.get(dt, 0) + count
+        return list(buckets.items())[:limit]
+
+    def date_bucket_counts(self, qs, fieldname, kind, first, bucketsize):
+        counts = self.get_counts(qs, fieldname)
+        if counts is None:
+            return super(IndexBackend, self).date_bucket_counts(
+                qs, fieldname, kind, first, bucketsize)
+        buckets = OrderedDict()
+        for val, count in counts:
+            if val is None:
+                continue
+            bucketnum = (getattr(val, kind) - first) // bucketsize
+            buckets[bucketnum] = buckets.get(bucketnum, 0) + count
+        return list(buckets.items())
+
+    def m2m_value_counts(self, qs, fieldname, exclude=()):
+        counts = self.get_counts(qs, fieldname)
+        if counts is None:
+            return super(IndexBackend, self).m2m_value_counts(
+                qs, fieldname, exclude=exclude)
+        exclude = [getattr(obj, 'pk', obj) for obj in exclude]
+        return OrderedDict((val, count) for val, count in counts
+                           if val is not None and val not in exclude)
+
+    def conditional_counts(self, qs, conditions):
+        rows = self.get_rows(qs)
+        if rows is None or any(len(c) > 3 or
+                               (c[0] is not None and
+                                not self.index.has_field(c[0]))
+                               for c in conditions):
+            return super(IndexBackend, self).conditional_counts(qs,
+                                                                conditions)
+        out = []
+        for fieldname, lookup_type, value in conditions:
+            if fieldname is None:
+                out.append(self.index.count(rows))
+                continue
+            counts = self.index.counts(fieldname, rows)
+            if lookup_type == 'distinct':
+                out.append(len([val for val, count in counts
+                                if val is not None]))
+            elif lookup_type == 'exact':
+                out.append(dict(counts).get(value, 0))
+            else:
+                lower, upper, lower_inclusive = value
+                out.append(sum(count for val, count in counts
+                               if val is not None and
+                               (lower < val or
+                                (lower_inclusive and lower == val)) and
+                               val <= upper))
+        return out
+
+    def capped_counts(self, qs, fieldname, values, cap):
+        counts = self.get_counts(qs, fieldname)
+        if counts is None:
+            return super(IndexBackend, self).capped_counts(qs, fieldname,
+                                                           values, cap)
+        counts = dict(counts)
+        return OrderedDict((val, min(counts[val], cap + 1)) for val in values
+                           if counts.get(val))
+
+    def related_objects(self, rel_model, fieldname, values):
+        objs = (self.index.get_related_objects(rel_model)
+                if self.index is not None else None)
+        if objs is None:
+            return super(IndexBackend, self).related_objects(
+                rel_model, fieldname, values)
+        if fieldname == 'pk':
+            attname = 'pk'
+        else:
+            attname = rel_model._meta.get_field(fieldname).attname
+        values = set(values)
+        return [obj for obj in objs if getattr(obj, attname) in values]
+
+    def capped_values(self, qs, fieldname, limit, exclude=()):
+        counts = self.get_counts(qs, fieldname)
+        if counts is None:
+            return super(IndexBackend, self).capped_values(
+                qs, fieldname, limit, exclude=exclude)
+        exclude = [getattr(obj, 'pk', obj) for obj in exclude]
+        return [val for val, count in counts if val not in exclude][:limit]
+
+
+def truncate_date(value, kind):
+    """
+    Truncates a date or datetime to the 'year', 'month' or 'day', returning a
+    datetime as the SQL date aggregation does.
+    """
+    if kind == 'year':
+        return datetime(value.year, 1, 1)
+    elif kind == 'month':
+        return datetime(value.year, value.month, 1)
+    else:
+        return datetime(value.year, value.month, value.day)
@@ -0,0 +1,283 @@
+"""
+An in-memory bitmap index, and a backend that uses it to compute the counts
+for a FilterSet without querying the database.
+
+This is intended for data that is read a lot more than it changes. The index
+keeps one bitmap per (field, value), where bit N is set if the Nth row has that
+value. The rows matching the chosen filters are then found by intersecting
+bitmaps, and the count for a value by counting the bits of the intersection
+with that value's bitmap.
+
+Bitmaps are plain Python integers, which are arbitrary length bitsets, so no
+extra dependencies are needed. They are not compressed, so each bitmap takes
+up to one bit per row of the index. To bound this, fields with more than
+max_values distinct values are not indexed, and are counted with SQL instead.
+"""
+
+import threading
+from datetime import date
+from datetime import datetime
+from datetime import time
+
+from django.db.models import signals
+
+from .backends import IndexBackend
+from .backends import queryset_sql
+from .backends import split_lookup
+from .utils import LOOKUP_SEP
+from .utils import get_model_field
+
+
+def popcount(bitmap):
+    return bin(bitmap).count('1')
+
+
+def _comparable(value, other):
+    # Dates in lookups need converting to be compared with datetimes.
+    if (isinstance(other, datetime) and isinstance(value, date)
+            and not isinstance(value, datetime)):
+        return datetime.combine(value, time())
+    return value
+
+
+def _sort_key(value):
+    # NULLs first, like value_counts.
+    return (value is not None, value)
+
+
+LOOKUP_TESTS = {
+    'gt': lambda val, arg: val > arg,
+    'gte': lambda val, arg: val >= arg,
+    'lt': lambda val, arg: val < arg,
+    'lte': lambda val, arg: val <= arg,
+}
+
+
+class BitmapIndex(object):
+    """
+    Bitmap index over the fields of the objects in queryset.
+
+    fields can include ForeignKey and ManyToMany fields, and paths across
+    relations (e.g. 'genre__likes'). Call connect() to keep the index up to
+    date with saves and deletes of the model (and changes to its ManyToMany
+    fields). Changes to related objects are not tracked - call build() to
+    rebuild the index from scratch.
+
+    A field that has (or comes to have) more than max_values distinct values
+    is left out of the index, since its bitmaps would be mostly empty, and
+    has_field() is then False for it.
+    """
+
+    def __init__(self, queryset, fields, max_values=256):
+        self.queryset = queryset
+        self.model = queryset.model
+        self.fields = list(fields)
+        self.max_values = max_values
+        self.lock = threading.RLock()
+        self.build()
+
+    def build(self):
+        with self.lock:
+            self.queryset_sql = queryset_sql(self.queryset)
+            self.rows = {}     # pk: row number
+            self.all = 0       # bitmap of all the rows
+            self.bitmaps = dict((f, {}) for f in self.fields)
+            for pk in self.queryset.values_list('pk', flat=True):
+                self.add_row(pk)
+            for f in self.fields:
+                for pk, val in self.queryset.values_list('pk', f).iterator():
+                    self.set_bit(f, val, self.rows[pk])
+                    if not self.has_field(f):
+                        break
+            self.build_related_objects()
+
+    def build_related_objects(self):
+        # Related objects are kept as well, so that they can be displayed
+        # without querying.
+        self.related = {}
+        for f in self.bitmaps:
+            field_obj, m2m = get_model_field(self.model, f)
+            if field_obj.rel is not None:
+                rel_model = field_obj.rel.to
+                if rel_model not in self.related:
+                    self.related[rel_model] = list(rel_model.objects.all())
+
+    def covers(self, queryset):
+        """
+        Returns True if the index has the same rows as queryset.
+        """
+        return (queryset.model is self.model and
+                queryset_sql(queryset) == self.queryset_sql)
+
+    def add_row(self, pk):
+        row = self.rows.get(pk)
+        if row is None:
+            row = self.rows[pk] = len(self.rows)
+        self.all |= 1 << row
+        return row
+
+    def set_bit(self, field, value, row):
+        bitmaps = self.bitmaps.get(field)
+        if bitmaps is None:
+            return
+        bitmaps[value] = bitmaps.get(value, 0) | (1 << row)
+        if len(bitmaps) > self.max_values:
+            del self.bitmaps[field]
+
+    def clear_row(self, row):
+        mask = ~(1 << row)
+        self.all &= mask
+        for bitmaps in self.bitmaps.values():
+            for value in list(bitmaps):
+                bitmaps[value] &= mask
+                if not bitmaps[value]:
+                    del bitmaps[value]
+
+    def update(self, pks):
+        """
+        Updates the rows for the objects with primary keys pks from the
+        database.
+        """
+        pks = list(pks)
+        with self.lock:
+            for pk in pks:
+                if pk in self.rows:
+                    self.clear_row(self.rows[pk])
+            qs = self.queryset.filter(pk__in=pks)
+            for pk in qs.values_list('pk', flat=True):
+                self.add_row(pk)
+            for f in self.fields:
+                for pk, val in qs.values_list('pk', f):
+                    self.set_bit(f, val, self.rows[pk])
+
+    def remove(self, pk):
+        with self.lock:
+            row = self.rows.get(pk)
+            if row is not None:
+                self.clear_row(row)
+
+    # Signal handling
+
+    def connect(self):
+        uid = 'easyfilters-bitmapindex-%d' % id(self)
+        signals.post_save.connect(self.handle_save, sender=self.model,
+                                  weak=False, dispatch_uid=uid)
+        signals.post_delete.connect(self.handle_delete, sender=self.model,
+                                    weak=False, dispatch_uid=uid)
+        for through in self.get_throughs():
+            signals.m2m_changed.connect(self.handle_m2m_changed, sender=through,
+                                        weak=False, dispatch_uid=uid)
+
+    def disconnect(self):
+        uid = 'easyfilters-bitmapindex-%d' % id(self)
+        signals.post_save.disconnect(sender=self.model, dispatch_uid=uid)
+        signals.post_delete.disconnect(sender=self.model, dispatch_uid=uid)
+        for through in self.get_throughs():
+            signals.m2m_changed.disconnect(sender=through, dispatch_uid=uid)
+
+    def get_throughs(self):
+        throughs = []
+        for f in self.fields:
+            field_obj, m2m = get_model_field(self.model, f)
+            if m2m and LOOKUP_SEP not in f:
+                throughs.append(field_obj.rel.through)
+        return throughs
+
+    def handle_save(self, sender, instance, **kwargs):
+        self.update([instance.pk])
+
+    def handle_delete(self, sender, instance, **kwargs):
+        self.remove(instance.pk)
+
+    def handle_m2m_changed(self, sender, instance, action, reverse, pk_set,
+                           **kwargs):
+        if not action.startswith('post_'):
+            return
+        if not reverse:
+            self.update([instance.pk])
+        elif pk_set is not None:
+            self.update(pk_set)
+        else:
+            # Reverse clear, we don't know which rows were affected.
+            self.build()
+
+    # Queries
+
+    def has_field(self, field):
+        return field in self.bitmaps
+
+    def all_rows(self):
+        return self.all
+
+    def lookup(self, key, value):
+        """
+        Returns the bitmap of rows matching a filter() keyword argument, or
+        None if it can't be answered from the index.
+        """
+        field, lookup_type = split_lookup(key, self.fields)
+        if field is None:
+            return None
+        with self.lock:
+            bitmaps = self.bitmaps.get(field)
+            if bitmaps is None:
+                # Not indexed, see max_values.
+                return None
+            if lookup_type == 'isnull':
+                nulls = bitmaps.get(None, 0)
+                return nulls if value else self.all & ~nulls
+            if lookup_type == 'in':
+                values = [getattr(v, 'pk', v) for v in value]
+                return self.union(bitmaps, lambda val: val in values)
+            if lookup_type == 'exact':
+                return bitmaps.get(getattr(value, 'pk', value), 0)
+            test = LOOKUP_TESTS[lookup_type]
+            return self.union(bitmaps,
+                              lambda val: (val is not None and
+                                           test(val, _comparable(value, val))))
+
+    def union(self, bitmaps, test):
+        result = 0
+        for val, bitmap in bitmaps.items():
+            if test(val):
+                result |= bitmap
+        return result
+
+    def counts(self, field, mask):
+        """
+        Returns a list of (value, count) for the rows in mask, sorted by value,
+        leaving out values with no rows.
+        """
+        out = []
+        with self.lock:
+            bitmaps = self.bitmaps.get(field)
+            if bitmaps is None:
+                # Left out of the index (see max_values) since it was checked.
+                return None
+            for val, bitmap in bitmaps.items():
+                count = popcount(bitmap & mask)
+                if count:
+                    out.append((val, count))
+        out.sort(key=lambda item: _sort_key(item[0]))
+        return out
+
+    def count(self, mask):
+        return popcount(mask)
+
+    def get_related_objects(self, rel_model):
+        return self.related.get(rel_model)
+
+
+class BitmapBackend(IndexBackend):
+    """
+    Backend that computes counts from a BitmapIndex, given as the
+    'bitmap_index' attribute of the FilterSet.
+    """
+
+    def __init__(self, filterset=None, index=None):
+        self._index = index
+        super(BitmapBackend, self).__init__(filterset)
+
+    def get_index(self):
+        if self._index is not None:
+            return self._index
+        return getattr(self.filterset, 'bitmap_index', None)
@@ -0,0 +1,158 @@
+"""
+Caching of the choices of FilterSets (and optionally their rendered HTML)
+across requests, and warming the cache from a list of popular query strings
+(see the easyfilters_warm_cache management command).
+
+Cache keys are made from the FilterSet class, a hash of the SQL of the base
+QuerySet, and the query string in a canonical order, so that the same choices
+are found whatever order the parameters come in.
+
+Entries are stored with the time they go stale (see
+FilterSet.cache_soft_timeout). Stale entries are still served, while the
+Revalidator recomputes them in a background thread.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import threading
+import time
+from logging import getLogger
+
+from django.db import connections
+from django.http import QueryDict
+from django.utils.http import urlquote
+from six.moves import queue
+
+from .backends import queryset_sql
+
+try:
+    from django.core.cache import caches
+
+    def get_cache(alias):
+        return caches[alias]
+except ImportError:  # Django < 1.7
+    from django.core.cache import get_cache  # noqa
+
+logger = getLogger(__name__)
+
+
+def canonical_query_string(params, ignore=()):
+    """
+    Returns params as a query string with the keys sorted, leaving out those
+    in ignore. The order of the values of each key is kept, since filters
+    can depend on it.
+    """
+    return '&'.join('%s=%s' % (urlquote(key, safe=''), urlquote(val, safe=''))
+                    for key in sorted(params) if key not in ignore
+                    for val in params.getlist(key))
+
+
+def get_cache_key(filterset, filter_field, kind):
+    """
+    Returns the cache key for the choices ('choices') or HTML ('html') of a
+    filter of filterset.
+    """
+    cls = filterset.__class__
+    raw = '\n'.join(['%s.%s' % (cls.__module__, cls.__name__),
+                     queryset_sql(filterset.base_qs) or '',
+                     filterset.get_canonical_query_string(),
+                     filter_field])
+    return 'easyfilters:%s:%s' % (kind,
+                                  hashlib.md5(raw.encode('utf-8')).hexdigest())
+
+
+class Revalidator(object):
+    """
+    Runs the functions that recompute stale cache entries, one at a time, in a
+    background thread. A key that is waiting or being recomputed is not
+    scheduled again.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def schedule(self, key, func):
+        """
+        Schedules func() to recompute the entry for key, returning False if
+        it is already scheduled.
+        """
+        with self.lock:
+            if key in self.pending:
+                return False
+            self.pending.add(key)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.work)
+                self.thread.daemon = True
+                self.thread.start()
+        self.queue.put((key, func))
+        return True
+
+    def work(self):
+        while True:
+            key, func = self.queue.get()
+            try:
+                func()
+            except Exception:
+                logger.exception("Recomputing cache entry %s failed", key)
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+                # The thread's DB connections must not be left open between
+                # entries.
+                for conn in connections.all():
+                    conn.close()
+                self.queue.task_done()
+
+    def join(self):
+        """
+        Waits until the scheduled entries have all been recomputed.
+        """
+        self.queue.join()
+
+
+# Shared by all FilterSets, so there is one thread per process.
+revalidator = Revalidator()
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls to wait() so that there are at most rate per second.
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = 0
+
+    def wait(self):
+        now = time.time()
+        if now < self.next_time:
+            time.sleep(self.next_time - now)
+            now = self.next_time
+        self.next_time = now + self.interval
+
+
+def warm(filterset_class, queryset, query_strings, html=False, rate=None):
+    """
+    Computes the choices of all the filters for each query string, storing
+    them in the cache, and the rendered HTML too if html is True. At most rate
+    query strings are done per second. Returns the number done.
+    """
+    if filterset_class.cache_timeout is None:
+        raise ValueError("%s.cache_timeout is not set" %
+                         filterset_class.__name__)
+    limiter = RateLimiter(rate)
+    done = 0
+    for query_string in query_strings:
+        limiter.wait()
+        fs = filterset_class(queryset, QueryDict(query_string))
+        for f in fs.filters:
+            if html:
+                fs.render_filter(f)
+            else:
+                fs.get_filter_choices(f.field)
+        done += 1
+    return done
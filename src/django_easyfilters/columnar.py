@@ -0,0 +1,261 @@
+"""
+A columnar snapshot of a QuerySet held in NumPy arrays, and a backend that
+uses it to compute the counts for a FilterSet without querying the database.
+
+Each field is stored as an array of integer codes, one per row, where the code
+is the position of the row's value in the sorted list of distinct values of
+that field, and NULL is -1. Because the codes are in value order, the lookups
+that filters use (exact, in, isnull, gt, gte, lt, lte) become vectorized
+comparisons on the codes, and counts become a single bincount.
+
+The snapshot is not updated when objects change, but is reloaded from the
+database when it is older than max_age. This is intended for dashboards over
+data that is read a lot more than it changes.
+
+NumPy is an optional dependency, only needed if this module is used.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .backends import IndexBackend
+from .backends import queryset_sql
+from .backends import split_lookup
+from .backends import truncate_date
+from .bitmaps import _comparable
+from .utils import get_model_field
+
+
+class Columns(object):
+    """
+    The arrays loaded by a ColumnarSnapshot. These are never changed once
+    loaded, so can be shared between threads.
+    """
+
+    def __init__(self, queryset, fields):
+        self.model = queryset.model
+        self.queryset_sql = queryset_sql(queryset)
+        pks = list(queryset.values_list('pk', flat=True).order_by('pk'))
+        self.size = len(pks)
+        self.fields = []
+        self.values = {}   # field: sorted list of distinct non-NULL values
+        self.codes = {}    # field: array of the code of each row
+        self._date_buckets = {}
+        for f in fields:
+            rows = list(queryset.values_list('pk', f).order_by('pk'))
+            if [pk for pk, val in rows] != pks:
+                # Multi-valued (e.g. ManyToMany), which can't be stored as a
+                # column, so counts for this field fall back to SQL.
+                continue
+            values = sorted(set(val for pk, val in rows if val is not None))
+            positions = dict((val, i) for i, val in enumerate(values))
+            self.fields.append(f)
+            self.values[f] = values
+            self.codes[f] = numpy.array(
+                [-1 if val is None else positions[val] for pk, val in rows],
+                dtype=numpy.int32)
+        self.load_related_objects()
+
+    def load_related_objects(self):
+        self.related = {}
+        for f in self.fields:
+            field_obj, m2m = get_model_field(self.model, f)
+            if field_obj.rel is not None:
+                rel_model = field_obj.rel.to
+                if rel_model not in self.related:
+                    self.related[rel_model] = list(rel_model.objects.all())
+
+    def covers(self, queryset):
+        return (queryset.model is self.model and
+                queryset_sql(queryset) == self.queryset_sql)
+
+    def has_field(self, field):
+        return field in self.codes
+
+    def all_rows(self):
+        return numpy.ones(self.size, dtype=bool)
+
+    def no_rows(self):
+        return numpy.zeros(self.size, dtype=bool)
+
+    def code_of(self, field, value):
+        """
+        Returns the code of value in field, or None if no row has the value.
+        """
+        values = self.values[field]
+        i = bisect_left(values, value)
+        if i < len(values) and values[i] == value:
+            return i
+        return None
+
+    def lookup(self, key, value):
+        """
+        Returns a boolean array of the rows matching a filter() keyword
+        argument, or None if it can't be answered from the snapshot.
+        """
+        field, lookup_type = split_lookup(key, self.fields)
+        if field is None:
+            return None
+        codes = self.codes[field]
+        values = self.values[field]
+        if lookup_type == 'isnull':
+            return codes == -1 if value else codes != -1
+        if lookup_type == 'in':
+            found = [self.code_of(field, getattr(v, 'pk', v)) for v in value]
+            return numpy.in1d(codes, [c for c in found if c is not None])
+        if lookup_type == 'exact':
+            if value is None:
+                return codes == -1
+            code = self.code_of(field, getattr(value, 'pk', value))
+            return self.no_rows() if code is None else codes == code
+        if not values:
+            return self.no_rows()
+        value = _comparable(value, values[0])
+        if lookup_type == 'gt':
+            return codes >= bisect_right(values, value)
+        if lookup_type == 'gte':
+            return codes >= bisect_left(values, value)
+        # NULLs are -1, so need excluding from less-than comparisons.
+        if lookup_type == 'lt':
+            return (codes >= 0) & (codes < bisect_left(values, value))
+        return (codes >= 0) & (codes < bisect_right(values, value))
+
+    def value_histogram(self, field, rows):
+        """
+        Returns an array of the count of each code for the rows, with the count
+        of NULLs first.
+        """
+        return numpy.bincount(self.codes[field][rows] + 1,
+                              minlength=len(self.values[field]) + 1)
+
+    def counts(self, field, rows):
+        histogram = self.value_histogram(field, rows)
+        return [(val, int(count))
+                for val, count in zip([None] + self.values[field], histogram)
+                if count]
+
+    def count(self, rows):
+        return int(numpy.count_nonzero(rows))
+
+    def get_related_objects(self, rel_model):
+        return self.related.get(rel_model)
+
+    def date_buckets(self, field, kind):
+        """
+        Returns (dates, bucket), where dates is the sorted list of the
+        truncated dates of field, and bucket an array mapping each code to the
+        index of its date.
+        """
+        key = (field, kind)
+        if key not in self._date_buckets:
+            truncated = [truncate_date(val, kind)
+                         for val in self.values[field]]
+            dates = sorted(set(truncated))
+            positions = dict((dt, i) for i, dt in enumerate(dates))
+            bucket = numpy.array([positions[dt] for dt in truncated],
+                                 dtype=numpy.int32)
+            self._date_buckets[key] = (dates, bucket)
+        return self._date_buckets[key]
+
+
+class ColumnarSnapshot(object):
+    """
+    Snapshot of the values of fields for the objects in queryset.
+
+    fields can include ForeignKey fields and paths across relations, but
+    ManyToMany fields (or paths across them) are not loaded. The snapshot is
+    reloaded when it is more than max_age seconds old, or if refresh() is
+    called. If max_age is None, it is only loaded once.
+    """
+
+    def __init__(self, queryset, fields, max_age=None):
+        if numpy is None:
+            raise ImportError("ColumnarSnapshot requires NumPy")
+        self.queryset = queryset
+        self.fields = list(fields)
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        columns = Columns(self.queryset, self.fields)
+        # Swapping in a complete set of columns means readers never see a
+        # partially loaded snapshot.
+        self.columns, self.loaded_at = columns, time.time()
+
+    def get(self):
+        """
+        Returns the current Columns, reloading them first if they are stale.
+        """
+        if (self.max_age is not None and
+                time.time() - self.loaded_at >= self.max_age):
+            with self.lock:
+                # Another thread may have reloaded while we waited.
+                if time.time() - self.loaded_at >= self.max_age:
+                    self.refresh()
+        return self.columns
+
+
+class ColumnarBackend(IndexBackend):
+    """
+    Backend that computes counts from a ColumnarSnapshot, given as the
+    'columnar_snapshot' attribute of the FilterSet.
+    """
+
+    def __init__(self, filterset=None, snapshot=None):
+        self._snapshot = snapshot
+        super(ColumnarBackend, self).__init__(filterset)
+
+    def get_index(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = getattr(self.filterset, 'columnar_snapshot', None)
+        if snapshot is None:
+            return None
+        # The same Columns are used for the whole request, even if the
+        # snapshot is reloaded meanwhile.
+        return snapshot.get()
+
+    def get_histogram(self, qs, fieldname):
+        rows = self.get_rows(qs)
+        if rows is None or not self.index.has_field(fieldname):
+            return None
+        return self.index.value_histogram(fieldname, rows)
+
+    def numeric_range_counts(self, qs, fieldname, ranges):
+        histogram = self.get_histogram(qs, fieldname)
+        if histogram is None or not ranges:
+            return super(ColumnarBackend, self).numeric_range_counts(
+                qs, fieldname, ranges)
+        # cumulative[i] is the number of rows with a code less than i.
+        cumulative = numpy.concatenate([[0], numpy.cumsum(histogram[1:])])
+        values = numpy.array(self.index.values[fieldname], dtype=object)
+        # Lower bounds are exclusive, apart from for the first range.
+        lowers = numpy.searchsorted(values, [r[0] for r in ranges],
+                                    side='right')
+        lowers[0] = numpy.searchsorted(values, ranges[0][0], side='left')
+        uppers = numpy.searchsorted(values, [r[1] for r in ranges],
+                                    side='right')
+        counts = cumulative[uppers] - cumulative[lowers]
+        return OrderedDict((r, int(count))
+                           for r, count in zip(ranges, counts) if count > 0)
+
+    def date_counts(self, qs, fieldname, kind, limit=None):
+        rows = self.get_rows(qs)
+        if rows is None or not self.index.has_field(fieldname):
+            return super(ColumnarBackend, self).date_counts(qs, fieldname,
+                                                            kind, limit=limit)
+        dates, bucket = self.index.date_buckets(fieldname, kind)
+        codes = self.index.codes[fieldname][rows]
+        counts = numpy.bincount(bucket[codes[codes >= 0]],
+                                minlength=len(dates))
+        return [(dt, int(count))
+                for dt, count in zip(dates, counts) if count][:limit]
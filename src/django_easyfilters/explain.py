@@ -0,0 +1,224 @@
+"""
+Query plan diagnostics for FilterSets (see FilterSet.explain).
+
+The queries that a FilterSet does are recorded, and the database's EXPLAIN is
+run on each of them. The plans are then checked for full table scans,
+temporary B-trees and sorts, which usually mean an index is missing.
+"""
+
+import re
+
+import six
+
+from .utils import python_2_unicode_compatible
+
+
+class RecordingCursor(object):
+    """
+    Wraps a cursor, recording the SQL and parameters of each query.
+    """
+
+    def __init__(self, cursor, recorder, alias):
+        self.cursor = cursor
+        self.recorder = recorder
+        self.alias = alias
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def execute(self, sql, params=None):
+        self.recorder.record(self.alias, sql, params)
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.recorder.record(self.alias, sql, None)
+        return self.cursor.executemany(sql, param_list)
+
+
+class QueryRecorder(object):
+    """
+    Context manager that records the queries done on one or more connections,
+    as a list of (sql, params) in the 'queries' attribute, and the alias of
+    the connection of each in the 'aliases' attribute.
+    """
+
+    def __init__(self, *connections):
+        self.connections = []
+        for conn in connections:
+            if conn not in self.connections:
+                self.connections.append(conn)
+        self.queries = []
+        self.aliases = []
+
+    def record(self, alias, sql, params):
+        self.queries.append((sql, params))
+        self.aliases.append(alias)
+
+    def __enter__(self):
+        self.saved = []
+        for conn in self.connections:
+            # The name of the flag that forces debug cursors depends on the
+            # Django version.
+            if hasattr(conn, 'force_debug_cursor'):
+                flag = 'force_debug_cursor'
+            else:
+                flag = 'use_debug_cursor'
+            self.saved.append((conn, flag, getattr(conn, flag)))
+            setattr(conn, flag, True)
+            conn.make_debug_cursor = self.wrap(conn)
+        return self
+
+    def wrap(self, conn):
+        make_debug_cursor = conn.make_debug_cursor
+        return lambda cursor: RecordingCursor(make_debug_cursor(cursor), self,
+                                              conn.alias)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for conn, flag, saved_flag in self.saved:
+            del conn.make_debug_cursor
+            setattr(conn, flag, saved_flag)
+
+
+@python_2_unicode_compatible
+class QueryPlan(object):
+    """
+    The plan for a query, and the problems found in it.
+    """
+
+    def __init__(self, sql, params, plan, full_scans, temp_btrees, sorts,
+                 cost=None, rows=None):
+        self.sql = sql
+        self.params = params
+        self.plan = plan                # Lines of the plan
+        self.full_scans = full_scans    # Plan lines that scan a whole table
+        self.temp_btrees = temp_btrees  # Plan lines that build a temp B-tree
+        self.sorts = sorts              # Plan lines that sort
+        self.cost = cost                # Estimated cost, if the DB gives one
+        self.rows = rows                # Estimated rows, if the DB gives them
+
+    def is_flagged(self):
+        return bool(self.full_scans or self.temp_btrees or self.sorts)
+
+    def __str__(self):
+        lines = [self.sql]
+        if self.cost is not None:
+            lines.append("  cost: %s" % self.cost)
+        for label, items in [("full scan", self.full_scans),
+                             ("temp b-tree", self.temp_btrees),
+                             ("sort", self.sorts)]:
+            for item in items:
+                lines.append("  %s: %s" % (label, item))
+        return u"\n".join(lines)
+
+
+@python_2_unicode_compatible
+class ExplainReport(object):
+    """
+    The query plans for a FilterSet. 'entries' is a list of (name, plans),
+    where name is 'qs' for the main QuerySet, 'conditional counts' for the
+    query shared by filters with known values, or the field of a filter.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def get_plans(self, name):
+        return dict(self.entries)[name]
+
+    def flagged(self):
+        """
+        Returns a list of (name, plan) for the plans with problems.
+        """
+        return [(name, plan) for name, plans in self.entries
+                for plan in plans if plan.is_flagged()]
+
+    def __str__(self):
+        out = []
+        for name, plans in self.entries:
+            out.append(u"%s: %d queries" % (name, len(plans)))
+            for plan in plans:
+                out.append(u"  " + six.text_type(plan).replace(u"\n", u"\n  "))
+        return u"\n".join(out)
+
+
+def explain_sqlite(cursor, sql, params):
+    cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+    # The detail is the last column, in all versions of SQLite.
+    plan = [six.text_type(row[-1]) for row in cursor.fetchall()]
+    return QueryPlan(
+        sql, params, plan,
+        full_scans=[line for line in plan
+                    if line.startswith('SCAN') and 'USING' not in line],
+        temp_btrees=[line for line in plan if 'TEMP B-TREE' in line],
+        sorts=[line for line in plan
+               if 'TEMP B-TREE FOR ORDER BY' in line])
+
+
+def explain_postgresql(cursor, sql, params):
+    cursor.execute("EXPLAIN " + sql, params)
+    plan = [row[0] for row in cursor.fetchall()]
+    cost = rows = None
+    match = plan and re.search(r'cost=[\d.]+\.\.([\d.]+) rows=(\d+)', plan[0])
+    if match:
+        cost = float(match.group(1))
+        rows = int(match.group(2))
+    return QueryPlan(
+        sql, params, plan,
+        full_scans=[line.strip() for line in plan if 'Seq Scan' in line],
+        temp_btrees=[],
+        sorts=[line.strip() for line in plan
+               if re.search(r'(^|->)\s*Sort\b', line.strip())],
+        cost=cost, rows=rows)
+
+
+def explain_mysql(cursor, sql, params):
+    cursor.execute("EXPLAIN " + sql, params)
+    columns = [col[0] for col in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    plan = [u", ".join(u"%s=%s" % (col, row[col]) for col in columns)
+            for row in rows]
+    # MySQL gives no cost, but the product of the estimated rows examined is a
+    # fair proxy, and an upper bound on the rows returned.
+    cost = 1
+    for row in rows:
+        cost *= row.get('rows') or 1
+    return QueryPlan(
+        sql, params, plan,
+        full_scans=[line for line, row in zip(plan, rows)
+                    if row.get('type') == 'ALL'],
+        temp_btrees=[line for line, row in zip(plan, rows)
+                     if 'Using temporary' in (row.get('Extra') or '')],
+        sorts=[line for line, row in zip(plan, rows)
+               if 'Using filesort' in (row.get('Extra') or '')],
+        cost=cost, rows=cost)
+
+
+EXPLAINERS = {
+    'sqlite': explain_sqlite,
+    'postgresql': explain_postgresql,
+    'mysql': explain_mysql,
+}
+
+
+def explain_query(connection, sql, params):
+    """
+    Returns the QueryPlan for sql, or None if EXPLAIN isn't supported for the
+    database or the query.
+    """
+    explainer = EXPLAINERS.get(connection.vendor)
+    if explainer is None or not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    cursor = connection.cursor()
+    try:
+        return explainer(cursor, sql, params)
+    finally:
+        cursor.close()
@@ -0,0 +1,105 @@
+"""
+Streaming export of the items of a FilterSet (or any QuerySet) as CSV or JSON
+Lines, in constant memory.
+
+Rows are fetched in chunks, using the primary key to seek to the start of each
+chunk (rather than OFFSET), and only the values of the requested columns are
+fetched, without creating model instances. Columns must be single-valued
+(fields of the model, or paths across ForeignKeys), and items are exported in
+primary key order.
+"""
+
+from __future__ import unicode_literals
+
+import csv
+
+import six
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:  # Django < 1.5
+    StreamingHttpResponse = HttpResponse
+
+DEFAULT_CHUNK_SIZE = 2000
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonlines': 'application/x-jsonlines; charset=utf-8',
+}
+
+
+def iter_values(queryset, columns, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields a tuple of the values of columns for each item in queryset, doing
+    one query per chunk_size items.
+    """
+    qs = getattr(queryset, 'qs', queryset).order_by('pk')
+    last_pk = None
+    while True:
+        chunk_qs = qs if last_pk is None else qs.filter(pk__gt=last_pk)
+        rows = list(chunk_qs.values_list('pk', *columns)[:chunk_size])
+        for row in rows:
+            yield row[1:]
+        if len(rows) < chunk_size:
+            return
+        last_pk = rows[-1][0]
+
+
+class Echo(object):
+    """
+    File-like object that returns what is written, so that csv.writer can
+    produce one line at a time.
+    """
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if six.PY2:
+        # The Python 2 csv module only handles bytestrings.
+        return six.text_type(value).encode('utf-8')
+    return value
+
+
+def iter_csv(queryset, columns, headers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields the lines of a CSV export of columns, starting with a line of
+    headers (which default to the column names).
+    """
+    writer = csv.writer(Echo())
+    if headers is None:
+        headers = columns
+    yield writer.writerow([_csv_value(h) for h in headers])
+    for row in iter_values(queryset, columns, chunk_size=chunk_size):
+        yield writer.writerow([_csv_value(v) for v in row])
+
+
+def iter_jsonlines(queryset, columns, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields a line of JSON for each item, with the column names as keys.
+    """
+    encoder = DjangoJSONEncoder(sort_keys=True)
+    for row in iter_values(queryset, columns, chunk_size=chunk_size):
+        yield encoder.encode(dict(zip(columns, row))) + '\n'
+
+
+def export_response(queryset, columns, format='csv', filename=None,
+                    chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Returns a StreamingHttpResponse with an export of queryset (or the items
+    of a FilterSet) in format 'csv' or 'jsonlines'.
+    """
+    if format == 'csv':
+        lines = iter_csv(queryset, columns, chunk_size=chunk_size)
+    elif format == 'jsonlines':
+        lines = iter_jsonlines(queryset, columns, chunk_size=chunk_size)
+    else:
+        raise ValueError("Unknown export format %r" % format)
+    response = StreamingHttpResponse(lines, content_type=CONTENT_TYPES[format])
+    if filename is not None:
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
@@ -3,21 +3,21 @@ from __future__ import unicode_literals
 import math
 import operator
 import re
+from collections import OrderedDict
 from datetime import date
 from logging import getLogger
 
 import six
 from dateutil.relativedelta import relativedelta
-from django import VERSION
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.dates import MONTHS
 
-from .queries import date_aggregation
-from .queries import numeric_range_counts
-from .queries import value_counts
+from .backends import SQLBackend
 from .ranges import auto_ranges
+from .utils import LOOKUP_SEP
 from .utils import get_model_field
+from .utils import get_through_fields
 from .utils import python_2_unicode_compatible
 
 logger = getLogger(__name__)
@@ -32,15 +32,76 @@ else:
     total_ordering = lambda c: c
 
 
-try:
-    from collections import namedtuple
-    FilterChoice = namedtuple('FilterChoice', 'label count params link_type')
-except ImportError:
-    # We don't use it as a tuple, so this will do:
-    class FilterChoice(object):
-        def __init__(self, label, count, params, link_type):
-            self.label, self.count, self.params, self.link_type = \
-                label, count, params, link_type
+class FilterChoice(object):
+    """
+    A choice returned by Filter.get_choices.
+
+    params can be given directly, or built on first access from filter and
+    the choice to add to (add) or remove from (remove) its chosen values, so
+    that choices that are never linked to don't copy the query string.
+
+    capped is True if count is the filter's count_cap, and the actual count is
+    greater.
+
+    As a sequence it is (label, count, params, link_type), as the namedtuple
+    it replaces was, so it can still be unpacked, indexed and compared with
+    tuples.
+    """
+    __slots__ = ('label', 'count', 'link_type', 'capped', '_params', '_filter',
+                 '_add', '_remove')
+
+    def __init__(self, label, count, params=None, link_type=None, capped=False,
+                 filter=None, add=Ellipsis, remove=()):
+        self.label, self.count, self.link_type = label, count, link_type
+        self.capped = capped
+        self._params = params
+        self._filter, self._add, self._remove = filter, add, remove
+
+    @property
+    def params(self):
+        if self._filter is not None:
+            self._params = self._filter.build_params(add=self._add,
+                                                     remove=self._remove)
+            self._filter, self._add, self._remove = None, Ellipsis, ()
+        return self._params
+
+    @property
+    def url(self):
+        params = self.params
+        return None if params is None else '?' + params.urlencode()
+
+    def _fields(self):
+        return (self.label, self.count, self.params, self.link_type,
+                self.capped)
+
+    def __iter__(self):
+        return iter(self._fields()[:4])
+
+    def __getitem__(self, index):
+        return self._fields()[:4][index]
+
+    def __len__(self):
+        return 4
+
+    def __eq__(self, other):
+        if isinstance(other, tuple):
+            return tuple(self) == other
+        return (isinstance(other, FilterChoice) and
+                self._fields() == other._fields())
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # Pickled (e.g. for FilterSet.cache_timeout) with the params built, and
+        # without the filter.
+        return (FilterChoice, self._fields())
+
+    def __repr__(self):
+        return ('FilterChoice(label=%r, count=%r, params=%r, link_type=%r, '
+                'capped=%r)' % self._fields())
 
 
 FILTER_ADD = 'add'
@@ -54,6 +115,9 @@ class Filter(object):
     and can apply the information from a URL to filter a QuerySet.
     """
 
+    # True if the count_cap option is supported.
+    supports_count_cap = False
+
     # Public interface
 
     def __init__(self,
@@ -63,7 +127,13 @@ class Filter(object):
                  query_param=None,
                  order_by_count=False,
                  sticky=False,
-                 show_counts=True):
+                 show_counts=True,
+                 multiselect=False,
+                 reset_params=('page', 'cursor'),
+                 count_cap=None,
+                 count_cap_values=100,
+                 timeout=None,
+                 backend=None):
         self.field = field
         self.model = model
         self.params = params
@@ -80,6 +150,14 @@ class Filter(object):
         self.chosen = tuple(self.choices_from_params())
         self.sticky = sticky
         self.show_counts = show_counts
+        self.multiselect = multiselect
+        self.reset_params = reset_params
+        self.count_cap = count_cap
+        self.count_cap_values = count_cap_values
+        self.timeout = timeout
+        if backend is None:
+            backend = SQLBackend()
+        self.backend = backend
 
     def apply_filter(self, qs):
         """
@@ -87,6 +165,13 @@ class Filter(object):
         returning the new QuerySet.
         """
         chosen = list(self.chosen)
+        if self.multiselect and len(chosen) > 1:
+            # Any of the chosen values, OR'd in a single filter() call.
+            if self.sticky:
+                qs._next_is_sticky()
+            return qs.filter(six.moves.reduce(
+                operator.or_,
+                [models.Q(**self.lookup_from_choice(c)) for c in chosen]))
         while len(chosen) > 0:
             lookup = self.lookup_from_choice(chosen.pop())
             if self.sticky:
@@ -96,11 +181,62 @@ class Filter(object):
 
     def get_choices(self, qs):
         """
-        Returns a list of namedtuples containing (label (as a string), count,
-        params, link type)
+        Returns a list of FilterChoice objects, with label (as a string),
+        count, params and link_type
         """
         raise NotImplementedError()
 
+    def get_count_conditions(self):
+        """
+        Returns a list of conditions, as accepted by queries.conditional_counts,
+        if the counts this filter needs can be computed that way, or None.
+
+        FilterSet uses this to compute the counts of all such filters with a
+        single query.
+        """
+        return None
+
+    def get_selection_condition(self):
+        """
+        For a multiselect filter, returns a condition (fieldname, 'in',
+        values), as accepted by queries.conditional_counts, that matches the
+        chosen values, or None if it can't be expressed that way.
+        """
+        if LOOKUP_SEP in self.field:
+            return None
+        return (self.field, 'in',
+                [self.value_from_choice(c) for c in self.chosen])
+
+    def provides_total_count(self):
+        """
+        Returns True if computing this filter's choices also gives the total
+        number of items (see get_total_count).
+        """
+        return False
+
+    def get_total_count(self, qs):
+        """
+        Returns the number of items in qs, if it is known from counts that
+        this filter has already computed for qs, or None.
+        """
+        cached_qs, total = getattr(self, '_total_count', (None, None))
+        return total if cached_qs is qs else None
+
+    def set_conditional_counts(self, qs, counts):
+        self._conditional_counts = (qs, counts)
+
+    def get_conditional_counts(self, qs):
+        """
+        Returns the counts for get_count_conditions() on qs, using those
+        supplied by set_conditional_counts if they are for the same QuerySet.
+        """
+        cached_qs, counts = getattr(self, '_conditional_counts', (None, None))
+        if cached_qs is not qs:
+            counts = self.backend.conditional_counts(
+                qs, self.get_count_conditions())
+            self.set_conditional_counts(qs, counts)
+        return counts
+
     # Methods that are used by base implementation above
 
     def choices_from_params(self):
@@ -132,6 +268,15 @@ class Filter(object):
         """
         return {self.field: choice}
 
+    def value_from_choice(self, choice):
+        """
+        Converts a choice value to the value stored in the DB field, or None
+        for NULL.
+        """
+        if choice is NullChoice:
+            return None
+        return choice
+
     # Utility methods needed by most/all subclasses
 
     def param_from_choice(self, choice):
@@ -155,19 +300,39 @@ class Filter(object):
             chosen.remove(r)
         if add is not Ellipsis and add not in chosen:
             chosen.append(add)
-        if NullChoice in chosen:
+
+        def is_null(choice):
+            # A NULL chosen in the params is None for most filters (see
+            # choices_from_params), which multiselect filters can keep
+            # alongside other values.
+            return choice is NullChoice or (self.multiselect and choice is None)
+        if any(is_null(i) for i in chosen):
             params[self.query_param + "--isnull"] = ''
         else:
             params.pop(self.query_param + "--isnull", None)
-        chosen = list(i for i in chosen if i is not NullChoice)
+        chosen = list(i for i in chosen if not is_null(i))
         if chosen:
             params.setlist(self.query_param,
                            self.paramlist_from_choices(chosen))
         else:
             params.pop(self.query_param, None)
-        params.pop('page', None)  # links should reset paging
+        # Links should reset paging
+        for param in self.reset_params:
+            params.pop(param, None)
         return params
 
+    def make_choice(self, label, count, link_type, add=Ellipsis, remove=()):
+        """
+        Returns a FilterChoice whose params are those of build_params(add,
+        remove), built when first needed. Counts over count_cap are capped.
+        """
+        capped = (self.count_cap is not None and count is not None and
+                  count > self.count_cap)
+        if capped:
+            count = self.count_cap
+        return FilterChoice(label, count, link_type=link_type, capped=capped,
+                            filter=self, add=add, remove=remove)
+
     def sort_choices(self, qs, choices):
         """
         Sorts the choices by applying order_by_count if applicable.
@@ -185,10 +350,9 @@ class Filter(object):
         chosen = self.chosen
         choices = []
         for choice in chosen:
-            choices.append(FilterChoice(self.render_choice_object(choice),
-                                        None,  # Don't need count for removing
-                                        self.build_params(remove=[choice]),
-                                        FILTER_REMOVE))
+            choices.append(self.make_choice(self.render_choice_object(choice),
+                                            None,  # Don't need count for removing
+                                            FILTER_REMOVE, remove=[choice]))
         return choices
 
     def render_choice_object(self, choice_obj):
@@ -210,7 +374,7 @@ class SingleValueMixin(object):
     def normalize_add_choices(self, choices):
         addchoices = [(i, choice) for i, choice in enumerate(choices)
                       if choice.link_type == FILTER_ADD]
-        if len(addchoices) == 1:
+        if len(addchoices) == 1 and not (self.multiselect and self.chosen):
             # No point giving people a choice of one, since all the results will
             # already have the selected value (apart from nullable fields, which
             # might have null)
@@ -218,7 +382,8 @@ class SingleValueMixin(object):
                 choices[i] = FilterChoice(label=choices[i].label,
                                           count=choices[i].count,
                                           link_type=FILTER_DISPLAY,
-                                          params=None)
+                                          params=None,
+                                          capped=choices[i].capped)
         return choices
 
 
@@ -229,7 +394,11 @@ class ChooseOnceMixin(SingleValueMixin):
     """
     def get_choices(self, qs):
         choices_remove = self.get_choices_remove(qs)
-        if len(choices_remove) > 0:
+        if len(choices_remove) > 0 and self.multiselect:
+            # Other values can be chosen in addition.
+            choices_add = self.normalize_add_choices(self.get_choices_add(qs))
+            return choices_remove + self.sort_choices(qs, choices_add)
+        elif len(choices_remove) > 0:
             return choices_remove
         else:
             choices_add = self.normalize_add_choices(self.get_choices_add(qs))
@@ -269,6 +438,44 @@ class SimpleQueryMixin(object):
     """
     Mixin for filters that do a simple DB query on main table to get counts.
     """
+    supports_count_cap = True
+
+    def get_known_values(self):
+        """
+        Returns the list of values the field can take, if it is known up front
+        (and small), or None.
+        """
+        return None
+
+    def get_count_conditions(self):
+        values = self.get_known_values()
+        if (values is None or
+                self.count_cap is not None or
+                (self.chosen and not self.multiselect) or
+                LOOKUP_SEP in self.field or
+                not (self.show_counts or self.order_by_count)):
+            return None
+        return [(self.field, 'exact', val) for val in values]
+
+    def provides_total_count(self):
+        # The counts of all the values, including NULL, add up to the total,
+        # as long as each item has just one value.
+        return (self.get_count_conditions() is None and
+                (self.show_counts or self.order_by_count) and
+                self.count_cap is None and
+                LOOKUP_SEP not in self.field)
+
+    def get_capped_values(self, qs):
+        """
+        Returns the values to count when count_cap is set, at most
+        count_cap_values of them.
+        """
+        values = self.get_known_values()
+        if values is None:
+            values = self.backend.capped_values(qs, self.field,
+                                                self.count_cap_values)
+        return values
+
     def get_values_counts(self, qs):
         """
         Returns a SortedDict dictionary of {value: count}.
@@ -276,12 +483,35 @@ class SimpleQueryMixin(object):
         The order is the underlying order produced by sorting ascending on the
         DB field.
         """
-        if self.show_counts or self.order_by_count:
-            return value_counts(qs, self.field)
+        conditions = self.get_count_conditions()
+        if conditions is not None:
+            # Values that don't appear in qs are left out, as value_counts
+            # does.
+            counts = OrderedDict((val, count)
+                                 for (_f, _t, val), count
+                                 in zip(conditions,
+                                        self.get_conditional_counts(qs))
+                                 if count)
+        elif ((self.show_counts or self.order_by_count) and
+              self.count_cap is not None):
+            counts = self.backend.capped_counts(qs, self.field,
+                                                self.get_capped_values(qs),
+                                                self.count_cap)
+        elif self.show_counts or self.order_by_count:
+            counts = self.backend.value_counts(qs, self.field)
+            if LOOKUP_SEP not in self.field:
+                self._total_count = (qs, sum(counts.values()))
         else:
-            return dict((val, None)
-                        for val, in qs.values_list(self.field)
-                        .order_by(self.field).distinct())
+            counts = dict((val, None)
+                          for val in self.backend.distinct_values(qs,
+                                                                  self.field))
+        if self.multiselect and self.chosen:
+            # Chosen values are offered for removal instead.
+            chosen = [self.value_from_choice(c) for c in self.chosen]
+            for val in list(counts):
+                if val in chosen:
+                    del counts[val]
+        return counts
 
 
 class RangeFilterMixin(ChooseAgainMixin):
@@ -311,10 +541,9 @@ class RangeFilterMixin(ChooseAgainMixin):
         out = []
         for i, choice in enumerate(chosen):
             to_remove = [c for c in chosen if c >= choice]
-            out.append(FilterChoice(self.render_choice_object(choice),
-                                    None,
-                                    self.build_params(remove=to_remove),
-                                    FILTER_REMOVE))
+            out.append(self.make_choice(self.render_choice_object(choice),
+                                        None,
+                                        FILTER_REMOVE, remove=to_remove))
         return out
 
 
@@ -331,15 +560,25 @@ class ValuesFilter(ChooseOnceMixin, SimpleQueryMixin, Filter):
         else:
             return retval
 
+    def get_known_values(self):
+        if isinstance(self.field_obj, (models.BooleanField,
+                                       models.NullBooleanField)):
+            # Same order as value_counts would use.
+            values = [False, True]
+            if (self.field_obj.null or
+                    isinstance(self.field_obj, models.NullBooleanField)):
+                values.insert(0, None)
+            return values
+        return None
+
     def get_choices_add(self, qs):
         """
         Called by 'get_choices', this is usually the one to override.
         """
         count_dict = self.get_values_counts(qs)
-        return [FilterChoice(self.render_choice_object(val),
-                             count,
-                             self.build_params(add=val),
-                             FILTER_ADD)
+        return [self.make_choice(self.render_choice_object(val),
+                                 count,
+                                 FILTER_ADD, add=val)
                 for val, count in count_dict.items()
                 for val in (NullChoice if val is None else val,)]
 
@@ -360,6 +599,9 @@ class ChoicesFilter(ValuesFilter):
         # 3) above
         return self.choices_dict.get(choice, choice)
 
+    def get_known_values(self):
+        return [val for val, display in self.field_obj.flatchoices]
+
     def get_choices_add(self, qs):
         count_dict = self.get_values_counts(qs)
         choices = []
@@ -367,10 +609,9 @@ class ChoicesFilter(ValuesFilter):
             # 1), 2) above
             if val in count_dict:
                 choice = NullChoice if val is None else val
-                choices.append(FilterChoice(self.render_choice_object(val),
-                                            count_dict[val],
-                                            self.build_params(add=choice),
-                                            FILTER_ADD))
+                choices.append(self.make_choice(self.render_choice_object(val),
+                                                count_dict[val],
+                                                FILTER_ADD, add=choice))
         return choices
 
 
@@ -399,71 +640,107 @@ class ForeignKeyFilter(ChooseOnceMixin,
         else:
             return super(ForeignKeyFilter, self).param_from_choice(choice)
 
+    def value_from_choice(self, choice):
+        if hasattr(choice, 'pk'):
+            return getattr(choice, self.rel_field.attname)
+        return super(ForeignKeyFilter, self).value_from_choice(choice)
+
+    def get_capped_values(self, qs):
+        # NULLs are counted separately, by get_null_count.
+        return [val for val in self.backend.capped_values(
+                    qs, self.field, self.count_cap_values + 1)
+                if val is not None][:self.count_cap_values]
+
+    def get_null_count(self, qs):
+        if self.count_cap is None:
+            return self.backend.null_count(qs, self.field)
+        return self.backend.capped_counts(qs, self.field, [None],
+                                          self.count_cap).get(None, 0)
+
     def get_choices_add(self, qs):
         count_dict = self.get_values_counts(qs)
-        lookup = {self.rel_field.name + '__in': count_dict.keys()}
-        objs = self.rel_model.objects.filter(**lookup)
+        objs = self.backend.related_objects(self.rel_model, self.rel_field.name,
+                                            count_dict.keys())
         choices = []
 
-        null_count = (not self.chosen
+        null_count = ((not self.chosen or
+                       (self.multiselect and None not in self.chosen))
                       and self.field_obj.null
-                      and qs.filter(**{self.field + '__isnull': True}).count())
+                      and self.get_null_count(qs))
         if null_count:
-            choices.append(FilterChoice(self.render_choice_object(NullChoice),
-                                        null_count,
-                                        self.build_params(add=NullChoice),
-                                        FILTER_ADD))
+            choices.append(self.make_choice(self.render_choice_object(NullChoice),
+                                            null_count,
+                                            FILTER_ADD, add=NullChoice))
 
         for o in objs:
             pk = getattr(o, self.rel_field.attname)
-            choices.append(FilterChoice(self.render_choice_object(o),
-                                        count_dict[pk],
-                                        self.build_params(add=o),
-                                        FILTER_ADD))
+            choices.append(self.make_choice(self.render_choice_object(o),
+                                            count_dict[pk],
+                                            FILTER_ADD, add=o))
 
         return choices
 
 
 class ManyToManyFilter(ChooseAgainMixin, RelatedObjectMixin, Filter):
 
-    def get_values_counts(self, qs):
-        # It is easiest to base queries around the intermediate table, in order
-        # to get counts.
-        through = self.field_obj.rel.through
-        rel_model = self.rel_model
-
-        assert rel_model != self.model, "Can't cope with this yet..."
-        fkey_this = [f for f in through._meta.fields
-                     if f.rel is not None and f.rel.to is self.model][0]
-        fkey_other = [f for f in through._meta.fields
-                      if f.rel is not None and f.rel.to is rel_model][0]
+    supports_count_cap = True
 
-        # We need to limit items by what is in the main QuerySet (which might
-        # already be filtered).
-        m2m_objs = through.objects.filter(**{fkey_this.name + '__in': qs})
-
-        # We need to exclude items in other table that we have already filtered
-        # on, because they are not interesting.
-        m2m_objs = m2m_objs.exclude(**{fkey_other.name + '__in': self.chosen})
+    def apply_filter(self, qs):
+        chosen = list(self.chosen)
+        if (len(chosen) < 2 or LOOKUP_SEP in self.field or
+                qs.model is not self.model):
+            return super(ManyToManyFilter, self).apply_filter(qs)
+        through, fkey_this, fkey_other = get_through_fields(self.field_obj,
+                                                            self.model)
+        pks = through.objects.filter(
+            **{fkey_other.name + '__in': [o.pk for o in chosen]})
+        if self.multiselect:
+            # Items related to any of the chosen objects. OR'ing the lookups
+            # would join the through table, giving an item once for each
+            # chosen object it is related to, so instead this is a subquery.
+            return qs.filter(pk__in=pks.values(fkey_this.name))
+        # Items related to all of the chosen objects. Chaining a filter() for
+        # each would join the through table once per object, so instead this
+        # is a single subquery on the through table, grouped by item, that
+        # costs the same however many objects are chosen.
+        pks = (pks.values(fkey_this.name)
+               .annotate(num_chosen=models.Count(fkey_other.name,
+                                                 distinct=True))
+               .filter(num_chosen=len(chosen))
+               .values_list(fkey_this.name, flat=True))
+        return qs.filter(pk__in=pks)
 
-        # Now get counts:
-        field_name = fkey_other.name
-        return value_counts(m2m_objs, field_name)
+    def get_values_counts(self, qs):
+        if self.count_cap is not None:
+            values = self.backend.capped_values(qs, self.field,
+                                                self.count_cap_values,
+                                                exclude=self.chosen)
+            return self.backend.capped_counts(qs, self.field, values,
+                                              self.count_cap)
+        return self.backend.m2m_value_counts(qs, self.field,
+                                             exclude=self.chosen)
 
     def get_choices_add(self, qs):
         count_dict = self.get_values_counts(qs)
         # Now, need to lookup objects on related table, to display them.
-        objs = self.rel_model.objects.filter(pk__in=count_dict.keys())
+        objs = self.backend.related_objects(self.rel_model, 'pk',
+                                            count_dict.keys())
 
-        return [FilterChoice(self.render_choice_object(o),
-                             count_dict[o.pk],
-                             self.build_params(add=o),
-                             FILTER_ADD)
+        return [self.make_choice(self.render_choice_object(o),
+                                 count_dict[o.pk],
+                                 FILTER_ADD, add=o)
                 for o in objs]
 
     def param_from_choice(self, choice):
         return six.text_type(choice.pk)
 
+    def value_from_choice(self, choice):
+        return choice.pk
+
+    def get_selection_condition(self):
+        # Not a column of the model's table.
+        return None
+
     def choices_from_params(self):
         # To create the model instances, we override this method rather than
         # choice_from_param in order to do a single bulk query rather than
@@ -545,6 +822,7 @@ DAYGROUP = DateRangeType(3,     False, 'day',   _ymd)
 DAY = DateRangeType(3,          True,  'day',   _ymd)
 
 
+@total_ordering
 class NullChoice(object):
     def make_lookup(self, field_name):
         return {field_name+"__isnull": True}
@@ -559,6 +837,10 @@ class NullChoice(object):
     def __eq__(self, other):
         return other is NullChoice
 
+    def __lt__(self, other):
+        # As for __cmp__, greater than any other choice.
+        return False
+
     range_type = values = None
 NullChoice = NullChoice()
 
@@ -716,10 +998,9 @@ class DateTimeFilter(RangeFilterMixin, Filter):
             # As for RangeFilterMixin, if a broader param is removed, the more
             # specific params must be removed too.
             to_remove = [c for c in chosen if c >= choice]
-            out.append(FilterChoice(self.render_choice_object(choice),
-                                    None,
-                                    self.build_params(remove=to_remove),
-                                    FILTER_REMOVE))
+            out.append(self.make_choice(self.render_choice_object(choice),
+                                        None,
+                                        FILTER_REMOVE, remove=to_remove))
             # There can be cases where there are gaps, so we need to bridge
             # using FILTER_DISPLAY
             out.extend(self.bridge_choices(chosen[0:i+1], chosen[i+1:]))
@@ -736,6 +1017,7 @@ class DateTimeFilter(RangeFilterMixin, Filter):
 
         def get_choices_add_recursive(chosen):
             range_type = None
+            last = None
 
             if len(chosen) > 0:
                 range_type = chosen[-1].range_type.drilldown()
@@ -744,10 +1026,7 @@ class DateTimeFilter(RangeFilterMixin, Filter):
 
             if range_type is None:
                 # Get some initial idea of range
-                date_range = qs.aggregate(first=models.Min(self.field),
-                                          last=models.Max(self.field))
-                first = date_range['first']
-                last = date_range['last']
+                first, last = self.backend.value_range(qs, self.field)
                 if first is None or last is None:
                     # No values, can't drill down:
                     return []
@@ -759,15 +1038,8 @@ class DateTimeFilter(RangeFilterMixin, Filter):
                 else:
                     range_type = YEAR
 
-            if (VERSION >= (1, 6) and isinstance(self.field_obj,
-                                                 models.fields.DateTimeField)):
-                date_qs = qs.datetimes(self.field, range_type.label)
-            else:
-                date_qs = qs.dates(self.field, range_type.label)
-
-            results = date_aggregation(date_qs)
-
-            date_choice_counts = self.collapse_results(results, range_type)
+            date_choice_counts = self.get_date_choice_counts(qs, range_type,
+                                                             last)
             if len(date_choice_counts) == 1 and range_type is not None:
                 # Single choice - recurse.
                 single_choice, count = date_choice_counts[0]
@@ -792,14 +1064,13 @@ class DateTimeFilter(RangeFilterMixin, Filter):
                 chosen, [choice for choice, count in date_choice_counts]))
 
         null_count = (not chosen
-                      and qs.filter(**{self.field + '__isnull': True}).count())
+                      and self.backend.null_count(qs, self.field))
 
         if null_count:
             choices.append(
-                FilterChoice(self.render_choice_object(NullChoice),
-                             null_count if self.show_counts else None,
-                             self.build_params(add=NullChoice),
-                             FILTER_ADD))
+                self.make_choice(self.render_choice_object(NullChoice),
+                                 null_count if self.show_counts else None,
+                                 FILTER_ADD, add=NullChoice))
 
         for date_choice, count in date_choice_counts:
             if date_choice in chosen:
@@ -817,57 +1088,60 @@ class DateTimeFilter(RangeFilterMixin, Filter):
             else:
                 link_type = FILTER_ADD
 
-            choices.append(FilterChoice(self.render_choice_object(date_choice),
-                                        count if self.show_counts else None,
-                                        self.build_params(add=date_choice),
-                                        link_type))
+            choices.append(self.make_choice(self.render_choice_object(date_choice),
+                                            count if self.show_counts else None,
+                                            link_type, add=date_choice))
         return choices
 
-    def collapse_results(self, results, range_type):
-        if len(results) > self.max_links:
-            # If range_type is month/day, we don't want any possibility of the
-            # buckets wrapping over to the next year/month, so we set first and
-            # last accordingly
-            if range_type is MONTH:
-                first, last = 1, 12
-            elif range_type is DAY:
-                first, last = 1, ((results[0][0] + relativedelta(day=1))
-                                  + relativedelta(months=1, days=-1)).day
-            else:
-                first = results[0][0].year
-                last = results[-1][0].year
-
-            # We need to split into even sized buckets, so it looks nice.
-            span = last - first + 1
-            bucketsize = int(math.ceil(float(span) / self.max_links))
-            numbuckets = int(math.ceil(float(span) / bucketsize))
-
-            buckets = [[] for i in range(numbuckets)]
-            for row in results:
-                val = getattr(row[0], range_type.dateattr)
-                bucketnum = int(math.floor(float(val - first)/bucketsize))
-                buckets[bucketnum].append(row)
-
-            dt_template = results[0][0]
-            date_choice_counts = []
-            for i, bucket in enumerate(buckets):
-                count = sum(row[1] for row in bucket)
-                if count:
-                    start_val = first + bucketsize * i
-                    end_val = min(start_val + bucketsize, last)
-                    start_date = dt_template.replace(
-                        **dict({range_type.dateattr: start_val}))
-                    end_date = dt_template.replace(
-                        **dict({range_type.dateattr: end_val}))
-
-                    choice = DateChoice.from_datetime_range(range_type,
-                                                            start_date,
-                                                            end_date)
-                    date_choice_counts.append((choice, count))
+    def get_date_choice_counts(self, qs, range_type, last=None):
+        """
+        Returns a list of (DateChoice, count) for range_type, collapsed into
+        ranges if there would be more than max_links. last is the latest
+        date, if known already.
+        """
+        # One row more than can be shown is enough to know whether to collapse,
+        # without fetching every year, month or day.
+        results = self.backend.date_counts(qs, self.field, range_type.label,
+                                           limit=self.max_links + 1)
+        if len(results) <= self.max_links:
+            return [(DateChoice.from_datetime(range_type, dt), count)
+                    for dt, count in results]
+
+        # If range_type is month/day, we don't want any possibility of the
+        # buckets wrapping over to the next year/month, so we set first and
+        # last accordingly
+        dt_template = results[0][0]
+        if range_type is MONTH:
+            first, last = 1, 12
+        elif range_type is DAY:
+            first, last = 1, ((dt_template + relativedelta(day=1))
+                              + relativedelta(months=1, days=-1)).day
         else:
-            date_choice_counts = \
-                [(DateChoice.from_datetime(range_type, dt), count)
-                 for dt, count in results]
+            first = dt_template.year
+            if last is None:
+                last = self.backend.value_range(qs, self.field)[1]
+            last = last.year
+
+        # We need to split into even sized buckets, so it looks nice. The
+        # database counts the buckets, so returns at most max_links rows.
+        span = last - first + 1
+        bucketsize = int(math.ceil(float(span) / self.max_links))
+        bucket_counts = self.backend.date_bucket_counts(
+            qs, self.field, range_type.label, first, bucketsize)
+
+        date_choice_counts = []
+        for i, count in bucket_counts:
+            start_val = first + bucketsize * i
+            end_val = min(start_val + bucketsize, last)
+            start_date = dt_template.replace(
+                **dict({range_type.dateattr: start_val}))
+            end_date = dt_template.replace(
+                **dict({range_type.dateattr: end_val}))
+
+            choice = DateChoice.from_datetime_range(range_type,
+                                                    start_date,
+                                                    end_date)
+            date_choice_counts.append((choice, count))
         return date_choice_counts
 
     def bridge_choices(self, chosen, choices):
@@ -1029,49 +1303,67 @@ class NumericRangeFilter(RangeFilterMixin, SingleValueMixin, Filter):
                     return c.display()
         return c.display()
 
+    def get_count_conditions(self):
+        # With fixed ranges, everything apart from the single values case can
+        # be counted up front.
+        if (self.ranges is None or
+                LOOKUP_SEP in self.field or
+                NullChoice in self.chosen or
+                (not self.drilldown and len(self.chosen) > 0)):
+            return None
+        return ([(self.field, 'distinct', None),
+                 (self.field, 'exact', None)] +
+                [(self.field, 'range', (r[0], r[1], i == 0))
+                 for i, r in enumerate(self.ranges)])
+
     def get_choices_add(self, qs):
         chosen = list(self.chosen)
         if NullChoice in chosen or (not self.drilldown and len(chosen) > 0):
             return []
 
-        all_vals = qs.values_list(self.field).distinct()
-
-        num = all_vals.count()
+        conditions = self.get_count_conditions()
+        if conditions is not None:
+            counts = self.get_conditional_counts(qs)
+            # NULL counts as a distinct value, as for DISTINCT below.
+            num = counts[0] + (1 if counts[1] else 0)
+        else:
+            num = self.backend.distinct_count(qs, self.field)
 
         choices = []
         if num <= self.max_links:
-            val_counts = value_counts(qs, self.field)
+            val_counts = self.backend.value_counts(qs, self.field)
             for v, count in val_counts.items():
                 choice = (NullChoice if v is None
                           else self.choice_type([RangeEnd(v, True)]))
-                choices.append(FilterChoice(self.render_choice_object(choice),
-                                            count if self.show_counts else None,
-                                            self.build_params(add=choice),
-                                            FILTER_ADD))
+                choices.append(self.make_choice(self.render_choice_object(choice),
+                                                count if self.show_counts else None,
+                                                FILTER_ADD, add=choice))
         else:
-            null_count = (not chosen
-                          and qs.filter(**{self.field +
-                                           '__isnull': True}).count())
+            if conditions is not None:
+                null_count = not chosen and counts[1]
+            else:
+                null_count = (not chosen
+                              and self.backend.null_count(qs, self.field))
             if null_count:
                 choice = NullChoice
-                choices.append(FilterChoice(self.render_choice_object(choice),
-                                            null_count if self.show_counts
-                                            else None,
-                                            self.build_params(add=choice),
-                                            FILTER_ADD))
+                choices.append(self.make_choice(self.render_choice_object(choice),
+                                                null_count if self.show_counts
+                                                else None,
+                                                FILTER_ADD, add=choice))
             if self.ranges is None:
-                val_range = qs.aggregate(
-                    lower=models.Min(self.field),
-                    upper=models.Max(self.field)
-                )
-                ranges = auto_ranges(val_range['lower'],
-                                     val_range['upper'],
-                                     self.max_links)
+                lower, upper = self.backend.value_range(qs, self.field)
+                ranges = auto_ranges(lower, upper, self.max_links)
             else:
                 ranges = self.ranges
 
-            if self.show_counts or self.order_by_count:
-                val_counts = numeric_range_counts(qs, self.field, ranges)
+            if conditions is not None and (self.show_counts or
+                                           self.order_by_count):
+                val_counts = OrderedDict((r, count)
+                                         for r, count in zip(ranges, counts[2:])
+                                         if count)
+            elif self.show_counts or self.order_by_count:
+                val_counts = self.backend.numeric_range_counts(qs, self.field,
+                                                               ranges)
             else:
                 val_counts = dict((val, None) for val in ranges)
             for i, (vals, count) in enumerate(val_counts.items()):
@@ -1081,8 +1373,7 @@ class NumericRangeFilter(RangeFilterMixin, SingleValueMixin, Filter):
                 # the first will include 10 and 20, the second will exlude 20.
                 choice = self.choice_type([RangeEnd(vals[0], i == 0),
                                            RangeEnd(vals[1], True)])
-                choices.append(FilterChoice(self.render_choice_object(choice),
-                                            count,
-                                            self.build_params(add=choice),
-                                            FILTER_ADD))
+                choices.append(self.make_choice(self.render_choice_object(choice),
+                                                count,
+                                                FILTER_ADD, add=choice))
         return choices
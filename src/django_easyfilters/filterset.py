@@ -1,21 +1,38 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
 from logging import getLogger
 
 import six
 from django import template
+from django.db import connections
 from django.template.loader import get_template
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from django.utils.text import capfirst
 from django.utils.translation import ugettext as _
+from six.moves import queue
 
+from . import signals
+from .backends import SQLBackend
+from .caching import canonical_query_string
+from .caching import get_cache
+from .caching import get_cache_key
+from .caching import revalidator
+from .explain import ExplainReport
+from .explain import QueryRecorder
+from .explain import explain_query
 from .filters import ChoicesFilter
 from .filters import DateTimeFilter
-from .filters import FILTER_DISPLAY
 from .filters import FILTER_REMOVE
 from .filters import ForeignKeyFilter
 from .filters import ManyToManyFilter
 from .filters import NumericRangeFilter
 from .filters import ValuesFilter
+from .planner import SKIPPED
+from .timeouts import FacetTimeout
+from .timeouts import statement_timeout
 from .utils import get_model_field
 from .utils import python_2_unicode_compatible
 
@@ -38,6 +55,10 @@ except ImportError:
 
 logger = getLogger(__name__)
 
+# The query string parameter used by placeholders (see FilterSet.lazy) to ask
+# for the HTML fragment of a single filter.
+FRAGMENT_PARAM = 'filter-fragment'
+
 
 def non_breaking_spaces(val):
     # This helps a lot with presentation, by stopping the links+count from being
@@ -54,12 +75,63 @@ class FilterSet(object):
     template = None
     template_file = "django_easyfilters/default.html"
 
+    # If "lazy" is True, render() only outputs placeholders, and the HTML for
+    # each filter is fetched separately (see django_easyfilters.views).
+    lazy = False
+    placeholder_template_file = "django_easyfilters/placeholder.html"
+    fill_template_file = "django_easyfilters/fill.html"
+    fragment_url = None
+
     title_fields = None
     defaults = None
 
+    # Query string parameters that filter links remove, so that choosing a
+    # filter goes back to the first page (the cursor is KeysetPaginator's).
+    reset_params = ('page', 'cursor')
+
+    # If set, counts greater than this are shown as e.g. "1000+", and counting
+    # stops there (see the count_cap option of filters).
+    count_cap = None
+
+    # The class used to compute counts for the filters, see
+    # django_easyfilters.backends
+    backend_class = SQLBackend
+
+    # The database alias that the queries for counts (and related objects) go
+    # to, e.g. a replica, see get_facet_using. qs stays on the QuerySet's own
+    # database.
+    facet_using = None
+
+    # If set, the queries for each filter's choices are limited to this many
+    # seconds, after which the filter is shown without counts (see the timeout
+    # option of filters, and django_easyfilters.timeouts)
+    facet_timeout = None
+
+    # If set, a django_easyfilters.planner.FacetPlanner, which chooses how the
+    # counts of each filter are computed from estimates of their cost.
+    planner = None
+
+    # If set, the choices of each filter (and its HTML, once rendered) are
+    # cached for this many seconds in the cache cache_alias, see
+    # django_easyfilters.caching
+    cache_timeout = None
+    cache_alias = 'default'
+
+    # If set (to less than cache_timeout), cached entries older than this many
+    # seconds are still served, but are recomputed in a background thread, so
+    # that requests don't wait for them. cache_timeout is then the longest that
+    # entries are served for.
+    cache_soft_timeout = None
+
     def __init__(self, queryset, params):
         self.params = params
         self.model = queryset.model
+        self.base_qs = queryset
+        self.backend = self.get_backend()
+        # The fields of the filters whose queries timed out.
+        self.timeouts = []
+        # field: FacetStats, for the filters the planner has computed.
+        self.facet_stats = OrderedDict()
         self.filters = self.setup_filters()
         self.qs = self.apply_filters(queryset)
 
@@ -67,26 +139,315 @@ class FilterSet(object):
     def title(self):
         return self.make_title()
 
+    @cached_property
+    def total_count(self):
+        """
+        The number of items in qs, derived from the facet counts where
+        possible, so that paginating doesn't need a separate COUNT query.
+        """
+        return self.compute_total_count()
+
+    def compute_total_count(self):
+        # Counts that have been computed already are free.
+        for f in self.filters:
+            total = f.get_total_count(self.qs)
+            if total is not None:
+                return total
+        # Otherwise, from counts that rendering will need anyway.
+        self.compute_conditional_counts()
+        if getattr(self, '_conditional_total', None) is not None:
+            return self._conditional_total
+        for f in self.filters:
+            if (self.get_choices_qs(f) is self.qs and
+                    f.provides_total_count()):
+                self.get_filter_choices(f.field)
+                total = f.get_total_count(self.qs)
+                if total is not None:
+                    return total
+        return self.backend.route(self.qs).count()
+
+    def get_filter(self, filter_field):
+        for f in self.filters:
+            if f.field == filter_field:
+                return f
+        raise KeyError(filter_field)
+
     def get_filter_choices(self, filter_field):
+        # Choices are computed on demand, one filter at a time, so that
+        # rendering a single filter doesn't pay for all the others.
         if not hasattr(self, '_cached_filter_choices'):
-            self._cached_filter_choices = dict((f.field, f.get_choices(self.qs))
-                                               for f in self.filters)
+            self._cached_filter_choices = {}
+        if filter_field not in self._cached_filter_choices:
+            choices = self.get_cached(filter_field, 'choices')
+            if choices is None:
+                choices = self.get_filter_choices_uncached(filter_field)
+                if not self.is_degraded(filter_field):
+                    self.set_cached(filter_field, 'choices', choices)
+            self._cached_filter_choices[filter_field] = choices
         return self._cached_filter_choices[filter_field]
 
+    def get_filter_choices_uncached(self, filter_field):
+        """
+        Computes the choices of a filter without looking in the cache or
+        storing them there.
+        """
+        f = self.get_filter(filter_field)
+        if f.get_count_conditions() is not None:
+            self.compute_conditional_counts()
+        return self.compute_choices(f, self.get_choices_qs(f))
+
+    def compute_choices(self, filter_, qs):
+        """
+        Returns filter_.get_choices(qs), with its queries limited to
+        filter_.timeout. If they take longer, the timeout is recorded and the
+        choices from get_degraded_choices are returned instead.
+        """
+        if filter_.timeout is None:
+            return self.get_planned_choices(filter_, qs)
+        try:
+            with statement_timeout(self.get_facet_connection(qs),
+                                   filter_.timeout):
+                return self.get_planned_choices(filter_, qs)
+        except FacetTimeout:
+            self.record_timeout(filter_)
+            return self.get_degraded_choices(filter_, qs)
+
+    def get_planned_choices(self, filter_, qs):
+        """
+        Returns filter_.get_choices(qs), computed in the way that the planner
+        chooses, if there is one.
+        """
+        if self.planner is None:
+            return filter_.get_choices(qs)
+        return self.planner.get_choices(self, filter_, qs)
+
+    def is_degraded(self, filter_field):
+        """
+        Returns True if the choices of a filter are incomplete, because its
+        queries timed out or the planner skipped it, so are not to be cached.
+        """
+        stats = self.facet_stats.get(filter_field)
+        return (filter_field in self.timeouts or
+                (stats is not None and stats.strategy == SKIPPED))
+
+    def get_degraded_choices(self, filter_, qs):
+        """
+        Returns the choices for a filter whose queries timed out: those in the
+        cache if there are any, otherwise the choices without counts, or if
+        that times out too, just the links to remove the chosen values.
+        """
+        choices = self.get_cached(filter_.field, 'choices')
+        if choices is not None:
+            return choices
+        show_counts = filter_.show_counts
+        order_by_count = filter_.order_by_count
+        filter_.show_counts = filter_.order_by_count = False
+        try:
+            with statement_timeout(self.get_facet_connection(qs),
+                                   filter_.timeout):
+                return filter_.get_choices(qs)
+        except FacetTimeout:
+            return filter_.get_choices_remove(qs)
+        finally:
+            filter_.show_counts = show_counts
+            filter_.order_by_count = order_by_count
+
+    def record_timeout(self, filter_):
+        self.timeouts.append(filter_.field)
+        logger.warning("Choices for %s took longer than %s seconds",
+                       filter_.field, filter_.timeout)
+        signals.facet_timeout.send(sender=self.__class__, filterset=self,
+                                   field=filter_.field,
+                                   timeout=filter_.timeout)
+
+    def get_facet_connection(self, qs):
+        """
+        Returns the connection that the queries for counts on qs go to.
+        """
+        return connections[self.backend.route(qs).db]
+
+    def get_canonical_query_string(self):
+        """
+        Returns the params that the choices depend on, as a query string in a
+        canonical order.
+        """
+        return canonical_query_string(
+            self.params, ignore=tuple(self.reset_params) + (FRAGMENT_PARAM,))
+
+    def get_cached(self, filter_field, kind):
+        """
+        Returns the choices ('choices') or HTML ('html') of a filter from the
+        cache, or None if not cached or caching is off. Stale entries are
+        returned too, after scheduling them to be recomputed.
+        """
+        if self.cache_timeout is None:
+            return None
+        entry = get_cache(self.cache_alias).get(
+            get_cache_key(self, filter_field, kind))
+        if entry is None:
+            return None
+        value, stale_at = entry
+        if stale_at is not None and time.time() >= stale_at:
+            self.revalidate(filter_field, kind)
+        return value
+
+    def set_cached(self, filter_field, kind, value):
+        if self.cache_timeout is not None:
+            stale_at = None
+            if self.cache_soft_timeout is not None:
+                stale_at = time.time() + self.cache_soft_timeout
+            get_cache(self.cache_alias).set(
+                get_cache_key(self, filter_field, kind), (value, stale_at),
+                self.cache_timeout)
+
+    def revalidate(self, filter_field, kind):
+        """
+        Schedules the stale cache entry of a filter to be recomputed in the
+        background.
+        """
+        revalidator.schedule(get_cache_key(self, filter_field, kind),
+                             lambda: self.refresh_cached(filter_field, kind))
+
+    def refresh_cached(self, filter_field, kind):
+        """
+        Recomputes the cache entry for the choices ('choices') or HTML ('html')
+        of a filter, with a new FilterSet, so that nothing cached is used.
+        """
+        fs = self.__class__(self.base_qs, self.params)
+        choices = fs.get_filter_choices_uncached(filter_field)
+        if not fs.is_degraded(filter_field):
+            fs.set_cached(filter_field, 'choices', choices)
+        if kind == 'html':
+            fs._cached_filter_choices = {filter_field: choices}
+            html = fs.render_filter_uncached(fs.get_filter(filter_field))
+            if not fs.is_degraded(filter_field):
+                fs.set_cached(filter_field, 'html', html)
+
+    def get_multiselect_filters(self):
+        """
+        Returns the multiselect filters that have chosen values.
+        """
+        return [f for f in self.filters if f.multiselect and f.chosen]
+
+    def get_shared_qs(self):
+        """
+        Returns the QuerySet filtered by all the filters apart from the
+        multiselect filters with chosen values, which all facets are counted
+        from.
+        """
+        if not hasattr(self, '_shared_qs'):
+            active = self.get_multiselect_filters()
+            qs = self.base_qs
+            for f in self.filters:
+                if f not in active:
+                    qs = f.apply_filter(qs)
+            self._shared_qs = qs
+        return self._shared_qs
+
+    def get_choices_qs(self, filter_):
+        """
+        Returns the QuerySet to compute the choices of filter_ from. For a
+        multiselect filter with chosen values, this leaves out its own
+        choices, so that the counts are for choosing each value in addition.
+        """
+        if not (filter_.multiselect and filter_.chosen):
+            return self.qs
+        if not hasattr(self, '_choices_qs'):
+            self._choices_qs = {}
+        if filter_.field not in self._choices_qs:
+            qs = self.get_shared_qs()
+            for f in self.get_multiselect_filters():
+                if f is not filter_:
+                    qs = f.apply_filter(qs)
+            self._choices_qs[filter_.field] = qs
+        return self._choices_qs[filter_.field]
+
+    def compute_conditional_counts(self):
+        """
+        Computes the counts for all the filters that support conditional
+        aggregation (see Filter.get_count_conditions) in a single query.
+        """
+        if getattr(self, '_conditional_counts_done', False):
+            return
+        self._conditional_counts_done = True
+        computed = getattr(self, '_cached_filter_choices', {})
+
+        # With multiselect filters, each filter's counts are for a different
+        # QuerySet. These can still be done in one query, from the QuerySet
+        # they have in common, by adding the chosen values of the other
+        # multiselect filters to each condition.
+        qs = self.qs
+        active = self.get_multiselect_filters()
+        selections = dict((f, f.get_selection_condition()) for f in active)
+        if active and None not in selections.values():
+            qs = self.get_shared_qs()
+        folded = []
+        conditions = []
+        for f in self.filters:
+            f_conditions = (None if f.field in computed
+                            else f.get_count_conditions())
+            if not f_conditions:
+                continue
+            if qs is self.qs and self.get_choices_qs(f) is not self.qs:
+                # Can't be folded, so is counted on its own.
+                continue
+            if qs is not self.qs:
+                where = [selections[g] for g in active if g is not f]
+                f_conditions = [c + (where,) for c in f_conditions]
+            folded.append((f, len(f_conditions)))
+            conditions.extend(f_conditions)
+        if not folded:
+            return
+        # The total for total_count comes for free with the same query.
+        total_condition = (None, 'exact', None)
+        if qs is not self.qs:
+            total_condition += ([selections[g] for g in active],)
+        conditions.append(total_condition)
+        if self.facet_timeout is None:
+            counts = self.backend.conditional_counts(qs, conditions)
+        else:
+            try:
+                with statement_timeout(self.get_facet_connection(qs),
+                                       self.facet_timeout):
+                    counts = self.backend.conditional_counts(qs, conditions)
+            except FacetTimeout:
+                # Each filter counts its own conditions instead, within its
+                # own timeout.
+                logger.warning("Conditional counts took longer than %s "
+                               "seconds", self.facet_timeout)
+                return
+        self._conditional_total = counts[-1]
+        start = 0
+        for f, num in folded:
+            f.set_conditional_counts(self.get_choices_qs(f),
+                                     counts[start:start + num])
+            start += num
+
     def apply_filters(self, queryset):
         for f in self.filters:
             queryset = f.apply_filter(queryset)
         return queryset
 
-    def render_filter(self, filter_):
+    def get_filter_label(self, filter_):
         field_obj, _m2m = get_model_field(self.model, filter_.field)
+        return capfirst(_(field_obj.verbose_name))
+
+    def render_filter(self, filter_):
+        html = self.get_cached(filter_.field, 'html')
+        if html is None:
+            html = self.render_filter_uncached(filter_)
+            if not self.is_degraded(filter_.field):
+                self.set_cached(filter_.field, 'html', html)
+        return mark_safe(html)
+
+    def render_filter_uncached(self, filter_):
         choices = self.get_filter_choices(filter_.field)
-        ctx = {'filterlabel': capfirst(_(field_obj.verbose_name))}
+        ctx = {'filterlabel': self.get_filter_label(filter_)}
         ctx['choices'] = [dict(label=non_breaking_spaces(c.label),
-                               url=u'?' + c.params.urlencode()
-                                   if c.link_type != FILTER_DISPLAY else None,
+                               url=c.url,
                                link_type=c.link_type,
-                               count=c.count)
+                               count=c.count,
+                               capped=c.capped)
                           for c in choices]
         return self.get_template(filter_.field).render(template.Context(ctx))
 
@@ -96,13 +457,164 @@ class FilterSet(object):
         else:
             return get_template(self.template_file)
 
+    def get_fragment_url(self, filter_):
+        params = self.params.copy()
+        params[FRAGMENT_PARAM] = filter_.field
+        return (self.fragment_url or u'') + u'?' + params.urlencode()
+
+    def render_placeholder(self, filter_, fetch=True):
+        """
+        Renders a lightweight placeholder for a filter, to be replaced by the
+        output of render_filter fetched from get_fragment_url (or streamed
+        afterwards, if fetch is False).
+        """
+        ctx = {'filterlabel': self.get_filter_label(filter_),
+               'field': filter_.field,
+               'url': self.get_fragment_url(filter_) if fetch else None}
+        return get_template(self.placeholder_template_file).render(
+            template.Context(ctx))
+
+    def render_fill(self, filter_):
+        """
+        Renders a filter wrapped so that it replaces its placeholder when it
+        arrives at the client out of order.
+        """
+        ctx = {'field': filter_.field,
+               'content': self.render_filter(filter_)}
+        return get_template(self.fill_template_file).render(
+            template.Context(ctx))
+
+    def iter_render(self, parallel=False):
+        """
+        Generator version of render, that yields the HTML for each filter as
+        soon as its choices are computed, for use with StreamingHttpResponse.
+
+        If parallel is True (or the number of threads to use), choices are
+        computed concurrently, placeholders for all the filters are yielded
+        first and the filters then follow in the order they complete.
+        """
+        if self.lazy:
+            for f in self.filters:
+                yield self.render_placeholder(f)
+        elif not parallel or len(self.filters) < 2:
+            for f in self.filters:
+                yield self.render_filter(f)
+        else:
+            for f in self.filters:
+                yield self.render_placeholder(f, fetch=False)
+            self.compute_conditional_counts()
+            workers = len(self.filters) if parallel is True else parallel
+            for f in self.iter_compute_choices(workers):
+                yield self.render_fill(f)
+
+    def iter_compute_choices(self, workers):
+        """
+        Computes the choices of all the filters using a pool of threads,
+        yielding each filter once its choices are available.
+        """
+        if not hasattr(self, '_cached_filter_choices'):
+            self._cached_filter_choices = {}
+        pending = queue.Queue()
+        done = queue.Queue()
+        for f in self.filters:
+            if f.field not in self._cached_filter_choices:
+                choices = self.get_cached(f.field, 'choices')
+                if choices is not None:
+                    self._cached_filter_choices[f.field] = choices
+        todo = [f for f in self.filters
+                if f.field not in self._cached_filter_choices]
+        choices_qs = dict((f.field, self.get_choices_qs(f)) for f in todo)
+        for f in todo:
+            pending.put(f)
+
+        def work():
+            try:
+                while True:
+                    try:
+                        f = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    try:
+                        done.put((f, self.compute_choices(
+                            f, choices_qs[f.field]), None))
+                    except Exception:
+                        done.put((f, None, sys.exc_info()))
+            finally:
+                # Each thread gets its own DB connections, which we must not
+                # leak.
+                for conn in connections.all():
+                    conn.close()
+
+        for i in range(min(workers, len(todo))):
+            t = threading.Thread(target=work)
+            t.daemon = True
+            t.start()
+
+        for f in self.filters:
+            if f.field in self._cached_filter_choices:
+                yield f
+        for i in range(len(todo)):
+            f, choices, exc_info = done.get()
+            if exc_info is not None:
+                six.reraise(*exc_info)
+            self._cached_filter_choices[f.field] = choices
+            if not self.is_degraded(f.field):
+                self.set_cached(f.field, 'choices', choices)
+            yield f
+
     def render(self):
-        return mark_safe(u'\n'.join(self.render_filter(f)
+        if self.lazy:
+            render_filter = self.render_placeholder
+        else:
+            render_filter = self.render_filter
+        return mark_safe(u'\n'.join(render_filter(f)
                          for f in self.filters))
 
+    def explain(self):
+        """
+        Runs the database's EXPLAIN on the query for qs and on the queries
+        that computing each filter's choices does, returning an ExplainReport
+        that flags full scans, temporary B-trees and sorts.
+        """
+        # The queries for counts can go to another database (facet_using).
+        recorded_connections = [connections[self.qs.db],
+                                self.get_facet_connection(self.qs)]
+
+        def plans(queries, aliases):
+            return [plan for plan in (explain_query(connections[alias], sql, params)
+                                      for (sql, params), alias in zip(queries, aliases))
+                    if plan is not None]
+
+        sql, params = self.qs.query.get_compiler(self.qs.db).as_sql()
+        entries = [('qs', plans([(sql, params)], [self.qs.db]))]
+        # A new FilterSet, so that nothing is cached already, that doesn't use
+        # the shared cache either.
+        fs = self.__class__(self.base_qs, self.params)
+        fs.cache_timeout = None
+        with QueryRecorder(*recorded_connections) as recorder:
+            fs.compute_conditional_counts()
+        if recorder.queries:
+            entries.append(('conditional counts',
+                            plans(recorder.queries, recorder.aliases)))
+        for f in fs.filters:
+            with QueryRecorder(*recorded_connections) as recorder:
+                fs.get_filter_choices_uncached(f.field)
+            entries.append((f.field, plans(recorder.queries, recorder.aliases)))
+        return ExplainReport(entries)
+
     def get_fields(self):
         return self.fields
 
+    def get_backend(self):
+        return self.backend_class(self)
+
+    def get_facet_using(self):
+        """
+        Returns the database alias for the queries for counts, or None to use
+        that of the QuerySet. Override this to choose a replica per request.
+        """
+        return self.facet_using
+
     def get_filter_for_field(self, field):
         f, m2m = get_model_field(self.model, field)
         if f.rel is not None:
@@ -135,6 +647,10 @@ class FilterSet(object):
                     klass = f[2]
             if klass is None:
                 klass = self.get_filter_for_field(field_name)
+            opts.setdefault('backend', self.backend)
+            opts.setdefault('reset_params', self.reset_params)
+            opts.setdefault('count_cap', self.count_cap)
+            opts.setdefault('timeout', self.facet_timeout)
             logger.debug("Creating %s(%s, %s, %s, **%s)",
                          klass.__name__,
                          field_name,
@@ -0,0 +1,136 @@
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db import connections
+
+from django_easyfilters.advisor import benchmark
+from django_easyfilters.advisor import migration_source
+from django_easyfilters.advisor import missing_indexes
+from django_easyfilters.advisor import propose_indexes
+from django_easyfilters.utils import import_module
+from django_easyfilters.utils import parse_filterset_spec
+
+try:
+    from django.db.migrations.loader import MigrationLoader
+except ImportError:  # Django < 1.7
+    MigrationLoader = None
+
+
+class Command(BaseCommand):
+    args = '<path.to.FilterSet:app_label.ModelName ...>'
+    help = ("Proposes indexes for the queries done by FilterSets, as a "
+            "migration, and optionally measures the difference they make.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', default='default',
+                    help="The database to inspect."),
+        make_option('--app',
+                    help="The app to add the migration to, by default that "
+                         "of the first model."),
+        make_option('--name', default='easyfilters_indexes',
+                    help="The name of the migration."),
+        make_option('--write', action='store_true', default=False,
+                    help="Write the migration to the app's migrations, "
+                         "instead of the standard output."),
+        make_option('--benchmark', action='store_true', default=False,
+                    help="Time the FilterSets before and after adding the "
+                         "indexes (which are then dropped again) on "
+                         "--sample-database."),
+        make_option('--sample-database',
+                    help="The database to benchmark on, with a sample of the "
+                         "data. Must not be the default database or "
+                         "--database."),
+        make_option('--repeat', type='int', default=3,
+                    help="Number of timings to take the best of."),
+    )
+
+    def handle(self, *specs, **options):
+        if not specs:
+            raise CommandError("Give at least one FilterSet, as "
+                               "path.to.FilterSet:app_label.ModelName")
+        try:
+            specs = [parse_filterset_spec(spec) for spec in specs]
+        except (ValueError, ImportError, LookupError) as e:
+            raise CommandError(str(e))
+        connection = connections[options['database']]
+        sample = options['sample_database']
+        if options['benchmark']:
+            # Creating and dropping indexes locks tables, so this is not
+            # done on the live database.
+            if not sample:
+                raise CommandError("--benchmark needs --sample-database")
+            if sample in (DEFAULT_DB_ALIAS, options['database']):
+                raise CommandError("--sample-database must be a database "
+                                   "other than %r and --database" % DEFAULT_DB_ALIAS)
+            if sample not in connections.databases:
+                raise CommandError("Unknown database %r" % sample)
+
+        proposals = []
+        for filterset_class, model in specs:
+            for p in propose_indexes(filterset_class, model):
+                if p not in proposals:
+                    proposals.append(p)
+        proposals = missing_indexes(connection, proposals)
+        if not proposals:
+            self.stdout.write("# No indexes to add.\n")
+            return
+
+        app_label = options['app'] or specs[0][1]._meta.app_label
+        self.output(connection, proposals, app_label, options)
+        if options['benchmark']:
+            sample_connection = connections[sample]
+            self.benchmark(sample_connection, specs,
+                           missing_indexes(sample_connection, proposals),
+                           options['repeat'])
+
+    def output(self, connection, proposals, app_label, options):
+        if MigrationLoader is None:
+            # No migrations, so give the SQL to run.
+            for p in proposals:
+                self.stdout.write("-- %s\n%s;\n" % (p.reason,
+                                                    p.create_sql(connection)))
+            return
+        loader = MigrationLoader(connection)
+        leaves = [key for key in loader.graph.leaf_nodes()
+                  if key[0] == app_label]
+        source = migration_source(connection, proposals, leaves)
+        if not options['write']:
+            self.stdout.write(source)
+            return
+        try:
+            module = import_module(MigrationLoader.migrations_module(app_label))
+        except ImportError:
+            raise CommandError("App %r has no migrations" % app_label)
+        numbers = [int(name.split('_')[0]) for app, name in leaves
+                   if name.split('_')[0].isdigit()]
+        filename = '%04d_%s.py' % (max(numbers or [0]) + 1, options['name'])
+        path = os.path.join(os.path.dirname(module.__file__), filename)
+        with open(path, 'w') as f:
+            f.write(source)
+        self.stdout.write("# Wrote %s\n" % path)
+
+    def benchmark(self, connection, specs, proposals, repeat):
+        def run():
+            return [benchmark(filterset_class,
+                              model._default_manager.using(connection.alias),
+                              repeat=repeat)
+                    for filterset_class, model in specs]
+
+        before = run()
+        cursor = connection.cursor()
+        created = []
+        try:
+            for p in proposals:
+                cursor.execute(p.create_sql(connection))
+                created.append(p)
+            after = run()
+        finally:
+            for p in created:
+                cursor.execute(p.drop_sql(connection))
+            cursor.close()
+        for (filterset_class, model), b, a in zip(specs, before, after):
+            self.stdout.write("# %s: %.4fs before, %.4fs after\n"
+                              % (filterset_class.__name__, b, a))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from django_easyfilters.materialized import MaterializedCounts
+from django_easyfilters.utils import import_object
+
+
+class Command(BaseCommand):
+    args = '<path.to.FilterSet or path.to.MaterializedCounts ...>'
+    help = ("Rebuilds the table of counts of MaterializedCounts, given "
+            "directly or as the materialized_counts of a FilterSet.")
+
+    def handle(self, *paths, **options):
+        if not paths:
+            raise CommandError("Give at least one FilterSet or "
+                               "MaterializedCounts, as a dotted path")
+        all_counts = []
+        for path in paths:
+            try:
+                obj = import_object(path)
+            except ImportError as e:
+                raise CommandError(str(e))
+            counts = getattr(obj, 'materialized_counts', obj)
+            if not isinstance(counts, MaterializedCounts):
+                raise CommandError("%s has no MaterializedCounts" % path)
+            all_counts.append(counts)
+        for counts in all_counts:
+            num = counts.refresh()
+            self.stdout.write("Refreshed %s: %d rows\n" % (counts.name, num))
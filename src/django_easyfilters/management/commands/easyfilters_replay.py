@@ -0,0 +1,71 @@
+import io
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from django_easyfilters.replay import parse_query_string
+from django_easyfilters.replay import percentile
+from django_easyfilters.replay import replay
+from django_easyfilters.utils import parse_filterset_spec
+
+
+class Command(BaseCommand):
+    args = '<logfile> <path.to.FilterSet:app_label.ModelName>'
+    help = ("Replays a file of recorded query strings against a FilterSet, "
+            "and reports latency and query counts.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--concurrency', type='int', default=1,
+                    help="Number of threads to replay with."),
+        make_option('--slowest', type='int', default=10,
+                    help="Number of the slowest query strings to list."),
+        make_option('--database', default='default',
+                    help="The database to use."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Give a log file and a FilterSet, as "
+                               "path.to.FilterSet:app_label.ModelName")
+        logfile, spec = args
+        try:
+            filterset_class, model = parse_filterset_spec(spec)
+        except (ValueError, ImportError, LookupError) as e:
+            raise CommandError(str(e))
+        try:
+            with io.open(logfile, encoding='utf-8') as f:
+                query_strings = [q for q in map(parse_query_string, f)
+                                 if q is not None]
+        except IOError as e:
+            raise CommandError(str(e))
+
+        queryset = model._default_manager.using(options['database'])
+        stats = replay(filterset_class, queryset, query_strings,
+                       concurrency=options['concurrency'])
+        self.report(stats, options['slowest'])
+
+    def report(self, stats, slowest):
+        write = self.stdout.write
+
+        def ms(seconds):
+            return '%.1fms' % (seconds * 1000)
+
+        def latency(values):
+            return ', '.join('p%d %s' % (p, ms(percentile(values, p)))
+                             for p in (50, 95, 99))
+
+        write("Replayed %d requests in %.2fs with concurrency %d\n"
+              % (len(stats.timings), stats.elapsed, stats.concurrency))
+        if not stats.timings:
+            return
+        write("Latency: %s\n" % latency(stats.latencies()))
+        write("\nPer filter:\n")
+        for field in stats.fields():
+            queries = stats.filter_queries(field)
+            write("  %s: %s, %.1f queries (max %d)\n"
+                  % (field, latency(stats.filter_latencies(field)),
+                     float(sum(queries)) / len(queries), max(queries)))
+        write("\nSlowest:\n")
+        for t in stats.slowest(slowest):
+            write("  %s  ?%s\n" % (ms(t.elapsed), t.query_string))
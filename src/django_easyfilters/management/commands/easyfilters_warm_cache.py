@@ -0,0 +1,110 @@
+import io
+import multiprocessing
+from optparse import make_option
+
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connections
+from django.http import QueryDict
+
+from django_easyfilters.caching import canonical_query_string
+from django_easyfilters.caching import get_cache
+from django_easyfilters.caching import warm
+from django_easyfilters.filterset import FRAGMENT_PARAM
+from django_easyfilters.replay import parse_query_string
+from django_easyfilters.utils import parse_filterset_spec
+
+
+def warm_chunk(args):
+    """
+    Warms the cache for some query strings, in a worker process.
+    """
+    spec, database, query_strings, html, rate = args
+    filterset_class, model = parse_filterset_spec(spec)
+    try:
+        return warm(filterset_class, model._default_manager.using(database),
+                    query_strings, html=html, rate=rate)
+    finally:
+        for conn in connections.all():
+            conn.close()
+
+
+class Command(BaseCommand):
+    args = '<logfile> <path.to.FilterSet:app_label.ModelName>'
+    help = ("Fills the cache with the choices of a FilterSet for a list of "
+            "popular query strings.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', default=1,
+                    help="Number of processes to compute choices in. Needs "
+                         "a cache shared between processes."),
+        make_option('--rate', type='float',
+                    help="Maximum number of query strings to compute per "
+                         "second, over all the processes."),
+        make_option('--html', action='store_true', default=False,
+                    help="Cache the rendered HTML of the filters as well."),
+        make_option('--database', default='default',
+                    help="The database to use."),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Give a log file and a FilterSet, as "
+                               "path.to.FilterSet:app_label.ModelName")
+        logfile, spec = args
+        try:
+            filterset_class, model = parse_filterset_spec(spec)
+        except (ValueError, ImportError, LookupError) as e:
+            raise CommandError(str(e))
+        if filterset_class.cache_timeout is None:
+            raise CommandError("%s.cache_timeout is not set, so nothing "
+                               "would be cached" % filterset_class.__name__)
+        processes = max(options['processes'], 1)
+        if processes > 1 and isinstance(get_cache(filterset_class.cache_alias),
+                                        (LocMemCache, DummyCache)):
+            # What other processes cache would be lost with them.
+            raise CommandError("--processes needs a cache shared between "
+                               "processes, not %r"
+                               % filterset_class.cache_alias)
+        try:
+            with io.open(logfile, encoding='utf-8') as f:
+                lines = [q for q in map(parse_query_string, f)
+                         if q is not None]
+        except IOError as e:
+            raise CommandError(str(e))
+
+        # Query strings that differ only in order (or in parameters that
+        # don't change the choices) share cache entries.
+        ignore = tuple(filterset_class.reset_params) + (FRAGMENT_PARAM,)
+        query_strings = []
+        seen = set()
+        for line in lines:
+            q = canonical_query_string(QueryDict(line), ignore=ignore)
+            if q not in seen:
+                seen.add(q)
+                query_strings.append(q)
+
+        rate = options['rate']
+        if rate is not None:
+            rate = rate / processes
+        if processes == 1:
+            done = warm(filterset_class,
+                        model._default_manager.using(options['database']),
+                        query_strings, html=options['html'], rate=rate)
+        else:
+            # Dealt out in turn, so that the most popular come first in every
+            # process.
+            chunks = [(spec, options['database'], query_strings[i::processes],
+                       options['html'], rate) for i in range(processes)]
+            # Connections must not be shared with the forked processes.
+            for conn in connections.all():
+                conn.close()
+            pool = multiprocessing.Pool(processes)
+            try:
+                done = sum(pool.map(warm_chunk, chunks))
+            finally:
+                pool.close()
+                pool.join()
+        self.stdout.write("Cached the choices for %d query strings\n" % done)
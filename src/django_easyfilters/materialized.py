@@ -0,0 +1,238 @@
+"""
+Facet counts precomputed into a table, for pages where the base QuerySet is
+fixed and only a few filters (the "dimensions") are ever chosen.
+
+A MaterializedCounts stores, for every combination of values of the
+dimensions (including leaving each dimension unchosen), the count of each
+value of each of its fields, and the total. These are rows of the FacetCount
+model, which works the same on every database, rebuilt by refresh() or the
+easyfilters_refresh_counts management command.
+
+MaterializedBackend then reads the counts from the table when the chosen
+filters of a FilterSet are all single values of dimensions, and falls back to
+SQL otherwise. The counts are as of the last refresh.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import json
+from itertools import combinations
+
+import six
+from django.db import models
+from django.db import transaction
+
+from .backends import IndexBackend
+from .backends import queryset_sql
+from .backends import split_lookup
+from .models import FacetCount
+from .utils import get_model_field
+
+try:
+    atomic = transaction.atomic
+except AttributeError:  # Django < 1.6
+    atomic = transaction.commit_on_success
+
+
+def dimensions_text(dimensions):
+    """
+    Returns the text stored for a dict of {dimension: value text}.
+    """
+    return json.dumps(sorted(dimensions.items()))
+
+
+class DimensionKey(object):
+    """
+    The chosen values of the dimensions, which MaterializedBackend uses in
+    place of a set of rows. Combining keys with '&' chooses the values of
+    both, which raises ValueError for two values of a ManyToMany dimension,
+    since an item can have both but no key stores its counts.
+    """
+
+    def __init__(self, counts, dimensions, empty=False):
+        self.counts = counts
+        self.dimensions = dimensions    # {dimension: value text or None}
+        self.empty = empty              # If conflicting values were chosen
+        self._rows = None
+
+    def __and__(self, other):
+        dimensions = dict(self.dimensions)
+        empty = self.empty or other.empty
+        for dim, val in other.dimensions.items():
+            if dimensions.get(dim, val) != val:
+                if self.counts.is_m2m(dim):
+                    raise ValueError("Several values of %s chosen" % dim)
+                empty = True
+            dimensions[dim] = val
+        return DimensionKey(self.counts, dimensions, empty)
+
+    def get_rows(self):
+        """
+        Returns {field: [(value text, count)]} for this key, with the total
+        under ''.
+        """
+        if self._rows is None:
+            self._rows = {}
+            if not self.empty:
+                for field, value, count in FacetCount.objects.using(
+                        self.counts.using).filter(
+                        key=self.counts.get_key(self.dimensions)).values_list(
+                        'field', 'value', 'count'):
+                    self._rows.setdefault(field, []).append((value, count))
+        return self._rows
+
+
+class MaterializedCounts(object):
+    """
+    Counts of the values of fields in queryset, for each combination of
+    values of the dimensions, stored under name.
+
+    dimensions are the fields of the filters that can be chosen, and fields
+    those of the other filters. Reverse relations are not supported, and
+    should be left out of both.
+    """
+
+    def __init__(self, name, queryset, dimensions, fields, using=None):
+        self.name = name
+        self.queryset = queryset
+        self.model = queryset.model
+        self.dimensions = list(dimensions)
+        self.fields = list(fields)
+        self.using = using
+        self.refreshed = False
+        self._value_fields = {}
+        self._m2m = {}
+
+    def value_field(self, fieldname):
+        """
+        Returns the field whose to_python converts the stored values of
+        fieldname.
+        """
+        if fieldname not in self._value_fields:
+            field_obj, m2m = get_model_field(self.model, fieldname)
+            if field_obj.rel is not None:
+                field_obj = field_obj.rel.get_related_field()
+            self._value_fields[fieldname] = field_obj
+            self._m2m[fieldname] = m2m
+        return self._value_fields[fieldname]
+
+    def is_m2m(self, fieldname):
+        self.value_field(fieldname)
+        return self._m2m[fieldname]
+
+    def to_text(self, fieldname, value):
+        if value is None:
+            return None
+        value = getattr(value, 'pk', value)
+        return six.text_type(self.value_field(fieldname).to_python(value))
+
+    def to_python(self, fieldname, text):
+        if text is None:
+            return None
+        return self.value_field(fieldname).to_python(text)
+
+    def get_key(self, dimensions):
+        return hashlib.md5((self.name + '\n' + dimensions_text(dimensions))
+                           .encode('utf-8')).hexdigest()
+
+    def refresh(self):
+        """
+        Rebuilds the counts from the database.
+        """
+        qs = self.queryset
+        if self.using is not None:
+            qs = qs.using(self.using)
+        rows = []
+        for num in range(len(self.dimensions) + 1):
+            for chosen in combinations(self.dimensions, num):
+                for field in [''] + self.fields + self.dimensions:
+                    if field in chosen:
+                        continue
+                    columns = list(chosen) + ([field] if field else [])
+                    if columns:
+                        groups = (qs.values(*columns).order_by()
+                                  .annotate(count=models.Count('pk',
+                                                               distinct=True)))
+                    else:
+                        groups = [{'count': qs.count()}]
+                    for group in groups:
+                        dimensions = dict((dim, self.to_text(dim, group[dim]))
+                                          for dim in chosen)
+                        rows.append(FacetCount(
+                            name=self.name,
+                            key=self.get_key(dimensions),
+                            dimensions=dimensions_text(dimensions),
+                            field=field,
+                            value=(self.to_text(field, group[field])
+                                   if field else None),
+                            count=group['count']))
+        with atomic(using=qs.db):
+            FacetCount.objects.using(qs.db).filter(name=self.name).delete()
+            FacetCount.objects.using(qs.db).bulk_create(rows)
+        self.refreshed = True
+        return len(rows)
+
+    def is_refreshed(self):
+        if not self.refreshed:
+            self.refreshed = FacetCount.objects.using(self.using).filter(
+                key=self.get_key({})).exists()
+        return self.refreshed
+
+    # The index interface of IndexBackend
+
+    def covers(self, queryset):
+        return (queryset.model is self.model and
+                queryset_sql(queryset) == queryset_sql(self.queryset) and
+                self.is_refreshed())
+
+    def all_rows(self):
+        return DimensionKey(self, {})
+
+    def lookup(self, key, value):
+        dim, lookup_type = split_lookup(key, self.dimensions)
+        if lookup_type == 'exact':
+            return DimensionKey(self, {dim: self.to_text(dim, value)})
+        if lookup_type == 'isnull' and value:
+            return DimensionKey(self, {dim: None})
+        return None
+
+    def has_field(self, fieldname):
+        return fieldname in self.fields or fieldname in self.dimensions
+
+    def counts(self, fieldname, rows):
+        if fieldname in rows.dimensions:
+            if self.is_m2m(fieldname):
+                # The other values of the chosen items aren't stored.
+                return None
+            # Only the chosen value.
+            total = self.count(rows)
+            if not total:
+                return []
+            return [(self.to_python(fieldname, rows.dimensions[fieldname]),
+                     total)]
+        counts = [(self.to_python(fieldname, value), count)
+                  for value, count in rows.get_rows().get(fieldname, [])]
+        return sorted(counts, key=lambda vc: (vc[0] is not None, vc[0]))
+
+    def count(self, rows):
+        return sum(count for value, count in rows.get_rows().get('', []))
+
+    def get_related_objects(self, rel_model):
+        return None
+
+
+class MaterializedBackend(IndexBackend):
+    """
+    Backend that reads counts from a MaterializedCounts, given as the
+    'materialized_counts' attribute of the FilterSet.
+    """
+
+    def __init__(self, filterset=None, counts=None):
+        self._counts = counts
+        super(MaterializedBackend, self).__init__(filterset)
+
+    def get_index(self):
+        if self._counts is not None:
+            return self._counts
+        return getattr(self.filterset, 'materialized_counts', None)
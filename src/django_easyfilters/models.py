@@ -0,0 +1,17 @@
+from django.db import models
+
+
+class FacetCount(models.Model):
+    """
+    The number of items with a value of a field, for one combination of
+    values of the dimensions of a MaterializedCounts (see
+    django_easyfilters.materialized).
+    """
+    name = models.CharField(max_length=100, db_index=True)
+    # Hash of name and dimensions, which rows are looked up by.
+    key = models.CharField(max_length=32, db_index=True)
+    dimensions = models.TextField()
+    # Empty for the total number of items.
+    field = models.CharField(max_length=255, blank=True)
+    value = models.TextField(null=True)
+    count = models.PositiveIntegerField()
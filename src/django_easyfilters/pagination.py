@@ -0,0 +1,205 @@
+"""
+Paginators that work with a FilterSet.
+"""
+
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models.fields import FieldDoesNotExist
+from django.http import QueryDict
+
+
+class FilterSetPaginator(Paginator):
+    """
+    Paginator for the items of a FilterSet, that gets the number of items
+    from FilterSet.total_count rather than doing its own COUNT query.
+    """
+
+    def __init__(self, filterset, per_page, orphans=0,
+                 allow_empty_first_page=True):
+        self.filterset = filterset
+        super(FilterSetPaginator, self).__init__(
+            filterset.qs, per_page, orphans=orphans,
+            allow_empty_first_page=allow_empty_first_page)
+
+    @property
+    def count(self):
+        return self.filterset.total_count
+
+
+class KeysetPage(object):
+    """
+    A page of items from KeysetPaginator.
+    """
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<KeysetPage of %d items>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def next_params(self):
+        return self.paginator.build_params(self.next_cursor)
+
+    def previous_params(self):
+        return self.paginator.build_params(self.previous_cursor)
+
+
+class KeysetPaginator(object):
+    """
+    Paginator that seeks to each page using the values of the ordering columns
+    of the last item of the previous page (a 'cursor'), rather than using
+    OFFSET, so that deep pages cost the same as the first one, given an index
+    on the ordering columns.
+
+    object_list can be a FilterSet, in which case its parameters are kept in
+    the links to other pages. Filter links must reset the cursor, so
+    cursor_param must be in FilterSet.reset_params (as 'cursor' is by
+    default).
+
+    The ordering defaults to that of the QuerySet, and must be of fields of
+    the model itself, not of related models, that can't be NULL. The primary
+    key is added to it if needed, so that it is unique.
+    """
+
+    def __init__(self, object_list, per_page, ordering=None,
+                 cursor_param='cursor'):
+        self.filterset = object_list if hasattr(object_list, 'qs') else None
+        qs = object_list.qs if self.filterset is not None else object_list
+        self.model = qs.model
+        self.per_page = int(per_page)
+        self.cursor_param = cursor_param
+        if (self.filterset is not None and
+                cursor_param not in self.filterset.reset_params):
+            raise ValueError("%r must be in %s.reset_params, so that filter "
+                             "links go back to the first page"
+                             % (cursor_param,
+                                self.filterset.__class__.__name__))
+        if ordering is None:
+            ordering = (qs.query.order_by or
+                        list(self.model._meta.ordering))
+        self.ordering = self.normalize_ordering(ordering)
+        self.object_list = qs.order_by(*[('-' if desc else '') + name
+                                         for name, desc in self.ordering])
+
+    def normalize_ordering(self, ordering):
+        """
+        Converts the ordering to a list of (field name, descending), ending
+        with the primary key.
+        """
+        pk_name = self.model._meta.pk.name
+        out = []
+        for item in ordering:
+            desc = item.startswith('-')
+            name = item.lstrip('-')
+            if name == 'pk':
+                name = pk_name
+            # The values of the fields are read from the items for cursors.
+            try:
+                if '__' in name:
+                    raise FieldDoesNotExist()
+                self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise ValueError("Can't order by %r: KeysetPaginator orderings "
+                                 "must be of fields of %s" % (item, self.model.__name__))
+            out.append((name, desc))
+        if pk_name not in [name for name, desc in out]:
+            out.append((pk_name, False))
+        return out
+
+    def encode_cursor(self, direction, obj):
+        values = [getattr(obj, self.model._meta.get_field(name).attname)
+                  for name, desc in self.ordering]
+        data = json.dumps([direction, values], cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        """
+        Returns (direction, values) for a cursor, or None if it is invalid.
+        """
+        try:
+            direction, values = json.loads(
+                base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+            if (direction not in ('next', 'prev') or
+                    len(values) != len(self.ordering)):
+                return None
+            return direction, [
+                self.model._meta.get_field(name).to_python(val)
+                for (name, desc), val in zip(self.ordering, values)]
+        except (TypeError, ValueError, ValidationError):
+            return None
+
+    def seek(self, qs, values, forwards):
+        """
+        Filters qs to the items after (or before, if not forwards) the item
+        with values for the ordering columns.
+        """
+        q = None
+        for i, (name, desc) in enumerate(self.ordering):
+            lookup = 'gt' if desc != forwards else 'lt'
+            term = models.Q(**{'%s__%s' % (name, lookup): values[i]})
+            for (prev_name, prev_desc), prev_val in zip(self.ordering[:i],
+                                                        values[:i]):
+                term &= models.Q(**{prev_name: prev_val})
+            q = term if q is None else q | term
+        return qs.filter(q)
+
+    def page(self, cursor=None):
+        """
+        Returns the KeysetPage for cursor, which is normally taken from the
+        query string. An invalid or missing cursor gives the first page.
+        """
+        decoded = self.decode_cursor(cursor) if cursor else None
+        qs = self.object_list
+        if decoded is None:
+            direction, forwards = None, True
+        else:
+            direction, values = decoded
+            forwards = direction == 'next'
+            qs = self.seek(qs, values, forwards)
+        if not forwards:
+            qs = qs.reverse()
+        # One more than needed, to find out if there is another page.
+        objects = list(qs[:self.per_page + 1])
+        more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        if not forwards:
+            objects.reverse()
+
+        next_cursor = previous_cursor = None
+        if objects:
+            if more or not forwards:
+                next_cursor = self.encode_cursor('next', objects[-1])
+            if (more and not forwards) or direction == 'next':
+                previous_cursor = self.encode_cursor('prev', objects[0])
+        return KeysetPage(objects, self, next_cursor, previous_cursor)
+
+    def build_params(self, cursor):
+        if self.filterset is not None:
+            params = self.filterset.params.copy()
+        else:
+            params = QueryDict('', mutable=True)
+        if cursor is None:
+            params.pop(self.cursor_param, None)
+        else:
+            params[self.cursor_param] = cursor
+        return params
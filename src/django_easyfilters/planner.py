@@ -0,0 +1,367 @@
+"""
+A planner that chooses how the counts of each filter of a FilterSet are
+computed, from estimates of what computing them exactly would cost (see
+FilterSet.planner).
+
+Before a filter's choices are computed, the number of rows they are counted
+over is estimated: a count of at most python_max_rows + 1 rows first, and if
+there are more than that, the row estimate from EXPLAIN (on PostgreSQL and
+MySQL). The time the filter takes is estimated from the times that computing
+it exactly took before. From these, one of the strategies is chosen:
+
+* EXACT: as without a planner.
+* PYTHON: for small results, the values of the field are fetched in one query
+  and counted in Python.
+* CAPPED: for slow or large results, counts are capped at count_cap, for
+  filters that support the count_cap option.
+* SAMPLED: for slow or large results where capping isn't supported, counts
+  are done on the first sample_size rows (in primary key order), and scaled
+  up to the estimated number of rows.
+* SKIPPED: if a page_budget is set and the estimated time of the filter would
+  go over what is left of it, only the links to remove chosen values are
+  shown.
+
+The strategy is recorded, with the estimates and the time taken, in the
+FilterSet's facet_stats.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.db import connections
+from django.db.models.sql.datastructures import EmptyResultSet
+
+from .backends import IndexBackend
+from .backends import SQLBackend
+from .bitmaps import _sort_key
+from .explain import explain_query
+
+EXACT = 'exact'
+PYTHON = 'python'
+CAPPED = 'capped'
+SAMPLED = 'sampled'
+SKIPPED = 'skipped'
+
+
+class FacetStats(object):
+    """
+    How the choices of a filter were computed, and what that was estimated to
+    cost.
+    """
+
+    def __init__(self, strategy, rows=None, estimate=None, counted=True):
+        self.strategy = strategy
+        self.counted = counted      # False if there was nothing to count
+        self.rows = rows            # Estimated rows, None if not known
+        self.estimate = estimate    # Estimated seconds, None if not known
+        self.elapsed = None         # Seconds taken
+
+    def __repr__(self):
+        return ('<FacetStats: %s, rows=%r, estimate=%r, elapsed=%r>' %
+                (self.strategy, self.rows, self.estimate, self.elapsed))
+
+
+class TimingHistory(object):
+    """
+    Moving averages of the seconds that facets took, by key, shared by the
+    threads of the process. Entries not updated for max_age seconds are
+    forgotten, so that facets are measured again.
+    """
+
+    def __init__(self, weight=0.3, max_age=3600):
+        self.weight = weight
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry[1] > self.max_age:
+            return None
+        return entry[0]
+
+    def record(self, key, seconds):
+        with self.lock:
+            average = self.get(key)
+            if average is not None:
+                seconds = (1 - self.weight) * average + self.weight * seconds
+            self.entries[key] = (seconds, time.time())
+
+
+class ValuesIndex(object):
+    """
+    The values of fields for the rows of a QuerySet, fetched with one query
+    per field, for use by PythonBackend. Rows aren't tracked, since the index
+    only ever answers for the whole QuerySet.
+    """
+
+    def __init__(self, queryset, fields):
+        self.counts_by_field = {}
+        pks = set()
+        # From a subquery, so that multi-valued fields aren't limited by the
+        # joins of the lookups of queryset.
+        rows = queryset.model._default_manager.using(queryset.db).filter(
+            pk__in=queryset.values('pk'))
+        for f in fields:
+            counts = {}
+            for pk, val in rows.values_list('pk', f).order_by():
+                pks.add(pk)
+                counts[val] = counts.get(val, 0) + 1
+            self.counts_by_field[f] = sorted(counts.items(),
+                                             key=lambda item: _sort_key(item[0]))
+        self.size = len(pks)
+
+    def has_field(self, field):
+        return field in self.counts_by_field
+
+    def counts(self, field, rows):
+        return self.counts_by_field[field]
+
+    def count(self, rows):
+        return self.size
+
+    def get_related_objects(self, rel_model):
+        return None
+
+
+class PythonBackend(IndexBackend):
+    """
+    Backend that counts the values of fields for the rows of queryset in
+    Python, falling back to SQL for other QuerySets.
+    """
+
+    def __init__(self, filterset, queryset, fields):
+        self.queryset = queryset
+        self.fields = fields
+        super(PythonBackend, self).__init__(filterset)
+
+    def get_index(self):
+        return ValuesIndex(self.route(self.queryset), self.fields)
+
+    def get_rows(self, qs):
+        return True if qs is self.queryset else None
+
+
+class SampledBackend(SQLBackend):
+    """
+    Backend that does the counts for queryset on its first sample_size rows
+    (in primary key order), scaled up to rows. Other QuerySets, and queries
+    that aren't counts, are done as by SQLBackend.
+    """
+
+    def __init__(self, filterset, queryset, sample_size, rows):
+        super(SampledBackend, self).__init__(filterset)
+        self.queryset = queryset
+        self.sample, self.factor = self.get_sample(queryset, sample_size,
+                                                   rows)
+
+    def get_sample(self, qs, sample_size, rows):
+        last = list(self.route(qs).order_by('pk')
+                    .values_list('pk', flat=True)[sample_size - 1:sample_size])
+        if not last:
+            # Fewer rows than the sample, so all of them are counted.
+            return qs, 1
+        return qs.filter(pk__lte=last[0]), float(rows) / sample_size
+
+    def scale(self, count):
+        if not count:
+            return count
+        return max(1, int(round(count * self.factor)))
+
+    def scale_items(self, items):
+        return [(key, self.scale(count)) for key, count in items]
+
+    def value_counts(self, qs, fieldname):
+        if qs is not self.queryset:
+            return super(SampledBackend, self).value_counts(qs, fieldname)
+        counts = super(SampledBackend, self).value_counts(self.sample,
+                                                          fieldname)
+        return OrderedDict(self.scale_items(counts.items()))
+
+    def null_count(self, qs, fieldname):
+        if qs is not self.queryset:
+            return super(SampledBackend, self).null_count(qs, fieldname)
+        return self.scale(super(SampledBackend, self).null_count(self.sample,
+                                                                 fieldname))
+
+    def numeric_range_counts(self, qs, fieldname, ranges):
+        if qs is not self.queryset:
+            return super(SampledBackend, self).numeric_range_counts(
+                qs, fieldname, ranges)
+        counts = super(SampledBackend, self).numeric_range_counts(
+            self.sample, fieldname, ranges)
+        return OrderedDict(self.scale_items(counts.items()))
+
+    def date_counts(self, qs, fieldname, kind, limit=None):
+        if qs is not self.queryset:
+            return super(SampledBackend, self).date_counts(qs, fieldname, kind,
+                                                           limit=limit)
+        return self.scale_items(super(SampledBackend, self).date_counts(
+            self.sample, fieldname, kind, limit=limit))
+
+    def date_bucket_counts(self, qs, fieldname, kind, first, bucketsize):
+        if qs is not self.queryset:
+            return super(SampledBackend, self).date_bucket_counts(
+                qs, fieldname, kind, first, bucketsize)
+        return self.scale_items(super(SampledBackend, self).date_bucket_counts(
+            self.sample, fieldname, kind, first, bucketsize))
+
+    def m2m_value_counts(self, qs, fieldname, exclude=()):
+        if qs is not self.queryset:
+            return super(SampledBackend, self).m2m_value_counts(
+                qs, fieldname, exclude=exclude)
+        counts = super(SampledBackend, self).m2m_value_counts(
+            self.sample, fieldname, exclude=exclude)
+        return OrderedDict(self.scale_items(counts.items()))
+
+    def conditional_counts(self, qs, conditions):
+        if qs is not self.queryset:
+            return super(SampledBackend, self).conditional_counts(qs,
+                                                                  conditions)
+        counts = super(SampledBackend, self).conditional_counts(self.sample,
+                                                                conditions)
+        # The numbers of distinct values are not scaled.
+        return [count if c[1] == 'distinct' else self.scale(count)
+                for c, count in zip(conditions, counts)]
+
+
+@contextmanager
+def swapped(obj, **attrs):
+    """
+    Context manager that sets attributes of obj, restoring them afterwards.
+    """
+    saved = dict((name, getattr(obj, name)) for name in attrs)
+    for name, value in attrs.items():
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(obj, name, value)
+
+
+class FacetPlanner(object):
+    """
+    Chooses a strategy for computing the counts of each filter, see the module
+    docstring. The planner is shared by the requests for a FilterSet class,
+    as it holds the history of timings.
+    """
+
+    def __init__(self, page_budget=None, slow_facet=0.1, python_max_rows=1000,
+                 sample_min_rows=100000, sample_size=10000, count_cap=1000,
+                 history=None):
+        self.page_budget = page_budget
+        self.slow_facet = slow_facet
+        self.python_max_rows = python_max_rows
+        self.sample_min_rows = sample_min_rows
+        self.sample_size = sample_size
+        self.count_cap = count_cap
+        if history is None:
+            history = TimingHistory()
+        self.history = history
+
+    def get_choices(self, filterset, filter_, qs):
+        """
+        Returns the choices of filter_ for qs, computed by the strategy that
+        plan() chooses, recording the FacetStats in filterset.facet_stats.
+        """
+        stats = self.plan(filterset, filter_, qs)
+        filterset.facet_stats[filter_.field] = stats
+        start = time.time()
+        try:
+            return self.run(stats, filterset, filter_, qs)
+        finally:
+            stats.elapsed = time.time() - start
+            if stats.strategy == EXACT and stats.counted:
+                self.history.record(self.get_history_key(filterset, filter_),
+                                    stats.elapsed)
+
+    def get_history_key(self, filterset, filter_):
+        return (filterset.__class__, filter_.field)
+
+    def plan(self, filterset, filter_, qs):
+        """
+        Returns the FacetStats for computing the choices of filter_ for qs.
+        """
+        conditional_qs = getattr(filter_, '_conditional_counts', (None,))[0]
+        if (not (filter_.show_counts or filter_.order_by_count) or
+                conditional_qs is qs):
+            # Nothing to count, or counted already.
+            return FacetStats(EXACT, counted=False)
+        rows = self.get_rows(filterset, qs)
+        estimate = self.history.get(self.get_history_key(filterset, filter_))
+        spent = sum((s.estimate or 0) if s.elapsed is None else s.elapsed
+                    for s in list(filterset.facet_stats.values()))
+        strategy = self.choose(filter_, rows, estimate, spent)
+        return FacetStats(strategy, rows=rows, estimate=estimate)
+
+    def choose(self, filter_, rows, estimate, spent):
+        """
+        Returns the strategy for filter_, given the estimated number of rows
+        and seconds (either may be None), and the seconds spent on the other
+        filters so far.
+        """
+        if rows is not None and rows <= self.python_max_rows:
+            return PYTHON
+        if (self.page_budget is not None and estimate is not None and
+                spent + estimate > self.page_budget):
+            return SKIPPED
+        if ((estimate is not None and estimate > self.slow_facet) or
+                (rows is not None and rows >= self.sample_min_rows)):
+            if filter_.supports_count_cap and filter_.count_cap is None:
+                return CAPPED
+            if rows is not None and rows > self.sample_size:
+                return SAMPLED
+        return EXACT
+
+    def run(self, stats, filterset, filter_, qs):
+        strategy = stats.strategy
+        if strategy == SKIPPED:
+            return filter_.get_choices_remove(qs)
+        if strategy == CAPPED:
+            with swapped(filter_, count_cap=self.count_cap):
+                return filter_.get_choices(qs)
+        if strategy == PYTHON:
+            backend = PythonBackend(filterset, qs, [filter_.field])
+        elif strategy == SAMPLED:
+            backend = SampledBackend(filterset, qs, self.sample_size,
+                                     stats.rows)
+        else:
+            return filter_.get_choices(qs)
+        with swapped(filter_, backend=backend):
+            choices = filter_.get_choices(qs)
+        if strategy == SAMPLED:
+            # The counts are estimates, so don't add up to the total.
+            filter_._total_count = (None, None)
+        return choices
+
+    def get_rows(self, filterset, qs):
+        """
+        Returns the estimated number of rows in qs, or None if there are more
+        than python_max_rows and the database gives no estimate. Estimates are
+        made once per QuerySet.
+        """
+        estimates = filterset.__dict__.setdefault('_row_estimates', {})
+        if id(qs) not in estimates:
+            estimates[id(qs)] = (qs, self.estimate_rows(filterset, qs))
+        return estimates[id(qs)][1]
+
+    def estimate_rows(self, filterset, qs):
+        qs = filterset.backend.route(qs).order_by()
+        rows = qs[:self.python_max_rows + 1].count()
+        if rows <= self.python_max_rows:
+            return rows
+        try:
+            sql, params = qs.query.get_compiler(qs.db).as_sql()
+        except EmptyResultSet:
+            return 0
+        plan = explain_query(connections[qs.db], sql, params)
+        if plan is None or plan.rows is None:
+            return None
+        return max(plan.rows, rows)
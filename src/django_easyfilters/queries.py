@@ -1,4 +1,6 @@
 from django import VERSION
+from django.conf import settings
+from django.db import connections
 from django.db import models
 from django.db.backends.utils import typecast_timestamp
 from django.db.models.sql.compiler import SQLCompiler
@@ -10,12 +12,75 @@ except ImportError:
 from django.db.models.sql.subqueries import AggregateQuery
 from collections import OrderedDict
 
+from .utils import get_model_field
+
+if VERSION >= (1, 8):
+    from django.db.models import Case
+    from django.db.models import F
+    from django.db.models import Func
+    from django.db.models import Q
+    from django.db.models import Value
+    from django.db.models import When
+    from django.db.models.expressions import DateTime
+    from django.utils import timezone
+
+
+def bucket_sql(connection, extract_sql, first, bucketsize):
+    """
+    Returns SQL for the number of the bucket of bucketsize that the year, month
+    or day extract_sql falls in, counting from first.
+    """
+    sql = '(%s - %d) / %d' % (extract_sql, first, bucketsize)
+    if connection.vendor != 'sqlite':
+        # SQLite divides integers exactly, but has no FLOOR.
+        sql = 'FLOOR(%s)' % sql
+    return sql
+
+
+def date_counts(qs, fieldname, kind, limit=None, buckets=None):
+    """
+    Returns a list of (date, count) of the values of the date field fieldname,
+    truncated to kind ('year', 'month' or 'day'), or only the first limit of
+    them. See date_aggregation for buckets.
+    """
+    field_obj, m2m = get_model_field(qs.model, fieldname)
+    is_datetime = isinstance(field_obj, models.DateTimeField)
+    if VERSION < (1, 8):
+        if VERSION >= (1, 6) and is_datetime:
+            date_qs = qs.datetimes(fieldname, kind)
+        else:
+            date_qs = qs.dates(fieldname, kind)
+        return date_aggregation(date_qs, limit=limit, buckets=buckets)
+
+    # A flat GROUP BY on the truncated date, or on the bucket number.
+    qs = qs.filter(**{fieldname + '__isnull': False})
+    if buckets is not None:
+        group = DateBucket(F(fieldname), is_datetime, *buckets)
+    elif is_datetime:
+        tzinfo = timezone.get_current_timezone() if settings.USE_TZ else None
+        group = DateTime(fieldname, kind, tzinfo)
+    else:
+        group = Date(fieldname, kind)
+    rows = (qs.annotate(easyfilters_group=group)
+            .values_list('easyfilters_group')
+            .annotate(models.Count('pk'))
+            .order_by('easyfilters_group'))
+    if limit is not None:
+        rows = rows[:limit]
+    return list(rows)
+
 
 # Some fairly brittle, low level stuff, to get the aggregation
-# queries we need.
+# queries we need on Django < 1.8, which has no public expressions.
 
 
 class DateAggregateQuery(AggregateQuery):
+    # The maximum number of rows to return, or None
+    limit = None
+    # (kind, first, bucketsize) to count dates in buckets of bucketsize
+    # years/months/days, numbered from first, rather than each date.
+    buckets = None
+
     # Need to override to return a compiler not in django.db.models.sql.compiler
     def get_compiler(self, using=None, connection=None):
         return DateAggregateCompiler(self, connection, using)
@@ -28,24 +93,37 @@ class DateAggregateQuery(AggregateQuery):
 
 class DateAggregateCompiler(SQLCompiler):
     def results_iter(self):
-        needs_string_cast = self.connection.features.needs_datetime_string_cast
+        needs_string_cast = (self.connection.features.needs_datetime_string_cast
+                             and self.query.buckets is None)
 
         for rows in self.execute_sql(MULTI):
             for row in rows:
                 if needs_string_cast:
                     vals = [typecast_timestamp(str(row[0])),
                             row[1]]
+                elif self.query.buckets is not None:
+                    vals = (int(row[0]), row[1])
                 else:
                     vals = row
                 yield vals
 
     def as_sql(self, qn=None):
+        if self.query.buckets is None:
+            group = DateWithAlias.alias
+        else:
+            kind, first, bucketsize = self.query.buckets
+            group = bucket_sql(
+                self.connection,
+                self.connection.ops.date_extract_sql(kind, DateWithAlias.alias),
+                first, bucketsize)
         sql = ('SELECT %s, COUNT(%s) '
                'FROM (%s) subquery '
                'GROUP BY (%s) '
                'ORDER BY (%s)'
-               % (DateWithAlias.alias, DateWithAlias.alias, self.query.subquery,
-                  DateWithAlias.alias, DateWithAlias.alias))
+               % (group, DateWithAlias.alias, self.query.subquery,
+                  group, group))
+        if self.query.limit is not None:
+            sql += ' LIMIT %d' % self.query.limit
         params = self.query.sub_params
         return (sql, params)
 
@@ -62,9 +140,14 @@ class DateWithAlias(Date):
                     + ' as ' + self.alias)
 
 
-def date_aggregation(date_qs):
+def date_aggregation(date_qs, limit=None, buckets=None):
     """
-    Performs an aggregation for a supplied DateQuerySet
+    Performs an aggregation for a supplied DateQuerySet, returning a list of
+    (date, count), or only the first limit of them.
+
+    If buckets is given, as (kind, first, bucketsize), the dates are counted
+    in buckets of bucketsize years, months or days (as kind), numbered from
+    first, returning a list of (bucket number, count) instead.
     """
     # The DateQuerySet gives us a query that we need to clone and hack
     date_q = date_qs.query.clone()
@@ -82,9 +165,42 @@ def date_aggregation(date_qs):
     # Now use as a subquery to do aggregation
     query = DateAggregateQuery(date_qs.model)
     query.add_subquery(date_q, date_qs.db)
+    query.limit = limit
+    query.buckets = buckets
     return query.get_counts(date_qs.db)
 
 
+if VERSION >= (1, 8):
+    class DateBucket(Func):
+        """
+        The number of the bucket of bucketsize years, months or days (as kind)
+        that a date falls in, counting from first.
+        """
+
+        def __init__(self, expression, is_datetime, kind, first, bucketsize):
+            super(DateBucket, self).__init__(
+                expression, output_field=models.IntegerField())
+            self.is_datetime = is_datetime
+            self.kind, self.first, self.bucketsize = kind, first, bucketsize
+
+        def as_sql(self, compiler, connection):
+            sql, params = compiler.compile(self.source_expressions[0])
+            if self.is_datetime:
+                tzname = (timezone.get_current_timezone_name()
+                          if settings.USE_TZ else None)
+                sql, tz_params = connection.ops.datetime_extract_sql(
+                    self.kind, sql, tzname)
+                params = list(params) + list(tz_params)
+            else:
+                sql = connection.ops.date_extract_sql(self.kind, sql)
+            return (bucket_sql(connection, sql, self.first, self.bucketsize),
+                    params)
+
+        def convert_value(self, value, expression, connection, context):
+            # FLOOR returns a float on some databases.
+            return int(value)
+
+
 def value_counts(qs, fieldname):
     """
     Performs a simple query returning the count of each value of
@@ -167,18 +283,35 @@ class NumericValueRange(object):
 
 
 def numeric_range_counts(qs, fieldname, ranges):
-
-    # Build the query:
-    query = qs.values_list(fieldname).query.clone()
-    if VERSION >= (1, 6):
-        col, field = query.select[0]
-        query.select[0] = NumericValueRange(col, ranges), field
+    """
+    Returns an OrderedDict of {range: count} for the list of ranges (lower,
+    upper), where the lower bound is exclusive apart from for the first range.
+    """
+    if VERSION >= (1, 8):
+        # A flat GROUP BY on the number of the range.
+        whens = ([When(Q(**{fieldname + '__gt': lower,
+                            fieldname + '__lte': upper}), then=Value(i))
+                  for i, (lower, upper) in enumerate(ranges)] +
+                 # An inclusive lower limit for the first item in ranges:
+                 [When(Q(**{fieldname: ranges[0][0]}), then=Value(0))])
+        results = (qs.annotate(easyfilters_range=Case(
+                       *whens, default=Value(len(ranges)),
+                       output_field=models.IntegerField()))
+                   .values_list('easyfilters_range')
+                   .annotate(models.Count('pk'))
+                   .order_by('easyfilters_range'))
     else:
-        query.select[0] = NumericValueRange(query.select[0], ranges)
+        # Build the query:
+        query = qs.values_list(fieldname).query.clone()
+        if VERSION >= (1, 6):
+            col, field = query.select[0]
+            query.select[0] = NumericValueRange(col, ranges), field
+        else:
+            query.select[0] = NumericValueRange(query.select[0], ranges)
 
-    agg_query = NumericAggregateQuery(qs.model)
-    agg_query.add_subquery(query, qs.db)
-    results = agg_query.get_counts(qs.db)
+        agg_query = NumericAggregateQuery(qs.model)
+        agg_query.add_subquery(query, qs.db)
+        results = agg_query.get_counts(qs.db)
 
     count_dict = OrderedDict()
     for val, count in results:
@@ -189,3 +322,167 @@ def numeric_range_counts(qs, fieldname, ranges):
             r = ranges[-1]
         count_dict[r] = count
     return count_dict
+
+
+def conditional_counts(qs, conditions):
+    """
+    Counts the rows of the QuerySet that match each of the conditions, using a
+    single aggregate query with one COUNT(CASE WHEN ...) column per condition.
+    Returns a list of counts, in the same order as conditions.
+
+    Each condition is a tuple (fieldname, lookup_type, value), where fieldname
+    must be a field of the QuerySet's model, and lookup_type is one of:
+
+    * 'exact': the field is equal to value (or NULL, if value is None)
+    * 'in': the field is one of the list value (or NULL, if it contains None)
+    * 'range': value is (lower, upper, lower_inclusive), and the field is
+      between lower and upper, including upper.
+    * 'distinct': counts the distinct non-NULL values of the field.
+
+    If fieldname is None, all the rows are counted.
+
+    A condition can have a fourth item, a list of further (fieldname,
+    lookup_type, value) tests that the rows counted must also match.
+    """
+    if VERSION >= (1, 8):
+        return conditional_counts_expressions(qs, conditions)
+
+    connection = connections[qs.db]
+    qn = connection.ops.quote_name
+    table = qn(qs.model._meta.db_table)
+
+    def test_sql(fieldname, lookup_type, value):
+        field = qs.model._meta.get_field(fieldname)
+        col = '%s.%s' % (table, qn(field.column))
+
+        def prep(lookup_type, value):
+            return list(field.get_db_prep_lookup(lookup_type, value,
+                                                 connection=connection))
+
+        if lookup_type == 'exact' and value is None:
+            return '%s IS NULL' % col, []
+        elif lookup_type == 'exact':
+            return '%s = %%s' % col, prep('exact', value)
+        elif lookup_type == 'in':
+            values = [v for v in value if v is not None]
+            tests, params = [], []
+            if values:
+                tests.append('%s IN (%s)'
+                             % (col, ', '.join(['%s'] * len(values))))
+                params = prep('in', values)
+            if len(values) < len(value):
+                tests.append('%s IS NULL' % col)
+            if not tests:
+                return '1 = 0', []
+            return '(%s)' % ' OR '.join(tests), params
+        elif lookup_type == 'range':
+            lower, upper, lower_inclusive = value
+            return ('%s %s %%s AND %s <= %%s'
+                    % (col, '>=' if lower_inclusive else '>', col),
+                    prep('gte' if lower_inclusive else 'gt', lower) +
+                    prep('lte', upper))
+        else:
+            raise ValueError("Unknown lookup type %r" % lookup_type)
+
+    select = OrderedDict()
+    select_params = []
+    for i, condition in enumerate(conditions):
+        fieldname, lookup_type, value = condition[:3]
+        tests, params = [], []
+        if fieldname is not None and lookup_type != 'distinct':
+            sql, test_params = test_sql(fieldname, lookup_type, value)
+            tests.append(sql)
+            params.extend(test_params)
+        for where in (condition[3] if len(condition) > 3 else ()):
+            sql, test_params = test_sql(*where)
+            tests.append(sql)
+            params.extend(test_params)
+
+        alias = 'easyfilter_count_%d' % i
+        if lookup_type == 'distinct':
+            col = '%s.%s' % (table,
+                             qn(qs.model._meta.get_field(fieldname).column))
+            if tests:
+                select[alias] = ('COUNT(DISTINCT CASE WHEN %s THEN %s END)'
+                                 % (' AND '.join(tests), col))
+            else:
+                select[alias] = 'COUNT(DISTINCT %s)' % col
+        elif tests:
+            select[alias] = ('COUNT(CASE WHEN %s THEN 1 END)'
+                             % ' AND '.join(tests))
+        else:
+            select[alias] = 'COUNT(*)'
+        select_params.extend(params)
+
+    rows = list(qs.extra(select=select, select_params=select_params)
+                .values_list(*select.keys())
+                .order_by())
+    if not rows:
+        # The ORM can tell the QuerySet is empty without querying the DB.
+        return [0] * len(conditions)
+    return list(rows[0])
+
+
+def condition_q(fieldname, lookup_type, value):
+    """
+    Returns a Q for a test of conditional_counts, or None if nothing can match.
+    """
+    if lookup_type == 'exact' and value is None:
+        return Q(**{fieldname + '__isnull': True})
+    elif lookup_type == 'exact':
+        return Q(**{fieldname: value})
+    elif lookup_type == 'in':
+        values = [v for v in value if v is not None]
+        q = Q(**{fieldname + '__in': values}) if values else None
+        if len(values) < len(value):
+            null_q = Q(**{fieldname + '__isnull': True})
+            q = null_q if q is None else q | null_q
+        return q
+    elif lookup_type == 'range':
+        lower, upper, lower_inclusive = value
+        return Q(**{fieldname + ('__gte' if lower_inclusive else '__gt'): lower,
+                    fieldname + '__lte': upper})
+    else:
+        raise ValueError("Unknown lookup type %r" % lookup_type)
+
+
+def conditional_counts_expressions(qs, conditions):
+    """
+    conditional_counts for Django >= 1.8, using a single aggregate() of
+    COUNT(CASE WHEN ...) expressions.
+    """
+    aggregates = {}
+    for i, condition in enumerate(conditions):
+        fieldname, lookup_type, value = condition[:3]
+        tests = []
+        if fieldname is not None and lookup_type != 'distinct':
+            tests.append(condition_q(fieldname, lookup_type, value))
+        for where in (condition[3] if len(condition) > 3 else ()):
+            tests.append(condition_q(*where))
+        if None in tests:
+            # Counts nothing.
+            continue
+
+        alias = 'easyfilter_count_%d' % i
+        if tests:
+            test = tests[0]
+            for q in tests[1:]:
+                test &= q
+        if lookup_type == 'distinct':
+            if tests:
+                aggregates[alias] = models.Count(
+                    Case(When(test, then=F(fieldname))), distinct=True)
+            else:
+                aggregates[alias] = models.Count(fieldname, distinct=True)
+        elif tests:
+            aggregates[alias] = models.Count(
+                Case(When(test, then=Value(1)),
+                     output_field=models.IntegerField()))
+        else:
+            aggregates[alias] = models.Count('*')
+
+    counts = qs.aggregate(**aggregates) if aggregates else {}
+    # The ORM can tell some QuerySets are empty without querying the DB, and
+    # gives None for them.
+    return [counts.get('easyfilter_count_%d' % i) or 0
+            for i in range(len(conditions))]
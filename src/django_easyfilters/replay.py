@@ -0,0 +1,149 @@
+"""
+Replays recorded query strings against a FilterSet, measuring latency and
+queries, used by the easyfilters_replay management command.
+"""
+
+from __future__ import unicode_literals
+
+import math
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import six
+from django.db import connections
+from django.http import QueryDict
+from six.moves import queue
+
+from .explain import QueryRecorder
+
+
+def percentile(values, p):
+    """
+    Returns the p'th percentile (0-100) of values, by the nearest-rank method.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def parse_query_string(line):
+    """
+    Returns the query string from a line of a log, which can be a bare query
+    string or a URL, or None for blank lines, comments and lines without a
+    query string (such as access log lines for URLs without one).
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if '?' in line:
+        # Anything after the URL, as in an access log line.
+        return line.split('?', 1)[1].split(' ', 1)[0]
+    if ' ' in line or '=' not in line or line.startswith('/'):
+        return None
+    return line
+
+
+class RequestTiming(object):
+
+    def __init__(self, query_string, elapsed, filters):
+        self.query_string = query_string
+        self.elapsed = elapsed      # Seconds for the whole request
+        self.filters = filters      # field: (seconds, number of queries)
+
+
+class ReplayStats(object):
+
+    def __init__(self, timings, elapsed, concurrency):
+        self.timings = timings
+        self.elapsed = elapsed
+        self.concurrency = concurrency
+
+    def latencies(self):
+        return [t.elapsed for t in self.timings]
+
+    def fields(self):
+        fields = []
+        for t in self.timings:
+            for field in t.filters:
+                if field not in fields:
+                    fields.append(field)
+        return fields
+
+    def filter_latencies(self, field):
+        return [t.filters[field][0] for t in self.timings
+                if field in t.filters]
+
+    def filter_queries(self, field):
+        return [t.filters[field][1] for t in self.timings
+                if field in t.filters]
+
+    def slowest(self, num):
+        return sorted(self.timings, key=lambda t: t.elapsed,
+                      reverse=True)[:num]
+
+
+def time_request(filterset_class, queryset, query_string):
+    start = time.time()
+    fs = filterset_class(queryset, QueryDict(query_string))
+    # Timed without the shared cache, and without filling it.
+    fs.cache_timeout = None
+    filters = OrderedDict()
+    # The queries for counts can go to another database (facet_using).
+    recorded_connections = [connections[queryset.db],
+                            fs.get_facet_connection(fs.qs)]
+    for f in fs.filters:
+        filter_start = time.time()
+        with QueryRecorder(*recorded_connections) as recorder:
+            fs.render_filter(f)
+        filters[f.field] = (time.time() - filter_start,
+                            len(recorder.queries))
+    return RequestTiming(query_string, time.time() - start, filters)
+
+
+def replay(filterset_class, queryset, query_strings, concurrency=1):
+    """
+    Constructs the FilterSet for each query string, and computes and renders
+    the choices of all its filters, using concurrency threads. Returns a
+    ReplayStats.
+    """
+    query_strings = list(query_strings)
+    start = time.time()
+    if concurrency <= 1:
+        timings = [time_request(filterset_class, queryset, q)
+                   for q in query_strings]
+        return ReplayStats(timings, time.time() - start, 1)
+
+    pending = queue.Queue()
+    for q in query_strings:
+        pending.put(q)
+    timings = []
+    errors = []
+
+    def work():
+        try:
+            while True:
+                try:
+                    q = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    timings.append(time_request(filterset_class, queryset, q))
+                except Exception:
+                    errors.append(sys.exc_info())
+                    return
+        finally:
+            for conn in connections.all():
+                conn.close()
+
+    threads = [threading.Thread(target=work) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        six.reraise(*errors[0])
+    return ReplayStats(timings, time.time() - start, concurrency)
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent by a FilterSet when the queries for a filter's choices take longer than
+# the filter's timeout, with the name of the field and the timeout.
+facet_timeout = Signal(providing_args=['filterset', 'field', 'timeout'])
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from south.db import db
+from south.v2 import SchemaMigration
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        db.create_table(u'django_easyfilters_facetcount', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(max_length=100, db_index=True)),
+            ('key', self.gf('django.db.models.fields.CharField')(max_length=32, db_index=True)),
+            ('dimensions', self.gf('django.db.models.fields.TextField')()),
+            ('field', self.gf('django.db.models.fields.CharField')(max_length=255, blank=True)),
+            ('value', self.gf('django.db.models.fields.TextField')(null=True)),
+            ('count', self.gf('django.db.models.fields.PositiveIntegerField')()),
+        ))
+        db.send_create_signal(u'django_easyfilters', ['FacetCount'])
+
+    def backwards(self, orm):
+        db.delete_table(u'django_easyfilters_facetcount')
+
+    models = {
+        u'django_easyfilters.facetcount': {
+            'Meta': {'object_name': 'FacetCount'},
+            'count': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'dimensions': ('django.db.models.fields.TextField', [], {}),
+            'field': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'max_length': '32', 'db_index': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100', 'db_index': 'True'}),
+            'value': ('django.db.models.fields.TextField', [], {'null': 'True'})
+        }
+    }
+
+    complete_apps = ['django_easyfilters']
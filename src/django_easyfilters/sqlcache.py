@@ -0,0 +1,282 @@
+"""
+A cache of the compiled SQL of facet queries, and a backend that uses it, so
+that requests whose FilterSet has the same shape (the same filters chosen, with
+the same number of values) skip building and compiling the QuerySets for their
+counts, and go straight to executing the SQL.
+
+The SQL of a facet query only depends on the shape of the FilterSet, while its
+parameters are the values of the chosen filters, plus constants. Which
+parameter comes from which chosen value is learnt from two requests of the
+same shape whose chosen values all differ: parameters that are the same in
+both are constants, and each of the others must match exactly one chosen
+value in both requests. If that is ambiguous, nothing is cached for the shape
+until another request has been seen, so the cached SQL is never bound to the
+wrong values.
+
+This relies on filters applying their choices as the lookups returned by
+lookup_from_choice (see backends.chosen_lookups), as the built in filters do.
+Only counts of integer and text fields are cached, since the values are
+fetched with a plain cursor and so skip the conversions that the ORM does.
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.db import connections
+from django.db import models
+from django.db.models.sql.constants import QUERY_TERMS
+from django.db.models.sql.datastructures import EmptyResultSet
+
+from .backends import SQLBackend
+from .backends import chosen_lookups
+from .backends import queryset_sql
+from .utils import LOOKUP_SEP
+from .utils import RelatedObject
+from .utils import get_model_field
+from .utils import get_through_fields
+
+# Field types whose values are the same from a cursor as from the ORM, for
+# all databases.
+RAW_VALUE_TYPES = ('AutoField', 'BigIntegerField', 'CharField', 'IntegerField',
+                   'PositiveIntegerField', 'PositiveSmallIntegerField',
+                   'SlugField', 'SmallIntegerField', 'TextField')
+
+
+class SQLTemplate(object):
+    """
+    The SQL of a query, and how to build its parameters from the values of
+    the chosen filters.
+    """
+
+    def __init__(self, sql, binder):
+        self.sql = sql
+        # A list of (slot, constant) for each parameter, where slot is the
+        # index of the chosen value to use, or None to use the constant.
+        self.binder = binder
+
+    def bind(self, values):
+        return [constant if slot is None else values[slot]
+                for slot, constant in self.binder]
+
+
+class SQLTemplateCache(object):
+    """
+    A thread safe cache of SQLTemplates, keyed by the shape of the query.
+    At most max_size shapes are kept, after which the cache starts again.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.templates = {}
+            self.observations = {}
+
+    def get(self, key):
+        return self.templates.get(key)
+
+    def learn(self, key, sql, params, values):
+        """
+        Records that the query of shape key compiled to (sql, params) for the
+        chosen values, returning the SQLTemplate for the shape if it could be
+        worked out.
+        """
+        params = list(params)
+        values = list(values)
+        with self.lock:
+            template = self.templates.get(key)
+            if template is not None:
+                return template
+            previous = self.observations.get(key)
+            self.observations[key] = (sql, params, values)
+            if previous is None:
+                return None
+            prev_sql, prev_params, prev_values = previous
+            if (prev_sql != sql or len(prev_params) != len(params) or
+                    any(a == b for a, b in zip(prev_values, values))):
+                return None
+            binder = []
+            for a, b in zip(prev_params, params):
+                if a == b:
+                    binder.append((None, b))
+                    continue
+                slots = [i for i in range(len(values))
+                         if prev_values[i] == a and values[i] == b]
+                if len(slots) != 1:
+                    return None
+                binder.append((slots[0], None))
+            if len(self.templates) >= self.max_size:
+                self.templates = {}
+                self.observations = {}
+            template = SQLTemplate(sql, binder)
+            self.templates[key] = template
+            del self.observations[key]
+            return template
+
+
+def lookup_params(model, key, value, connection):
+    """
+    Returns the list of SQL parameters for the filter() keyword argument
+    key=value, or None if it can't be worked out.
+    """
+    parts = key.split(LOOKUP_SEP)
+    lookup_type = 'exact'
+    if len(parts) > 1 and parts[-1] in QUERY_TERMS:
+        lookup_type = parts.pop()
+    try:
+        field_obj, m2m = get_model_field(model, LOOKUP_SEP.join(parts))
+    except Exception:
+        return None
+    if isinstance(field_obj, RelatedObject):
+        return None
+    if lookup_type == 'in':
+        value = [getattr(v, 'pk', v) for v in value]
+    else:
+        value = getattr(value, 'pk', value)
+    return list(field_obj.get_db_prep_lookup(lookup_type, value, connection))
+
+
+class CompiledSQLBackend(SQLBackend):
+    """
+    SQLBackend that caches the compiled SQL of value counts (including those
+    of ManyToMany fields) by the shape of the FilterSet, in template_cache.
+    Queries that can't be cached are done as by SQLBackend.
+    """
+
+    template_cache = SQLTemplateCache()
+
+    def __init__(self, filterset=None):
+        super(CompiledSQLBackend, self).__init__(filterset)
+        self._shape = None
+
+    def get_shape(self):
+        """
+        Returns (shape, values), where shape is a hashable key for the
+        FilterSet's class, QuerySet and chosen lookups, and values the list of
+        the SQL parameters of the chosen lookups, or (None, None) if the
+        FilterSet can't be cached.
+        """
+        if self._shape is None:
+            self._shape = self.compute_shape()
+        return self._shape
+
+    def compute_shape(self):
+        fs = self.filterset
+        base_sql = queryset_sql(fs.base_qs)
+        if base_sql is None:
+            return None, None
+        db = self.route(fs.qs).db
+        connection = connections[db]
+        lookups = []
+        values = []
+        try:
+            chosen = list(chosen_lookups(fs))
+        except ValueError:
+            return None, None
+        for key, value in chosen:
+            params = lookup_params(fs.model, key, value, connection)
+            if params is None:
+                return None, None
+            if params and None not in params:
+                lookups.append((key, len(params)))
+                values.extend(params)
+            else:
+                # The value is part of the SQL (e.g. IS NULL), so of the shape.
+                lookups.append((key, repr(params or value)))
+        shape = (fs.__class__, self.__class__, db, base_sql,
+                 tuple(lookups))
+        return shape, values
+
+    def can_cache(self, qs, fieldname):
+        fs = self.filterset
+        if fs is None or qs is not fs.qs or qs.query.distinct:
+            return False
+        try:
+            field_obj, m2m = get_model_field(qs.model, fieldname)
+        except Exception:
+            return False
+        if isinstance(field_obj, RelatedObject):
+            return False
+        if m2m:
+            field_obj = get_through_fields(field_obj, qs.model)[2]
+        if field_obj.rel is not None:
+            field_obj = field_obj.rel.get_related_field()
+        return field_obj.get_internal_type() in RAW_VALUE_TYPES
+
+    def fetch(self, qs, key, build):
+        """
+        Returns the rows of the query for key, using the cached SQL if there is
+        some, and otherwise the QuerySet that build() returns.
+        """
+        shape, values = self.get_shape()
+        if shape is None:
+            return list(build())
+        key = shape + key
+        template = self.template_cache.get(key)
+        if template is not None:
+            sql, params = template.sql, template.bind(values)
+        else:
+            query = build().query
+            try:
+                sql, params = query.get_compiler(qs.db).as_sql()
+            except EmptyResultSet:
+                return []
+            self.template_cache.learn(key, sql, params, values)
+        cursor = connections[qs.db].cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def counts_with_nulls(self, qs, key, make_qs, fieldname):
+        """
+        Does the equivalent of queries.value_counts(make_qs(), fieldname),
+        where make_qs builds a QuerySet from qs, and is only called if the SQL
+        isn't cached.
+        """
+        def build_null_count():
+            return (make_qs().filter(**{fieldname + '__isnull': True})
+                    .order_by().extra(select={'null_count': 'COUNT(*)'})
+                    .values_list('null_count'))
+
+        def build_counts():
+            return (make_qs().filter(**{fieldname + '__isnull': False})
+                    .values_list(fieldname).order_by(fieldname)
+                    .annotate(models.Count(fieldname)))
+
+        count_dict = OrderedDict()
+        null_count = self.fetch(qs, key + ('null',), build_null_count)
+        if null_count and null_count[0][0]:
+            count_dict[None] = null_count[0][0]
+        for val, count in self.fetch(qs, key + ('counts',), build_counts):
+            count_dict[val] = count
+        return count_dict
+
+    def value_counts(self, qs, fieldname):
+        if not self.can_cache(qs, fieldname):
+            return super(CompiledSQLBackend, self).value_counts(qs, fieldname)
+        qs = self.route(qs)
+        return self.counts_with_nulls(qs, ('value_counts', fieldname),
+                                      lambda: qs, fieldname)
+
+    def m2m_value_counts(self, qs, fieldname, exclude=()):
+        if not self.can_cache(qs, fieldname):
+            return super(CompiledSQLBackend, self).m2m_value_counts(
+                qs, fieldname, exclude=exclude)
+        qs = self.route(qs)
+        field_obj, m2m = get_model_field(qs.model, fieldname)
+        through, fkey_this, fkey_other = get_through_fields(field_obj,
+                                                            qs.model)
+
+        def make_qs():
+            return (through.objects.using(qs.db)
+                    .filter(**{fkey_this.name + '__in': qs})
+                    .exclude(**{fkey_other.name + '__in': exclude}))
+
+        return self.counts_with_nulls(
+            qs, ('m2m_value_counts', fieldname, len(exclude)), make_qs,
+            fkey_other.name)
@@ -0,0 +1,33 @@
+/*
+ * Replaces the placeholders output by a FilterSet with lazy = True by the HTML
+ * of each filter, fetched from the URL in the placeholder's
+ * data-easyfilters-url attribute.
+ */
+(function () {
+    "use strict";
+
+    function load(placeholder) {
+        var xhr = new XMLHttpRequest();
+        xhr.open("GET", placeholder.getAttribute("data-easyfilters-url"));
+        xhr.setRequestHeader("X-Requested-With", "XMLHttpRequest");
+        xhr.onload = function () {
+            if (xhr.status === 200) {
+                placeholder.outerHTML = xhr.responseText;
+            }
+        };
+        xhr.send();
+    }
+
+    function loadAll() {
+        var placeholders = document.querySelectorAll("[data-easyfilters-url]");
+        for (var i = 0; i < placeholders.length; i++) {
+            load(placeholders[i]);
+        }
+    }
+
+    if (document.readyState === "loading") {
+        document.addEventListener("DOMContentLoaded", loadAll);
+    } else {
+        loadAll();
+    }
+}());
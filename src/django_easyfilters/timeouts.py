@@ -0,0 +1,127 @@
+"""
+Time limits for the queries of a facet (see the timeout option of filters and
+FilterSet.facet_timeout).
+
+How queries are stopped depends on the database:
+
+* SQLite: a progress handler interrupts the queries once the time is up, so
+  the limit is for all the queries done within the block.
+* PostgreSQL: statement_timeout is set for the block, limiting each query.
+* MySQL (5.7.8 and later): max_execution_time is set for the block,
+  limiting each SELECT.
+
+Other databases are not limited. Within a transaction, the queries are run in
+a savepoint, so that a cancelled query doesn't break the transaction.
+"""
+
+import sys
+import time
+from contextlib import contextmanager
+
+from django.db import DatabaseError
+
+try:
+    from django.db.transaction import atomic
+except ImportError:  # Django < 1.6
+    atomic = None
+
+# The number of SQLite virtual machine instructions between checks of the
+# time.
+SQLITE_PROGRESS_STEPS = 1000
+
+
+class FacetTimeout(Exception):
+    """
+    Raised when the queries for a facet take longer than their time limit.
+    """
+
+
+def is_timeout_error(exc):
+    """
+    Returns True if the DatabaseError exc is from a query being cancelled.
+    """
+    cause = getattr(exc, '__cause__', None) or exc
+    if getattr(cause, 'pgcode', None) == '57014':  # query_canceled
+        return True
+    args = getattr(cause, 'args', ())
+    if args and args[0] in (1317, 3024):  # MySQL: interrupted, timed out
+        return True
+    return 'interrupted' in str(exc)  # SQLite
+
+
+def _limit_sqlite(connection, seconds):
+    if connection.connection is None:
+        connection.cursor().close()
+    raw = connection.connection
+    deadline = time.time() + seconds
+    raw.set_progress_handler(lambda: int(time.time() >= deadline),
+                             SQLITE_PROGRESS_STEPS)
+    return lambda: raw.set_progress_handler(None, 0)
+
+
+def _limit_setting(connection, show_sql, set_sql, value):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(show_sql)
+        previous = cursor.fetchone()[0]
+        cursor.execute(set_sql, [value])
+    finally:
+        cursor.close()
+
+    def restore():
+        cursor = connection.cursor()
+        try:
+            cursor.execute(set_sql, [previous])
+        finally:
+            cursor.close()
+    return restore
+
+
+def _limit_postgresql(connection, seconds):
+    return _limit_setting(connection, 'SHOW statement_timeout',
+                          'SET statement_timeout = %s',
+                          '%dms' % max(1, seconds * 1000))
+
+
+def _limit_mysql(connection, seconds):
+    return _limit_setting(connection, 'SELECT @@SESSION.max_execution_time',
+                          'SET SESSION max_execution_time = %s',
+                          int(max(1, seconds * 1000)))
+
+
+LIMITERS = {
+    'sqlite': _limit_sqlite,
+    'postgresql': _limit_postgresql,
+    'mysql': _limit_mysql,
+}
+
+
+@contextmanager
+def statement_timeout(connection, seconds):
+    """
+    Context manager that limits the time of the queries done on connection
+    within it to seconds, raising FacetTimeout if they are cancelled.
+    """
+    limiter = LIMITERS.get(connection.vendor)
+    if limiter is None:
+        yield
+        return
+    savepoint = None
+    if atomic is not None and getattr(connection, 'in_atomic_block', False):
+        savepoint = atomic(using=connection.alias)
+        savepoint.__enter__()
+    restore = limiter(connection, seconds)
+    try:
+        yield
+    except DatabaseError as e:
+        if savepoint is not None:
+            # Rolls back to the savepoint, so the transaction can go on.
+            savepoint.__exit__(*sys.exc_info())
+            savepoint = None
+        if is_timeout_error(e):
+            raise FacetTimeout("Queries took longer than %s seconds" % seconds)
+        raise
+    finally:
+        restore()
+        if savepoint is not None:
+            savepoint.__exit__(None, None, None)
@@ -6,6 +6,11 @@ try:
     from django.db.models.related import RelatedObject
 except ImportError:
     from django.db.models.fields.related import ForeignObjectRel as RelatedObject
+try:
+    from importlib import import_module
+except ImportError:  # Python 2.6
+    from django.utils.importlib import import_module
+
 from six import PY3
 
 
@@ -36,3 +41,60 @@ def get_model_field(model, f):
             opts = model._meta
     rel, model, direct, m2m = opts.get_field_by_name(parts[-1])
     return rel, m2m
+
+
+def get_through_fields(field_obj, model):
+    """
+    For a ManyToManyField of model, returns (through model, ForeignKey to
+    model, ForeignKey to the related model).
+    """
+    through = field_obj.rel.through
+    rel_model = field_obj.rel.to
+    assert rel_model != model, "Can't cope with this yet..."
+    fkey_this = [f for f in through._meta.fields
+                 if f.rel is not None and f.rel.to is model][0]
+    fkey_other = [f for f in through._meta.fields
+                  if f.rel is not None and f.rel.to is rel_model][0]
+    return through, fkey_this, fkey_other
+
+
+def import_object(path):
+    """
+    Imports an object given its dotted path, e.g. 'myapp.filters.BookFilters'.
+    """
+    module_name, _, name = path.rpartition('.')
+    if not module_name:
+        raise ImportError("%r is not a dotted path" % path)
+    module = import_module(module_name)
+    try:
+        return getattr(module, name)
+    except AttributeError:
+        raise ImportError("%r has no attribute %r" % (module_name, name))
+
+
+def get_model_by_label(label):
+    """
+    Returns the model for a label 'app_label.ModelName'.
+    """
+    try:
+        from django.apps import apps
+        get_model = apps.get_model
+    except ImportError:  # Django < 1.7
+        from django.db.models import get_model
+    app_label, _, model_name = label.partition('.')
+    model = get_model(app_label, model_name)
+    if model is None:  # Django < 1.7 returns None, later versions raise
+        raise LookupError("No model %r" % label)
+    return model
+
+
+def parse_filterset_spec(spec):
+    """
+    Parses 'path.to.FilterSet:app_label.ModelName', as used by the management
+    commands, returning (FilterSet class, model).
+    """
+    filterset_path, _, model_label = spec.partition(':')
+    if not model_label:
+        raise ValueError("%r should be of the form "
+                         "'path.to.FilterSet:app_label.ModelName'" % spec)
+    return import_object(filterset_path), get_model_by_label(model_label)
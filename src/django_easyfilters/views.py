@@ -0,0 +1,22 @@
+from django.http import Http404
+from django.http import HttpResponse
+
+from .filterset import FRAGMENT_PARAM
+
+
+def filter_fragment(request, filterset_class, queryset):
+    """
+    Renders the HTML for a single filter of a FilterSet, as requested by the
+    placeholders that FilterSet.render outputs when 'lazy' is True.
+
+    The filter is named by the FRAGMENT_PARAM query string parameter, the rest
+    of the query string is passed on to the FilterSet unchanged.
+    """
+    params = request.GET.copy()
+    field = params.pop(FRAGMENT_PARAM, [None])[0]
+    filterset = filterset_class(queryset, params)
+    try:
+        filter_ = filterset.get_filter(field)
+    except KeyError:
+        raise Http404("No filter for field %r" % field)
+    return HttpResponse(filterset.render_filter(filter_))
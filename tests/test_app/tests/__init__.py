@@ -1,2 +1,13 @@
-from .test_filterset import *
-from .test_ranges import *
\ No newline at end of file
+from .test_advisor import *
+from .test_bitmaps import *
+from .test_caching import *
+from .test_columnar import *
+from .test_export import *
+from .test_filterset import *
+from .test_materialized import *
+from .test_pagination import *
+from .test_planner import *
+from .test_ranges import *
+from .test_replay import *
+from .test_sqlcache import *
+from .test_timeouts import *
@@ -0,0 +1,111 @@
+from decimal import Decimal
+
+from django.http import QueryDict
+
+from django_easyfilters.filterset import FilterSet
+
+from test_app.models import Author, Book, Genre
+
+
+FIELDS = [
+    'binding',
+    'genre',
+    'authors',
+    'date_published',
+    'price',
+    'edition',
+]
+
+# The fields that are multiselect in test_multiselect_same_choices_as_sql.
+MULTISELECT_FIELDS = ['binding', 'genre', 'authors']
+
+
+class BackendEquivalenceMixin(object):
+    """
+    Tests that a FilterSet whose counts come from another backend gives the
+    same choices as one using SQL. Mix into a TestCase, and set
+    filterset_class (in setUp if it needs building).
+    """
+
+    fixtures = ['django_easyfilters_tests']
+
+    filterset_class = None
+
+    # The fields that test_no_queries expects to be counted without queries,
+    # or None if the backend always queries.
+    fields_without_queries = FIELDS
+
+    # The query string for test_no_queries.
+    no_queries_query_string = 'binding=H'
+
+    def get_sql_filterset_class(self):
+        return type(str('SQL' + self.filterset_class.__name__), (FilterSet,),
+                    {'fields': self.filterset_class.fields,
+                     'count_cap': self.filterset_class.count_cap})
+
+    def get_multiselect_filterset_class(self):
+        fields = [(f, dict(multiselect=True)) if f in MULTISELECT_FIELDS else f
+                  for f in self.filterset_class.fields]
+        return type(str('Multiselect' + self.filterset_class.__name__),
+                    (self.filterset_class,), {'fields': fields})
+
+    def assertSameChoices(self, query_string, queryset=None):
+        """
+        Asserts that filterset_class gives the same choices as SQL for
+        query_string, returning its FilterSet.
+        """
+        if queryset is None:
+            queryset = Book.objects.all()
+        params = QueryDict(query_string)
+        fs_sql = self.get_sql_filterset_class()(queryset, params)
+        fs = self.filterset_class(queryset, params)
+        for f in fs_sql.filters:
+            self.assertEqual(fs.get_filter_choices(f.field),
+                             fs_sql.get_filter_choices(f.field),
+                             "%s differs for %r" % (f.field, query_string))
+        return fs
+
+    def get_query_strings(self):
+        author = Author.objects.filter(book__isnull=False)[0]
+        genre = Genre.objects.filter(book__isnull=False)[0]
+        # Two authors of the same book.
+        milne = Author.objects.get(name='A. A. Milne')
+        shepard = Author.objects.get(name='E. H. Shepard')
+        return ['',
+                'binding=H',
+                'binding=H&binding=P',
+                'genre=%d' % genre.pk,
+                'genre--isnull=',
+                'genre=%d&genre--isnull=' % genre.pk,
+                'authors=%d' % author.pk,
+                'authors=%d&authors=%d' % (milne.pk, shepard.pk),
+                'binding=H&genre=%d' % genre.pk,
+                'binding=P&authors=%d' % author.pk,
+                'date_published=1818',
+                'date_published=1813..1814',
+                'price=3.50i..5.00i',
+                'edition=1&binding=P']
+
+    def test_same_choices_as_sql(self):
+        for query_string in self.get_query_strings():
+            self.assertSameChoices(query_string)
+
+    def test_multiselect_same_choices_as_sql(self):
+        self.filterset_class = self.get_multiselect_filterset_class()
+        for query_string in self.get_query_strings():
+            self.assertSameChoices(query_string)
+
+    def test_no_queries(self):
+        if self.fields_without_queries is None:
+            self.skipTest("The backend queries the database")
+        fs = self.filterset_class(Book.objects.all(),
+                                  QueryDict(self.no_queries_query_string))
+        with self.assertNumQueries(0):
+            for field in self.fields_without_queries:
+                fs.get_filter_choices(field)
+
+    def test_fallback_to_sql(self):
+        # A QuerySet other than the one the backend was set up for.
+        qs = Book.objects.filter(price__lt=Decimal('6.00'))
+        self.assertSameChoices('', queryset=qs)
+        self.assertSameChoices('binding=H', queryset=qs)
@@ -0,0 +1,73 @@
+from six import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.test import TestCase
+
+from django_easyfilters.advisor import IndexProposal, existing_indexes, missing_indexes, propose_indexes
+from django_easyfilters.filterset import FilterSet
+
+from test_app.models import Book
+
+
+class BookFilterSet(FilterSet):
+    fields = [
+        'binding',
+        'genre',
+        'authors',
+        'authors__likes',
+        'date_published',
+        'price',
+    ]
+
+
+SPEC = 'test_app.tests.test_advisor.BookFilterSet:test_app.Book'
+
+
+class TestIndexAdvisor(TestCase):
+
+    fixtures = ['django_easyfilters_tests']
+
+    def test_propose_indexes(self):
+        proposals = propose_indexes(BookFilterSet, Book)
+        for table, columns in [
+                ('test_app_book_authors', ['author_id', 'book_id']),
+                ('test_app_author', ['likes']),
+                ('test_app_book', ['genre_id', 'date_published']),
+                ('test_app_book', ['binding', 'price'])]:
+            self.assertIn(IndexProposal(table, columns, ''), proposals)
+        # Covered by the composite indexes.
+        self.assertNotIn(IndexProposal('test_app_book', ['binding'], ''),
+                         proposals)
+
+        # The primary key is already indexed.
+        proposals.append(IndexProposal('test_app_book', ['id'], ''))
+        missing = missing_indexes(connection, proposals)
+        self.assertNotIn(IndexProposal('test_app_book', ['id'], ''), missing)
+        self.assertIn(IndexProposal('test_app_book', ['binding', 'price'], ''),
+                      missing)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('easyfilters_index_advisor', SPEC, stdout=out)
+        source = out.getvalue()
+        compile(source, 'migration.py', 'exec')
+        self.assertIn('migrations.RunSQL', source)
+        self.assertIn('CREATE INDEX', source)
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('easyfilters_index_advisor', SPEC, benchmark=True,
+                     sample_database='replica', repeat=1, stdout=out)
+        self.assertIn('# BookFilterSet: ', out.getvalue())
+        # The indexes are dropped again.
+        self.assertNotIn(('binding', 'price'),
+                         existing_indexes(connections['replica'], 'test_app_book'))
+
+    def test_benchmark_needs_sample_database(self):
+        for options in [{}, {'sample_database': 'default'},
+                        {'sample_database': 'replica', 'database': 'replica'}]:
+            with self.assertRaises(CommandError):
+                call_command('easyfilters_index_advisor', SPEC, benchmark=True,
+                             stdout=StringIO(), **options)
@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from django.http import QueryDict
+from django.test import TestCase
+
+from django_easyfilters.bitmaps import BitmapBackend, BitmapIndex
+from django_easyfilters.filterset import FilterSet
+
+from test_app.models import Author, Book, Genre
+from test_app.tests.base import FIELDS, BackendEquivalenceMixin
+
+
+class TestBitmapIndex(BackendEquivalenceMixin, TestCase):
+
+    def setUp(self):
+        self.index = BitmapIndex(Book.objects.all(), FIELDS)
+
+        class BitmapBookFilterSet(FilterSet):
+            fields = FIELDS
+            backend_class = BitmapBackend
+            bitmap_index = self.index
+
+        self.filterset_class = BitmapBookFilterSet
+
+    def test_count_cap(self):
+        class CappedBookFilterSet(self.filterset_class):
+            count_cap = 2
+        self.filterset_class = CappedBookFilterSet
+        self.assertSameChoices('')
+        self.assertSameChoices('binding=H')
+
+    def test_max_values(self):
+        num_prices = Book.objects.values('price').distinct().count()
+        self.index = BitmapIndex(Book.objects.all(), FIELDS,
+                                 max_values=num_prices - 1)
+        self.filterset_class.bitmap_index = self.index
+        self.assertFalse(self.index.has_field('price'))
+        self.assertTrue(self.index.has_field('binding'))
+        self.assertSameChoices('')
+        self.assertSameChoices('price=3.50i..5.00i')
+        fs = self.filterset_class(Book.objects.all(), QueryDict('binding=H'))
+        with self.assertNumQueries(0):
+            fs.get_filter_choices('binding')
+
+    def test_incremental_updates(self):
+        self.index.connect()
+        try:
+            genre = Genre.objects.filter(book__isnull=False)[0]
+            author = Author.objects.all()[0]
+            book = Book.objects.create(name='New book', binding='H',
+                                       genre=genre, price=Decimal('7.50'))
+            self.assertSameChoices('')
+            book.authors.add(author)
+            self.assertSameChoices('authors=%d' % author.pk)
+            book.binding = 'P'
+            book.save()
+            self.assertSameChoices('binding=P')
+            author.book_set.remove(book)
+            self.assertSameChoices('authors=%d' % author.pk)
+            book.delete()
+            self.assertSameChoices('')
+        finally:
+            self.index.disconnect()
@@ -0,0 +1,223 @@
+import os
+import tempfile
+import threading
+
+from six import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import QueryDict
+from django.test import TestCase
+
+from django_easyfilters.advisor import benchmark
+from django_easyfilters.caching import Revalidator, canonical_query_string, get_cache, get_cache_key, warm
+from django_easyfilters.filterset import FilterSet
+from django_easyfilters.replay import replay
+
+from test_app.models import Book
+
+
+class CachedBookFilterSet(FilterSet):
+    fields = [
+        'binding',
+        'genre',
+        'authors',
+        'price',
+    ]
+    cache_timeout = 60
+
+
+class StaleBookFilterSet(CachedBookFilterSet):
+    # Entries are stale straight away.
+    cache_soft_timeout = 0
+
+    def __init__(self, *args, **kwargs):
+        super(StaleBookFilterSet, self).__init__(*args, **kwargs)
+        self.revalidated = []
+
+    def revalidate(self, filter_field, kind):
+        # Recorded instead of being done in the background, since the test
+        # database can't be used from other threads.
+        self.revalidated.append((filter_field, kind))
+
+
+SPEC = 'test_app.tests.test_caching.CachedBookFilterSet:test_app.Book'
+
+
+class TestCaching(TestCase):
+
+    fixtures = ['django_easyfilters_tests']
+
+    def setUp(self):
+        get_cache('default').clear()
+
+    def test_canonical_query_string(self):
+        self.assertEqual(
+            canonical_query_string(QueryDict('genre=2&binding=H&page=3'),
+                                   ignore=('page',)),
+            'binding=H&genre=2')
+        # The order of values is kept
+        self.assertEqual(canonical_query_string(QueryDict('a=2&a=1')),
+                         'a=2&a=1')
+
+    def test_cache_key(self):
+        fs1 = CachedBookFilterSet(Book.objects.all(),
+                                  QueryDict('genre=2&binding=H&page=2'))
+        fs2 = CachedBookFilterSet(Book.objects.all(),
+                                  QueryDict('binding=H&genre=2'))
+        fs3 = CachedBookFilterSet(Book.objects.filter(price__gt=1),
+                                  QueryDict('binding=H&genre=2'))
+        self.assertEqual(get_cache_key(fs1, 'genre', 'choices'),
+                         get_cache_key(fs2, 'genre', 'choices'))
+        self.assertNotEqual(get_cache_key(fs1, 'genre', 'choices'),
+                            get_cache_key(fs1, 'genre', 'html'))
+        self.assertNotEqual(get_cache_key(fs1, 'genre', 'choices'),
+                            get_cache_key(fs3, 'genre', 'choices'))
+
+    def test_cached_choices(self):
+        fs1 = CachedBookFilterSet(Book.objects.all(),
+                                  QueryDict('genre=2&binding=H'))
+        choices = dict((f.field, fs1.get_filter_choices(f.field))
+                       for f in fs1.filters)
+        fs2 = CachedBookFilterSet(Book.objects.all(),
+                                  QueryDict('binding=H&genre=2'))
+        with self.assertNumQueries(0):
+            for f in fs2.filters:
+                self.assertEqual(fs2.get_filter_choices(f.field),
+                                 choices[f.field])
+
+    def test_no_caching_by_default(self):
+        class BookFilterSet(FilterSet):
+            fields = ['authors']
+        BookFilterSet(Book.objects.all(), QueryDict('')).render()
+        fs = BookFilterSet(Book.objects.all(), QueryDict(''))
+        with self.assertNumQueries(3):
+            fs.get_filter_choices('authors')
+
+    def test_warm(self):
+        self.assertEqual(warm(CachedBookFilterSet, Book.objects.all(),
+                              ['', 'binding=H'], html=True), 2)
+        fs = CachedBookFilterSet(Book.objects.all(), QueryDict('binding=H'))
+        with self.assertNumQueries(0):
+            html = fs.render()
+        self.assertIn('Genre', html)
+
+    def test_warm_needs_cache_timeout(self):
+        class BookFilterSet(FilterSet):
+            fields = ['authors']
+        self.assertRaises(ValueError, warm, BookFilterSet, Book.objects.all(),
+                          [''])
+
+    def test_command(self):
+        fd, logfile = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('/books/?genre=2&binding=H\n'
+                        '/books/?binding=H&genre=2&page=2\n'
+                        'authors=1\n')
+            out = StringIO()
+            call_command('easyfilters_warm_cache', logfile, SPEC, rate=1000,
+                         stdout=out)
+        finally:
+            os.remove(logfile)
+        self.assertIn('for 2 query strings', out.getvalue())
+        fs = CachedBookFilterSet(Book.objects.all(), QueryDict('authors=1'))
+        with self.assertNumQueries(0):
+            for f in fs.filters:
+                fs.get_filter_choices(f.field)
+
+    def test_command_processes_need_shared_cache(self):
+        # The test settings use the local-memory cache.
+        with self.assertRaises(CommandError):
+            call_command('easyfilters_warm_cache', os.devnull, SPEC,
+                         processes=2, stdout=StringIO())
+
+    def test_stale_while_revalidate(self):
+        fs1 = StaleBookFilterSet(Book.objects.all(), QueryDict(''))
+        old_choices = fs1.get_filter_choices('genre')
+        self.assertEqual(fs1.revalidated, [])
+        Book.objects.filter(genre__isnull=False).update(genre=None)
+        fs2 = StaleBookFilterSet(Book.objects.all(), QueryDict(''))
+        with self.assertNumQueries(0):
+            self.assertEqual(fs2.get_filter_choices('genre'), old_choices)
+        self.assertEqual(fs2.revalidated, [('genre', 'choices')])
+        fs2.refresh_cached('genre', 'choices')
+        fs3 = StaleBookFilterSet(Book.objects.all(), QueryDict(''))
+        new_choices = fs3.get_filter_choices('genre')
+        self.assertNotEqual(new_choices, old_choices)
+        self.assertEqual(new_choices,
+                         CachedBookFilterSet(Book.objects.all(), QueryDict(''))
+                         .get_filter_choices('genre'))
+
+    def test_refresh_html(self):
+        fs1 = StaleBookFilterSet(Book.objects.all(), QueryDict(''))
+        fs1.render_filter(fs1.get_filter('genre'))
+        Book.objects.filter(genre__isnull=False).update(genre=None)
+        fs2 = StaleBookFilterSet(Book.objects.all(), QueryDict(''))
+        fs2.render_filter(fs2.get_filter('genre'))
+        self.assertEqual(fs2.revalidated, [('genre', 'html')])
+        fs2.refresh_cached('genre', 'html')
+        self.assertEqual(fs2.get_cached('genre', 'html'),
+                         fs2.render_filter_uncached(fs2.get_filter('genre')))
+
+    def test_fresh_not_revalidated(self):
+        class FreshBookFilterSet(StaleBookFilterSet):
+            cache_soft_timeout = 60
+        FreshBookFilterSet(Book.objects.all(),
+                           QueryDict('')).get_filter_choices('genre')
+        fs = FreshBookFilterSet(Book.objects.all(), QueryDict(''))
+        fs.get_filter_choices('genre')
+        self.assertEqual(fs.revalidated, [])
+
+    def test_diagnostics_not_cached(self):
+        qs = Book.objects.all()
+        # Cached choices that are out of date.
+        stale = CachedBookFilterSet(qs, QueryDict(''))
+        stale_choices = stale.get_filter_choices('genre')
+        Book.objects.filter(genre__isnull=False).update(genre=None)
+
+        fs = CachedBookFilterSet(qs, QueryDict('binding=H'))
+        fs.explain()
+        replay(CachedBookFilterSet, qs, ['binding=H'])
+        benchmark(CachedBookFilterSet, qs, repeat=1)
+        for field in CachedBookFilterSet.fields:
+            self.assertEqual(fs.get_cached(field, 'choices'), None)
+            self.assertEqual(fs.get_cached(field, 'html'), None)
+        self.assertEqual(stale.get_cached('genre', 'choices'), stale_choices)
+
+        # explain computes the choices, not using those cached.
+        self.assertTrue(stale.explain().get_plans('genre'))
+
+
+class TestRevalidator(TestCase):
+
+    def test_schedule(self):
+        revalidator = Revalidator()
+        started = threading.Event()
+        finish = threading.Event()
+        done = []
+
+        def refresh():
+            started.set()
+            finish.wait(5)
+            done.append('a')
+        self.assertTrue(revalidator.schedule('a', refresh))
+        started.wait(5)
+        # Already being recomputed.
+        self.assertFalse(revalidator.schedule('a', refresh))
+        self.assertTrue(revalidator.schedule('b', lambda: done.append('b')))
+        finish.set()
+        revalidator.join()
+        self.assertEqual(done, ['a', 'b'])
+        # Can be scheduled again once done.
+        self.assertTrue(revalidator.schedule('a', lambda: done.append('a')))
+        revalidator.join()
+        self.assertEqual(done, ['a', 'b', 'a'])
+
+    def test_errors(self):
+        revalidator = Revalidator()
+        done = []
+        revalidator.schedule('a', lambda: 1 / 0)
+        revalidator.schedule('b', lambda: done.append('b'))
+        revalidator.join()
+        self.assertEqual(done, ['b'])
@@ -0,0 +1,43 @@
+from decimal import Decimal
+import unittest
+
+from django.http import QueryDict
+from django.test import TestCase
+
+from django_easyfilters.columnar import ColumnarBackend, ColumnarSnapshot, numpy
+from django_easyfilters.filterset import FilterSet
+
+from test_app.models import Book
+from test_app.tests.base import FIELDS, BackendEquivalenceMixin
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class TestColumnarSnapshot(BackendEquivalenceMixin, TestCase):
+
+    # ManyToMany fields are not loaded, so 'authors' uses SQL.
+    fields_without_queries = [f for f in FIELDS if f != 'authors']
+    no_queries_query_string = 'binding=H&price=3.50i..5.00i'
+
+    def setUp(self):
+        self.snapshot = ColumnarSnapshot(Book.objects.all(), FIELDS)
+
+        class ColumnarBookFilterSet(FilterSet):
+            fields = FIELDS
+            backend_class = ColumnarBackend
+            columnar_snapshot = self.snapshot
+
+        self.filterset_class = ColumnarBookFilterSet
+
+    def test_no_queries(self):
+        self.assertFalse(self.snapshot.columns.has_field('authors'))
+        super(TestColumnarSnapshot, self).test_no_queries()
+
+    def test_refresh(self):
+        Book.objects.create(name='New book', binding='H',
+                            price=Decimal('7.50'))
+        fs = self.filterset_class(Book.objects.all(), QueryDict(''))
+        self.assertNotEqual(fs.get_filter_choices('binding'),
+                            self.get_sql_filterset_class()(Book.objects.all(), QueryDict(''))
+                            .get_filter_choices('binding'))
+        self.snapshot.max_age = 0
+        self.assertSameChoices('')
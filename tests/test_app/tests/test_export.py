@@ -0,0 +1,61 @@
+import csv
+import io
+import json
+
+import six
+from django.http import QueryDict
+from django.test import TestCase
+
+from django_easyfilters.export import export_response, iter_csv, iter_jsonlines
+from django_easyfilters.filterset import FilterSet
+
+from test_app.models import Book
+
+
+class TestExport(TestCase):
+
+    fixtures = ['django_easyfilters_tests']
+
+    def setUp(self):
+        class BookFilterSet(FilterSet):
+            fields = ['binding']
+
+        self.fs = BookFilterSet(Book.objects.all(), QueryDict('binding=P'))
+        self.columns = ['name', 'genre__name', 'price']
+        self.expected = list(self.fs.qs.order_by('pk')
+                             .values_list(*self.columns))
+        self.assertTrue(len(self.expected) > 3)
+
+    def test_csv(self):
+        lines = list(iter_csv(self.fs, self.columns, chunk_size=3))
+        content = b''.join(l if isinstance(l, bytes) else l.encode('utf-8')
+                           for l in lines)
+        if six.PY2:
+            rows = list(csv.reader(io.BytesIO(content)))
+        else:
+            rows = list(csv.reader(io.StringIO(content.decode('utf-8'))))
+        self.assertEqual(rows[0], self.columns)
+        self.assertEqual(rows[1:],
+                         [['' if v is None else str(v) for v in row]
+                          for row in self.expected])
+
+    def test_jsonlines(self):
+        lines = list(iter_jsonlines(self.fs.qs, self.columns))
+        self.assertEqual([json.loads(l)['name'] for l in lines],
+                         [row[0] for row in self.expected])
+
+    def test_chunked_queries(self):
+        num_chunks = len(self.expected) // 3 + 1
+        with self.assertNumQueries(num_chunks):
+            self.assertEqual(
+                len(list(iter_jsonlines(self.fs, self.columns,
+                                        chunk_size=3))),
+                len(self.expected))
+
+    def test_response(self):
+        response = export_response(self.fs, self.columns,
+                                   filename='books.csv')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="books.csv"')
+        content = b''.join(response.streaming_content)
+        self.assertEqual(len(content.splitlines()), len(self.expected) + 1)
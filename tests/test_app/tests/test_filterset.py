@@ -3,16 +3,21 @@
 from datetime import datetime, date
 from decimal import Decimal
 import operator
+import pickle
 import re
 
 from django.http import QueryDict
 from django.test import TestCase
+from django.test.client import RequestFactory
 from django.utils.datastructures import MultiValueDict
 from six import text_type
 
-from django_easyfilters.filterset import FilterSet
+from django_easyfilters.backends import SQLBackend
+from django_easyfilters.bitmaps import BitmapBackend, BitmapIndex
+from django_easyfilters.filterset import FilterSet, FRAGMENT_PARAM
+from django_easyfilters.views import filter_fragment
 from django_easyfilters.filters import \
-    FILTER_ADD, FILTER_REMOVE, FILTER_DISPLAY, \
+    FILTER_ADD, FILTER_REMOVE, FILTER_DISPLAY, FilterChoice, \
     ForeignKeyFilter, ValuesFilter, ChoicesFilter, ManyToManyFilter, DateTimeFilter, NumericRangeFilter
 
 from test_app.models import Book, Genre, Author, BINDING_CHOICES, Person
@@ -85,6 +90,420 @@ class TestFilterSet(TestCase):
         self.assertEqual(rendered, text_type(fs))
 
 
+    def test_lazy_render(self):
+        class BookFilterSet(FilterSet):
+            lazy = True
+            fragment_url = '/books/filter/'
+            fields = [
+                'genre',
+                'binding',
+                ]
+
+        qs = Book.objects.all()
+        fs = BookFilterSet(qs, QueryDict('binding=H'))
+        # Placeholders don't need any of the facets to be computed
+        with self.assertNumQueries(0):
+            rendered = fs.render()
+        self.assertTrue('Genre' in rendered)
+        self.assertTrue('/books/filter/?' in rendered)
+        self.assertEqual(rendered.count('data-easyfilters-url'), 2)
+        url = fs.get_fragment_url(fs.filters[0])
+        self.assertTrue(url.startswith('/books/filter/?'))
+        self.assertEqual(QueryDict(url.split('?', 1)[1]),
+                         QueryDict('binding=H&%s=genre' % FRAGMENT_PARAM))
+
+    def test_filter_fragment_view(self):
+        class BookFilterSet(FilterSet):
+            lazy = True
+            fields = [
+                'genre',
+                'binding',
+                ]
+
+        qs = Book.objects.all()
+        fs = BookFilterSet(qs, QueryDict('binding=H'))
+        request = RequestFactory().get(fs.get_fragment_url(fs.filters[0]))
+        response = filter_fragment(request, BookFilterSet, qs)
+        self.assertEqual(response.status_code, 200)
+        # Same output as non-lazy rendering, and links don't carry the
+        # fragment parameter
+        self.assertEqual(response.content.decode('utf-8'),
+                         fs.render_filter(fs.filters[0]))
+        self.assertFalse(FRAGMENT_PARAM in response.content.decode('utf-8'))
+
+
+    def test_iter_render(self):
+        class BookFilterSet(FilterSet):
+            fields = [
+                'genre',
+                'binding',
+                ]
+
+        qs = Book.objects.all()
+        fs = BookFilterSet(qs, QueryDict(''))
+        # Nothing is computed until the first chunk is asked for
+        with self.assertNumQueries(0):
+            chunks = fs.iter_render()
+        self.assertTrue('Genre' in next(chunks))
+        self.assertTrue('Binding' in next(chunks))
+        self.assertEqual(list(chunks), [])
+        self.assertEqual(u'\n'.join(fs.iter_render()), fs.render())
+
+    def test_iter_render_parallel(self):
+        # The in-memory test database can't be used from the worker threads,
+        # so the counts come from a BitmapIndex, without queries.
+        fields = ['genre', 'binding', 'authors', 'edition']
+
+        class BookFilterSet(FilterSet):
+            backend_class = BitmapBackend
+            bitmap_index = BitmapIndex(Book.objects.all(), fields)
+        BookFilterSet.fields = fields
+
+        qs = Book.objects.all()
+        sequential = BookFilterSet(qs, QueryDict('binding=H'))
+        chunks = list(BookFilterSet(qs, QueryDict('binding=H')).iter_render(parallel=True))
+        # Placeholders in the order of the filters, then the filters as they
+        # are done.
+        self.assertEqual(chunks[:len(fields)],
+                         [sequential.render_placeholder(f, fetch=False)
+                          for f in sequential.filters])
+        self.assertEqual(sorted(chunks[len(fields):]),
+                         sorted(sequential.render_fill(f)
+                                for f in sequential.filters))
+
+        class BrokenFilter(ValuesFilter):
+            def get_choices(self, qs):
+                raise ValueError("broken")
+
+        class BrokenBookFilterSet(BookFilterSet):
+            pass
+        BrokenBookFilterSet.fields = fields[:2] + [('edition', {}, BrokenFilter)]
+        fs = BrokenBookFilterSet(qs, QueryDict(''))
+        self.assertRaises(ValueError, list, fs.iter_render(parallel=True))
+
+    def test_render_fill(self):
+        class BookFilterSet(FilterSet):
+            fields = [
+                'genre',
+                ]
+
+        fs = BookFilterSet(Book.objects.all(), QueryDict(''))
+        placeholder = fs.render_placeholder(fs.filters[0], fetch=False)
+        self.assertTrue('data-easyfilters-field="genre"' in placeholder)
+        self.assertFalse('data-easyfilters-url' in placeholder)
+        fill = fs.render_fill(fs.filters[0])
+        self.assertTrue('data-easyfilters-field="genre"' in fill)
+        self.assertFalse('</div>' in fill)  # content must be escaped for JS
+
+
+    def test_conditional_counts_single_query(self):
+        """
+        Filters whose values are known up front are all counted with a single
+        query.
+        """
+        ranges = [(Decimal('3.50'), Decimal('5.00')),
+                  (Decimal('5.00'), Decimal('6.00')),
+                  (Decimal('6.00'), Decimal('50.00'))]
+
+        class BookFilterSet(FilterSet):
+            fields = [
+                'binding',
+                ('price', dict(ranges=ranges), NumericRangeFilter),
+                ]
+
+        qs = Book.objects.all()
+        fs = BookFilterSet(qs, QueryDict(''))
+        with self.assertNumQueries(1):
+            binding_choices = fs.get_filter_choices('binding')
+            price_choices = fs.get_filter_choices('price')
+
+        self.assertEqual([(c.label, c.count) for c in binding_choices],
+                         [(display, qs.filter(binding=val).count())
+                          for val, display in BINDING_CHOICES])
+        self.assertEqual([c.count for c in price_choices],
+                         [qs.filter(price__gte=Decimal('3.50'),
+                                    price__lte=Decimal('5.00')).count(),
+                          qs.filter(price__gt=Decimal('5.00'),
+                                    price__lte=Decimal('6.00')).count(),
+                          qs.filter(price__gt=Decimal('6.00'),
+                                    price__lte=Decimal('50.00')).count()])
+
+
+    def test_custom_backend(self):
+        """
+        Filters get their counts from the FilterSet's backend.
+        """
+        class InflatingBackend(SQLBackend):
+            def value_counts(self, qs, fieldname):
+                counts = super(InflatingBackend, self).value_counts(qs, fieldname)
+                return dict((val, count * 100) for val, count in counts.items())
+
+            def null_count(self, qs, fieldname):
+                return super(InflatingBackend, self).null_count(qs, fieldname) * 100
+
+            def m2m_value_counts(self, qs, fieldname, exclude=()):
+                counts = super(InflatingBackend, self).m2m_value_counts(
+                    qs, fieldname, exclude=exclude)
+                return dict((val, count * 100) for val, count in counts.items())
+
+        class BookFilterSet(FilterSet):
+            backend_class = InflatingBackend
+            fields = [
+                'genre',
+                'authors',
+                ]
+
+        qs = Book.objects.all()
+        fs = BookFilterSet(qs, QueryDict(''))
+        self.assertTrue(fs.backend.filterset is fs)
+        for f in fs.filters:
+            self.assertTrue(f.backend is fs.backend)
+            plain = type(f)(f.field, Book, QueryDict(''))
+            self.assertTrue(isinstance(plain.backend, SQLBackend))
+            self.assertEqual([c.count * 100 if c.count else c.count
+                              for c in plain.get_choices(qs)],
+                             [c.count for c in fs.get_filter_choices(f.field)])
+
+
+    def test_multiselect(self):
+        """
+        Multiselect filters match any of their chosen values, and count each
+        value against the QuerySet without their own choices.
+        """
+        class BookFilterSet(FilterSet):
+            fields = [
+                ('binding', dict(multiselect=True)),
+                ('genre', dict(multiselect=True)),
+                'authors',
+                ]
+
+        qs = Book.objects.all()
+        genre = Genre.objects.filter(book__binding='C')[0]
+        fs = BookFilterSet(qs, QueryDict('binding=H&binding=P&genre=%d' %
+                                         genre.pk))
+        self.assertEqual(set(fs.qs),
+                         set(qs.filter(binding__in=['H', 'P'], genre=genre)))
+
+        binding_choices = fs.get_filter_choices('binding')
+        self.assertEqual([c.link_type for c in binding_choices[:2]],
+                         [FILTER_REMOVE, FILTER_REMOVE])
+        added = [(c.label, c.count) for c in binding_choices[2:]]
+        self.assertEqual(added,
+                         [(display, qs.filter(genre=genre,
+                                              binding=val).count())
+                          for val, display in BINDING_CHOICES
+                          if val not in ('H', 'P') and
+                          qs.filter(genre=genre, binding=val).exists()])
+        self.assertTrue(added)
+        cloth = [c for c in binding_choices if c.label == 'Cloth'][0]
+        self.assertEqual(QueryDict(cloth.params.urlencode()).getlist('binding'),
+                         ['H', 'P', 'C'])
+
+        genre_choices = fs.get_filter_choices('genre')
+        self.assertEqual(genre_choices[0].link_type, FILTER_REMOVE)
+        in_bindings = qs.filter(binding__in=['H', 'P'])
+        for c in genre_choices[1:]:
+            self.assertEqual(c.link_type, FILTER_ADD)
+            if c.label != 'None':
+                self.assertEqual(c.count,
+                                 in_bindings.filter(genre__name=c.label).count())
+
+        # Other filters are counted against the fully filtered QuerySet.
+        for c in fs.get_filter_choices('authors'):
+            self.assertEqual(c.count,
+                             fs.qs.filter(authors__name=c.label).count())
+
+    def test_multiselect_null(self):
+        """
+        NULL stays chosen in the params of the other choices of a multiselect
+        filter.
+        """
+        class BookFilterSet(FilterSet):
+            fields = [('genre', dict(multiselect=True))]
+
+        qs = Book.objects.all()
+        fs = BookFilterSet(qs, QueryDict('genre--isnull='))
+        self.assertEqual(set(fs.qs), set(qs.filter(genre__isnull=True)))
+        choices = fs.get_filter_choices('genre')
+        self.assertEqual(choices[0].link_type, FILTER_REMOVE)
+        self.assertEqual(QueryDict(choices[0].params.urlencode()), QueryDict(''))
+        added = choices[1]
+        self.assertEqual(added.link_type, FILTER_ADD)
+        params = QueryDict(added.params.urlencode())
+        self.assertEqual(params.getlist('genre--isnull'), [''])
+        genre = Genre.objects.get(name=added.label)
+        self.assertEqual(params.getlist('genre'), [text_type(genre.pk)])
+
+        fs = BookFilterSet(qs, params)
+        self.assertEqual(set(fs.qs),
+                         set(qs.filter(genre__isnull=True)) |
+                         set(qs.filter(genre=genre)))
+        removes = [c for c in fs.get_filter_choices('genre')
+                   if c.link_type == FILTER_REMOVE]
+        self.assertEqual([QueryDict(c.params.urlencode()) for c in removes],
+                         [QueryDict('genre--isnull='),
+                          QueryDict('genre=%d' % genre.pk)])
+
+    def test_multiselect_single_query(self):
+        """
+        Filters with known values are still counted with a single query when
+        there are multiselect filters.
+        """
+        ranges = [(Decimal('3.50'), Decimal('5.00')),
+                  (Decimal('5.00'), Decimal('50.00'))]
+
+        class BookFilterSet(FilterSet):
+            fields = [
+                ('binding', dict(multiselect=True)),
+                ('price', dict(ranges=ranges), NumericRangeFilter),
+                ]
+
+        qs = Book.objects.all()
+        fs = BookFilterSet(qs, QueryDict('binding=H&binding=P'))
+        with self.assertNumQueries(1):
+            binding_choices = fs.get_filter_choices('binding')
+            price_choices = fs.get_filter_choices('price')
+        self.assertEqual([(c.label, c.count) for c in binding_choices
+                          if c.link_type == FILTER_ADD],
+                         [(display, qs.filter(binding=val).count())
+                          for val, display in BINDING_CHOICES
+                          if val not in ('H', 'P')])
+        in_bindings = qs.filter(binding__in=['H', 'P'])
+        self.assertEqual([c.count for c in price_choices],
+                         [in_bindings.filter(price__lte=Decimal('5.00')).count(),
+                          in_bindings.filter(price__gt=Decimal('5.00')).count()])
+
+    def test_total_count_from_facet(self):
+        """
+        total_count is derived from the counts of a complete facet.
+        """
+        class BookFilterSet(FilterSet):
+            fields = ['genre']
+
+        qs = Book.objects.all()
+        fs = BookFilterSet(qs, QueryDict(''))
+        fs.get_filter_choices('genre')
+        with self.assertNumQueries(0):
+            total_count = fs.total_count
+        self.assertEqual(total_count, qs.count())
+
+        # Computing total_count first computes the facet, so rendering needs
+        # no more queries.
+        fs = BookFilterSet(qs, QueryDict(''))
+        self.assertEqual(fs.total_count, qs.count())
+        with self.assertNumQueries(0):
+            fs.get_filter_choices('genre')
+
+    def test_count_cap(self):
+        """
+        With count_cap, counts above the cap are shown as the cap and a '+'.
+        """
+        fields = ['binding', 'genre', 'authors', 'edition']
+
+        class BookFilterSet(FilterSet):
+            pass
+        BookFilterSet.fields = fields
+
+        class CappedBookFilterSet(FilterSet):
+            count_cap = 2
+        CappedBookFilterSet.fields = fields
+
+        qs = Book.objects.all()
+        for query_string in ['', 'binding=H', 'genre--isnull=']:
+            fs = BookFilterSet(qs, QueryDict(query_string))
+            fs_capped = CappedBookFilterSet(qs, QueryDict(query_string))
+            for field in fields:
+                choices = fs.get_filter_choices(field)
+                capped_choices = fs_capped.get_filter_choices(field)
+                self.assertEqual([(c.label, min(c.count, 2) if c.count else c.count,
+                                   bool(c.count and c.count > 2))
+                                  for c in choices],
+                                 [(c.label, c.count, c.capped)
+                                  for c in capped_choices])
+        fs_capped = CappedBookFilterSet(qs, QueryDict(''))
+        self.assertTrue(any(c.capped for c in fs_capped.get_filter_choices('binding')))
+        self.assertTrue('(2+)' in fs_capped.render_filter(fs_capped.get_filter('binding')))
+
+        # Each value is counted by a subquery, all in one query.
+        fs_capped = CappedBookFilterSet(qs, QueryDict(''))
+        with self.assertNumQueries(1):
+            fs_capped.get_filter_choices('binding')
+
+        # Unless the values are known, at most count_cap_values are counted.
+        class FewValuesBookFilterSet(FilterSet):
+            count_cap = 2
+            fields = [
+                ('authors', dict(count_cap_values=1)),
+                ('edition', dict(count_cap_values=1)),
+                ]
+        fs_capped = FewValuesBookFilterSet(qs, QueryDict(''))
+        self.assertEqual(len(fs_capped.get_filter_choices('authors')), 1)
+        self.assertEqual(len(fs_capped.get_filter_choices('edition')), 1)
+
+    def test_total_count_from_conditional_counts(self):
+        """
+        total_count comes with the conditional aggregation query.
+        """
+        class BookFilterSet(FilterSet):
+            fields = [('binding', dict(multiselect=True)), 'authors']
+
+        qs = Book.objects.all()
+        fs = BookFilterSet(qs, QueryDict('binding=H&binding=P'))
+        with self.assertNumQueries(1):
+            total_count = fs.total_count
+            fs.get_filter_choices('binding')
+        self.assertEqual(total_count,
+                         qs.filter(binding__in=['H', 'P']).count())
+
+        class BookFilterSet(FilterSet):
+            fields = ['authors']
+
+        fs = BookFilterSet(qs, QueryDict(''))
+        self.assertEqual(fs.total_count, qs.count())
+
+    def test_multiselect_m2m_no_duplicates(self):
+        """
+        Items related to several of the chosen objects of a multiselect
+        ManyToManyFilter are counted once.
+        """
+        class BookFilterSet(FilterSet):
+            fields = [('authors', dict(multiselect=True)), 'binding', 'genre']
+
+        milne = Author.objects.get(name='A. A. Milne')
+        shepard = Author.objects.get(name='E. H. Shepard')
+        qs = Book.objects.all()
+        books = qs.filter(authors__in=[milne, shepard]).distinct()
+        fs = BookFilterSet(qs, QueryDict('authors=%d&authors=%d'
+                                         % (milne.pk, shepard.pk)))
+        self.assertEqual(fs.qs.count(), books.count())
+        self.assertEqual(fs.total_count, books.count())
+        for field in ['binding', 'genre']:
+            self.assertEqual(
+                sum(c.count for c in fs.get_filter_choices(field)),
+                books.exclude(**{field + '__isnull': True}).count())
+
+    def test_explain(self):
+        class BookFilterSet(FilterSet):
+            fields = ['binding', 'genre', 'authors', 'date_published', 'price']
+
+        fs = BookFilterSet(Book.objects.all(), QueryDict(''))
+        report = fs.explain()
+        self.assertEqual([name for name, plans in report.entries],
+                         ['qs', 'conditional counts', 'binding', 'genre',
+                          'authors', 'date_published', 'price'])
+        self.assertEqual(len(report.get_plans('qs')), 1)
+        self.assertTrue(report.get_plans('authors'))
+        # Nothing is filtered, so the table is scanned.
+        conditional_plan = report.get_plans('conditional counts')[0]
+        self.assertTrue(conditional_plan.full_scans)
+        self.assertIn(('conditional counts', conditional_plan),
+                      report.flagged())
+        self.assertIn('full scan', text_type(report))
+
+        # Queries are no longer recorded afterwards.
+        from django.db import connection
+        self.assertNotIn('make_debug_cursor', connection.__dict__)
+
     def test_get_filter_for_field(self):
         """
         Ensures that the get_filter_for_field method chooses appropriately.
@@ -148,6 +567,57 @@ class TestFilterSet(TestCase):
         self.assertEqual(f.title, "Classics")
 
 
+class TestFacetUsing(TestCase):
+
+    fixtures = ['django_easyfilters_tests']
+    multi_db = True
+
+    def test_facet_queries_use_replica(self):
+        class BookFilterSet(FilterSet):
+            fields = ['binding', 'genre', 'authors', 'edition',
+                      'date_published', 'price']
+            facet_using = 'replica'
+
+        # Changes that haven't reached the replica
+        Book.objects.using('default').update(edition=99)
+
+        qs = Book.objects.all()
+        fs = BookFilterSet(qs, QueryDict('binding=H'))
+        with self.assertNumQueries(0, using='default'):
+            for field in ['binding', 'genre', 'authors', 'edition',
+                          'date_published', 'price']:
+                fs.get_filter_choices(field)
+            total_count = fs.total_count
+        self.assertEqual(total_count, qs.filter(binding='H').count())
+        self.assertTrue('99' not in [c.label for c in fs.get_filter_choices('edition')])
+        self.assertEqual(set(b.edition for b in fs.qs), set([99]))
+        self.assertEqual(fs.qs.db, 'default')
+
+    def test_get_facet_using(self):
+        class BookFilterSet(FilterSet):
+            fields = ['genre']
+
+            def get_facet_using(self):
+                return 'replica' if 'replica' in self.params else None
+
+        qs = Book.objects.all()
+        fs = BookFilterSet(qs, QueryDict('replica=1'))
+        with self.assertNumQueries(0, using='default'):
+            fs.get_filter_choices('genre')
+        fs = BookFilterSet(qs, QueryDict(''))
+        with self.assertNumQueries(0, using='replica'):
+            fs.get_filter_choices('genre')
+
+    def test_explain_on_replica(self):
+        class BookFilterSet(FilterSet):
+            fields = ['binding', 'authors']
+            facet_using = 'replica'
+
+        report = BookFilterSet(Book.objects.all(), QueryDict('')).explain()
+        self.assertTrue(report.get_plans('conditional counts'))
+        self.assertTrue(report.get_plans('authors'))
+
+
 class TestFilters(TestCase):
     fixtures = ['django_easyfilters_tests']
 
@@ -264,6 +734,46 @@ class TestFilters(TestCase):
         qs_reverted = filter3.apply_filter(qs)
         self.assertEqual(qs, qs_reverted)
 
+    def test_choice_params_built_lazily(self):
+        """
+        The params of a choice are only built when they are used.
+        """
+        qs = Book.objects.all()
+        filter1 = ForeignKeyFilter('genre', Book, QueryDict('genre=1'))
+        built = []
+        build_params = filter1.build_params
+        filter1.build_params = lambda **kwargs: built.append(kwargs) or build_params(**kwargs)
+        choice = filter1.get_choices(qs)[0]
+        self.assertEqual(built, [])
+        self.assertEqual(choice.params, QueryDict(''))
+        self.assertEqual(choice.url, '?')
+        choice.params
+        self.assertEqual(len(built), 1)
+
+    def test_choice_pickle(self):
+        qs = Book.objects.all()
+        choices = ForeignKeyFilter('genre', Book, QueryDict('')).get_choices(qs)
+        unpickled = pickle.loads(pickle.dumps(choices, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(unpickled, choices)
+        self.assertEqual(unpickled[1].params, choices[1].params)
+        self.assertEqual(FilterChoice('x', None, None, FILTER_DISPLAY).url, None)
+
+    def test_choice_as_tuple(self):
+        """
+        Choices can still be used as the namedtuple they used to be.
+        """
+        params = QueryDict('genre=1')
+        choice = FilterChoice('x', 3, params, FILTER_ADD, capped=True)
+        label, count, choice_params, link_type = choice
+        self.assertEqual((label, count, choice_params, link_type),
+                         ('x', 3, params, FILTER_ADD))
+        self.assertEqual(choice[0], 'x')
+        self.assertEqual(choice[-1], FILTER_ADD)
+        self.assertEqual(len(choice), 4)
+        self.assertEqual(list(choice), ['x', 3, params, FILTER_ADD])
+        self.assertEqual(choice, ('x', 3, params, FILTER_ADD))
+        self.assertEqual(('x', 3, params, FILTER_ADD), choice)
+
     def test_foreignkey_invalid_query(self):
         self.do_invalid_query_param(lambda params:
                                              ForeignKeyFilter('genre', Book, params),
@@ -448,6 +958,20 @@ class TestFilters(TestCase):
                           (text_type(anne), FILTER_REMOVE),
                           (text_type(charlotte), FILTER_DISPLAY)])
 
+    def test_manytomany_filter_multiple_single_join(self):
+        qs = Book.objects.all()
+        brontes = Author.objects.filter(name__endswith='Brontë')
+        data = MultiValueDict({'authors': [str(a.pk) for a in brontes]})
+        filter1 = ManyToManyFilter('authors', Book, data)
+        filtered = filter1.apply_filter(qs)
+        # One subquery on the through table, whatever the number chosen.
+        sql = str(filtered.query)
+        self.assertEqual(sql.count('test_app_book_authors'), 1)
+        self.assertIn('HAVING', sql)
+        expected = [b for b in qs if set(brontes) <= set(b.authors.all())]
+        self.assertEqual(list(filtered), expected)
+        self.assertEqual([b.name for b in filtered], ['Poems'])
+
     def test_manytomany_filter_invalid_query(self):
         self.do_invalid_query_param(lambda params:
                                              ManyToManyFilter('authors', Book, params),
@@ -471,6 +995,36 @@ class TestFilters(TestCase):
         self.assertEqual('(null)', choices[0].label)
         self.assertTrue('-' in choices[1].label, choices)
 
+    def test_datetime_filter_buckets_in_database(self):
+        """
+        Tests that collapsing dates into ranges is done by the database, which
+        only returns as many rows as there are links.
+        """
+        qs = Book.objects.all()
+        backend = SQLBackend()
+        years = backend.date_counts(qs, 'date_published', 'year')
+        self.assertEqual(backend.date_counts(qs, 'date_published', 'year',
+                                             limit=3),
+                         years[:3])
+        first = years[0][0].year
+        expected = {}
+        for dt, count in years:
+            bucketnum = (dt.year - first) // 20
+            expected[bucketnum] = expected.get(bucketnum, 0) + count
+        self.assertEqual(backend.date_bucket_counts(qs, 'date_published',
+                                                    'year', first, 20),
+                         sorted(expected.items()))
+
+        f = DateTimeFilter('date_published', Book, MultiValueDict(), max_links=3)
+        with self.assertNumQueries(4):
+            # 1 for the range of dates, 1 for the first 4 years, 1 for the
+            # count of nulls and 1 for the buckets.
+            choices = f.get_choices(qs)
+        self.assertEqual([c.count for c in choices if c.label != '(null)'],
+                         [count for bucketnum, count in backend.date_bucket_counts(
+                             qs, 'date_published', 'year', first,
+                             (years[-1][0].year - first) // 3 + 1)])
+
     def test_datetime_filter_single_year_selected(self):
         params = MultiValueDict({'date_published':['1818']})
         f = DateTimeFilter('date_published', Book, params, max_links=10)
@@ -647,6 +1201,14 @@ class TestFilters(TestCase):
         self.assertEqual(len(choices), 1)
         self.assertEqual(choices[0].link_type, FILTER_REMOVE)
 
+    def test_datetime_filter_null_selected(self):
+        qs = Book.objects.all()
+        params = MultiValueDict({'date_published--isnull': ['']})
+        f = DateTimeFilter('date_published', Book, params)
+        choices = f.get_choices(f.apply_filter(qs))
+        self.assertEqual([c.link_type for c in choices], [FILTER_REMOVE])
+        self.assertEqual(choices[0].params, MultiValueDict())
+
     def test_datetime_filter_invalid_query(self):
         self.do_invalid_query_param(lambda params: DateTimeFilter('date_published', Book, params, max_links=10),
                                          MultiValueDict({'date_published':['1818xx']}))
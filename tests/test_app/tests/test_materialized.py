@@ -0,0 +1,58 @@
+from six import StringIO
+
+from django.core.management import call_command
+from django.http import QueryDict
+from django.test import TestCase
+
+from django_easyfilters.filterset import FilterSet
+from django_easyfilters.materialized import MaterializedBackend, MaterializedCounts
+from django_easyfilters.models import FacetCount
+
+from test_app.models import Book
+from test_app.tests.base import FIELDS, BackendEquivalenceMixin
+
+
+DIMENSIONS = ['binding', 'genre', 'authors']
+
+book_counts = MaterializedCounts('books', Book.objects.all(), DIMENSIONS,
+                                 [f for f in FIELDS if f not in DIMENSIONS])
+
+
+class MaterializedBookFilterSet(FilterSet):
+    fields = FIELDS
+    backend_class = MaterializedBackend
+    materialized_counts = book_counts
+
+
+class TestMaterializedCounts(BackendEquivalenceMixin, TestCase):
+
+    filterset_class = MaterializedBookFilterSet
+    # The counts are read from the table.
+    fields_without_queries = None
+
+    def setUp(self):
+        book_counts.refresh()
+
+    def test_reads_table(self):
+        # Counts are as of the last refresh.
+        editions = dict((c.label, c.count) for c in MaterializedBookFilterSet(
+            Book.objects.all(), QueryDict('binding=H'))
+            .get_filter_choices('edition'))
+        Book.objects.update(edition=99)
+        fs = MaterializedBookFilterSet(Book.objects.all(), QueryDict('binding=H'))
+        self.assertEqual(dict((c.label, c.count)
+                              for c in fs.get_filter_choices('edition')),
+                         editions)
+        book_counts.refresh()
+        fs = MaterializedBookFilterSet(Book.objects.all(), QueryDict('binding=H'))
+        self.assertEqual([c.label for c in fs.get_filter_choices('edition')],
+                         ['99'])
+
+    def test_command(self):
+        FacetCount.objects.all().delete()
+        out = StringIO()
+        call_command('easyfilters_refresh_counts',
+                     'test_app.tests.test_materialized.MaterializedBookFilterSet',
+                     stdout=out)
+        self.assertIn('Refreshed books', out.getvalue())
+        self.assertTrue(FacetCount.objects.filter(name='books').exists())
@@ -0,0 +1,102 @@
+from django.http import QueryDict
+from django.test import TestCase
+
+from django_easyfilters.filterset import FilterSet
+from django_easyfilters.pagination import FilterSetPaginator, KeysetPaginator
+
+from test_app.models import Book
+
+
+class TestFilterSetPaginator(TestCase):
+
+    fixtures = ['django_easyfilters_tests']
+
+    def test_count_from_filterset(self):
+        class BookFilterSet(FilterSet):
+            fields = ['binding', 'genre']
+
+        fs = BookFilterSet(Book.objects.order_by('id'), QueryDict('binding=H'))
+        for field in ['binding', 'genre']:
+            fs.get_filter_choices(field)
+        paginator = FilterSetPaginator(fs, 2)
+        with self.assertNumQueries(1):
+            objects = list(paginator.page(1).object_list)
+        self.assertEqual(objects, list(fs.qs[:2]))
+        self.assertEqual(paginator.count, fs.qs.count())
+        self.assertEqual(paginator.num_pages, (fs.qs.count() + 1) // 2)
+
+
+class TestKeysetPaginator(TestCase):
+
+    fixtures = ['django_easyfilters_tests']
+
+    def setUp(self):
+        class BookFilterSet(FilterSet):
+            fields = ['binding', 'genre']
+
+        self.BookFilterSet = BookFilterSet
+
+    def walk(self, paginator):
+        """
+        Returns the pages going forwards, and then back again.
+        """
+        forwards = []
+        page = paginator.page(None)
+        forwards.append(list(page))
+        while page.has_next():
+            with self.assertNumQueries(1):
+                page = paginator.page(page.next_params()['cursor'])
+            forwards.append(list(page))
+        backwards = [list(page)]
+        while page.has_previous():
+            page = paginator.page(page.previous_params()['cursor'])
+            backwards.append(list(page))
+        return forwards, backwards
+
+    def test_pages(self):
+        fs = self.BookFilterSet(Book.objects.all(), QueryDict('binding=P'))
+        paginator = KeysetPaginator(fs, 3, ordering=['-price', 'name'])
+        forwards, backwards = self.walk(paginator)
+        expected = list(fs.qs.order_by('-price', 'name', 'pk'))
+        self.assertTrue(len(forwards) > 1)
+        self.assertEqual(sum(forwards, []), expected)
+        self.assertEqual(backwards, list(reversed(forwards)))
+
+    def test_default_ordering(self):
+        paginator = KeysetPaginator(Book.objects.order_by('date_published'), 4)
+        self.assertEqual(paginator.ordering,
+                         [('date_published', False), ('id', False)])
+
+    def test_params(self):
+        fs = self.BookFilterSet(Book.objects.all(), QueryDict('binding=P'))
+        page = KeysetPaginator(fs, 3).page(None)
+        params = page.next_params()
+        self.assertEqual(params['binding'], 'P')
+
+        # Filter links go back to the first page.
+        fs = self.BookFilterSet(Book.objects.all(), params)
+        for choice in fs.get_filter_choices('genre'):
+            if choice.params is not None:
+                self.assertNotIn('cursor', choice.params)
+
+    def test_invalid_cursor(self):
+        paginator = KeysetPaginator(Book.objects.all(), 3)
+        self.assertEqual(list(paginator.page('not-a-cursor')),
+                         list(paginator.page(None)))
+
+    def test_cursor_param_reset(self):
+        fs = self.BookFilterSet(Book.objects.all(), QueryDict(''))
+        self.assertRaises(ValueError, KeysetPaginator, fs, 3,
+                          cursor_param='after')
+
+        class AfterBookFilterSet(self.BookFilterSet):
+            reset_params = ('after',)
+        fs = AfterBookFilterSet(Book.objects.all(), QueryDict('after=x'))
+        KeysetPaginator(fs, 3, cursor_param='after')
+        for choice in fs.get_filter_choices('genre'):
+            self.assertNotIn('after', choice.params)
+
+    def test_invalid_ordering(self):
+        for ordering in [['genre__name'], ['-nonexistent'], ['?']]:
+            self.assertRaises(ValueError, KeysetPaginator, Book.objects.all(), 3,
+                              ordering=ordering)
@@ -0,0 +1,111 @@
+from django.http import QueryDict
+from django.test import TestCase
+
+from django_easyfilters.caching import get_cache
+from django_easyfilters.filters import FILTER_REMOVE
+from django_easyfilters.filterset import FilterSet
+from django_easyfilters.planner import CAPPED, EXACT, PYTHON, SAMPLED, SKIPPED
+from django_easyfilters.planner import FacetPlanner, SampledBackend
+
+from test_app.models import Book
+from test_app.tests.base import FIELDS, BackendEquivalenceMixin
+
+
+class BookFilterSet(FilterSet):
+    fields = FIELDS
+
+
+def make_filterset_class(**attrs):
+    return type('PlannedBookFilterSet', (BookFilterSet,), attrs)
+
+
+def make_filterset(params='', **attrs):
+    return make_filterset_class(**attrs)(Book.objects.all(), QueryDict(params))
+
+
+class TestFacetPlanner(BackendEquivalenceMixin, TestCase):
+
+    # Only some strategies avoid queries.
+    fields_without_queries = None
+
+    def setUp(self):
+        self.filterset_class = make_filterset_class(planner=FacetPlanner())
+
+    def test_python(self):
+        fs = self.assertSameChoices('')
+        self.assertEqual(fs.facet_stats['genre'].strategy, PYTHON)
+        self.assertEqual(fs.facet_stats['genre'].rows, 17)
+        # Counted together with the other conditional counts.
+        self.assertEqual(fs.facet_stats['binding'].strategy, EXACT)
+
+    def test_exact(self):
+        planner = FacetPlanner(python_max_rows=5)
+        self.filterset_class = make_filterset_class(planner=planner)
+        fs = self.assertSameChoices('')
+        stats = fs.facet_stats['genre']
+        # SQLite gives no row estimates.
+        self.assertEqual((stats.strategy, stats.rows), (EXACT, None))
+        self.assertTrue(stats.elapsed is not None)
+        self.assertEqual(planner.history.get((fs.__class__, 'genre')),
+                         stats.elapsed)
+
+    def test_capped(self):
+        planner = FacetPlanner(python_max_rows=5, count_cap=2)
+        fs = make_filterset(planner=planner)
+        planner.history.record((fs.__class__, 'genre'), 1.0)
+        choices = fs.get_filter_choices('genre')
+        self.assertEqual(fs.facet_stats['genre'].strategy, CAPPED)
+        self.assertEqual(max(c.count for c in choices), 2)
+        self.assertTrue(any(c.capped for c in choices))
+        # The filter is left as it was.
+        self.assertEqual(fs.get_filter('genre').count_cap, None)
+
+    def test_skipped(self):
+        planner = FacetPlanner(python_max_rows=5, page_budget=0.5)
+        fs = make_filterset('genre=1', planner=planner, cache_timeout=60)
+        get_cache('default').clear()
+        planner.history.record((fs.__class__, 'authors'), 1.0)
+        choices = fs.get_filter_choices('authors')
+        self.assertEqual(fs.facet_stats['authors'].strategy, SKIPPED)
+        self.assertEqual(choices, [])
+        self.assertEqual([c.link_type for c in fs.get_filter_choices('genre')],
+                         [FILTER_REMOVE])
+        self.assertEqual(fs.get_cached('authors', 'choices'), None)
+        self.assertNotEqual(fs.get_cached('genre', 'choices'), None)
+
+    def test_choose(self):
+        planner = FacetPlanner()
+        fs = make_filterset(planner=planner)
+        genre = fs.get_filter('genre')
+        dates = fs.get_filter('date_published')
+        self.assertEqual(planner.choose(genre, 10, None, 0), PYTHON)
+        self.assertEqual(planner.choose(genre, 5000, None, 0), EXACT)
+        self.assertEqual(planner.choose(genre, 200000, None, 0), CAPPED)
+        self.assertEqual(planner.choose(dates, 200000, None, 0), SAMPLED)
+        self.assertEqual(planner.choose(dates, None, 1.0, 0), EXACT)
+        self.assertEqual(planner.choose(dates, 50000, 1.0, 0), SAMPLED)
+
+    def test_sampled_backend(self):
+        fs = BookFilterSet(Book.objects.all(), QueryDict(''))
+        backend = SampledBackend(fs, fs.qs, 17, 34)
+        counts = fs.backend.value_counts(fs.qs, 'genre')
+        self.assertEqual(backend.value_counts(fs.qs, 'genre'),
+                         dict((k, v * 2) for k, v in counts.items()))
+        # Other QuerySets are not sampled.
+        qs = fs.qs.filter(edition=1)
+        self.assertEqual(backend.value_counts(qs, 'genre'),
+                         fs.backend.value_counts(qs, 'genre'))
+
+    def test_sampled(self):
+        planner = FacetPlanner(python_max_rows=5, sample_size=4)
+        planner.choose = lambda filter_, rows, estimate, spent: SAMPLED
+        # Without an estimate from the database.
+        planner.estimate_rows = lambda filterset, qs: 17
+        fs = make_filterset(planner=planner)
+        choices = fs.get_filter_choices('date_published')
+        self.assertEqual(fs.facet_stats['date_published'].strategy, SAMPLED)
+        self.assertTrue(choices)
+        # The counts are estimates, so not used for the total.
+        fs.get_filter_choices('edition')
+        self.assertEqual(fs.get_filter('edition').get_total_count(fs.qs), None)
+        self.assertEqual(fs.total_count, 17)
@@ -0,0 +1,73 @@
+import os
+import tempfile
+
+from six import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from django_easyfilters.replay import parse_query_string, percentile, replay
+
+from test_app.models import Book
+from test_app.tests.test_advisor import BookFilterSet, SPEC
+
+
+class TestReplay(TestCase):
+
+    fixtures = ['django_easyfilters_tests']
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 95), 3)
+        self.assertEqual(percentile([], 50), None)
+
+    def test_parse_query_string(self):
+        self.assertEqual(parse_query_string('binding=H\n'), 'binding=H')
+        self.assertEqual(parse_query_string('/books/?genre=1&binding=H'),
+                         'genre=1&binding=H')
+        self.assertEqual(parse_query_string('GET /books/?genre=1 HTTP/1.1'),
+                         'genre=1')
+        self.assertEqual(parse_query_string('# comment'), None)
+        self.assertEqual(parse_query_string('  '), None)
+        # Lines without a query string.
+        self.assertEqual(parse_query_string('GET /books/ HTTP/1.1'), None)
+        self.assertEqual(parse_query_string(
+            '127.0.0.1 - - [18/Oct/2026:10:00:00 +0000] "GET /books/ HTTP/1.1" 200 512'), None)
+        self.assertEqual(parse_query_string('/books/'), None)
+
+    def test_replay(self):
+        stats = replay(BookFilterSet, Book.objects.all(),
+                       ['', 'binding=H', 'genre=1'])
+        self.assertEqual(len(stats.timings), 3)
+        self.assertEqual(stats.fields(),
+                         [f for f in BookFilterSet.fields])
+        for field in stats.fields():
+            self.assertEqual(len(stats.filter_queries(field)), 3)
+        # Counting a ManyToMany filter always needs a query.
+        self.assertTrue(min(stats.filter_queries('authors')) >= 1)
+        self.assertEqual(len(stats.slowest(2)), 2)
+
+    def test_replay_on_replica(self):
+        class ReplicaBookFilterSet(BookFilterSet):
+            facet_using = 'replica'
+
+        stats = replay(ReplicaBookFilterSet, Book.objects.all(), [''])
+        self.assertTrue(stats.filter_queries('authors')[0] >= 1)
+
+    def test_command(self):
+        fd, logfile = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('# recorded\n/books/?binding=H\ngenre=1\n\n')
+            out = StringIO()
+            call_command('easyfilters_replay', logfile, SPEC, slowest=1,
+                         stdout=out)
+        finally:
+            os.remove(logfile)
+        output = out.getvalue()
+        self.assertIn('Replayed 2 requests', output)
+        self.assertIn('p95', output)
+        self.assertIn('  genre: p50', output)
+        self.assertEqual(output.count('  ?'), 1)
@@ -0,0 +1,116 @@
+from django.http import QueryDict
+from django.test import TestCase
+
+from django_easyfilters.filterset import FilterSet
+from django_easyfilters.sqlcache import CompiledSQLBackend, SQLTemplateCache
+
+from test_app.models import Author, Book, Genre
+from test_app.tests.base import FIELDS, BackendEquivalenceMixin
+
+
+class CompiledBookFilterSet(FilterSet):
+    fields = FIELDS
+    backend_class = CompiledSQLBackend
+
+
+class TestSQLTemplateCache(TestCase):
+
+    def test_learns_from_two_observations(self):
+        cache = SQLTemplateCache()
+        sql = "SELECT ... WHERE a = %s AND b > %s AND c = %s"
+        self.assertEqual(cache.learn('k', sql, [1, 10, 'x'], [1, 'x']), None)
+        template = cache.learn('k', sql, [2, 10, 'y'], [2, 'y'])
+        self.assertEqual(template.sql, sql)
+        self.assertEqual(template.bind([3, 'z']), [3, 10, 'z'])
+        self.assertTrue(cache.get('k') is template)
+
+    def test_values_must_all_differ(self):
+        cache = SQLTemplateCache()
+        sql = "SELECT ... WHERE a = %s AND c = %s"
+        cache.learn('k', sql, [1, 'x'], [1, 'x'])
+        # 'x' could be a constant or the second value.
+        self.assertEqual(cache.learn('k', sql, [2, 'x'], [2, 'x']), None)
+        self.assertNotEqual(cache.learn('k', sql, [3, 'y'], [3, 'y']), None)
+
+    def test_ambiguous(self):
+        cache = SQLTemplateCache()
+        sql = "SELECT ... WHERE a = %s AND b = %s"
+        cache.learn('k', sql, [1, 1], [1, 1])
+        self.assertEqual(cache.learn('k', sql, [2, 2], [2, 2]), None)
+        self.assertEqual(cache.get('k'), None)
+
+    def test_transformed_values(self):
+        cache = SQLTemplateCache()
+        sql = "SELECT ... WHERE a LIKE %s"
+        cache.learn('k', sql, ['%x%'], ['x'])
+        self.assertEqual(cache.learn('k', sql, ['%y%'], ['y']), None)
+
+    def test_different_sql(self):
+        cache = SQLTemplateCache()
+        cache.learn('k', "SELECT ... WHERE a = %s", [1], [1])
+        self.assertEqual(cache.learn('k', "SELECT ... WHERE a IN (%s)", [2],
+                                     [2]),
+                         None)
+
+
+class TestCompiledSQLBackend(BackendEquivalenceMixin, TestCase):
+
+    filterset_class = CompiledBookFilterSet
+    # The SQL is reused, but still run.
+    fields_without_queries = None
+
+    def setUp(self):
+        CompiledSQLBackend.template_cache.clear()
+
+    def get_query_strings(self):
+        genres = list(Genre.objects.filter(book__isnull=False).distinct())
+        authors = list(Author.objects.filter(book__isnull=False).distinct())
+        query_strings = ['', 'genre--isnull=', 'binding=H&edition=2',
+                         'binding=P&edition=1']
+        for genre, binding in zip(genres, 'HPCH'):
+            query_strings.append('genre=%d' % genre.pk)
+            query_strings.append('genre=%d&binding=%s' % (genre.pk, binding))
+        for author in authors:
+            query_strings.append('authors=%d' % author.pk)
+        for a1, a2 in zip(authors, authors[1:]):
+            query_strings.append('authors=%d&authors=%d' % (a1.pk, a2.pk))
+        # Twice, so that the second time uses the cached SQL
+        return query_strings * 2
+
+    def test_same_choices_as_sql(self):
+        super(TestCompiledSQLBackend, self).test_same_choices_as_sql()
+        self.assertTrue(CompiledSQLBackend.template_cache.templates)
+
+    def test_skips_compilation(self):
+        genres = list(Genre.objects.filter(book__isnull=False).distinct())
+        for genre in genres[:2]:
+            fs = CompiledBookFilterSet(Book.objects.all(),
+                                       QueryDict('genre=%d' % genre.pk))
+            fs.get_filter_choices('edition')
+
+        built = []
+        fs = CompiledBookFilterSet(Book.objects.all(),
+                                   QueryDict('genre=%d' % genres[2].pk))
+        fetch = fs.backend.fetch
+
+        def fetch_recording(qs, key, build):
+            def build_recording():
+                built.append(key)
+                return build()
+            return fetch(qs, key, build_recording)
+        fs.backend.fetch = fetch_recording
+
+        with self.assertNumQueries(2):
+            choices = fs.get_filter_choices('edition')
+        self.assertEqual(built, [])
+        self.assertEqual(choices, self.get_sql_filterset_class()(
+            Book.objects.all(),
+            QueryDict('genre=%d' % genres[2].pk)).get_filter_choices('edition'))
+
+    def test_uncached_fields(self):
+        # Decimals aren't fetched with a plain cursor, but use SQLBackend.
+        fs = CompiledBookFilterSet(Book.objects.all(), QueryDict(''))
+        self.assertFalse(fs.backend.can_cache(fs.qs, 'price'))
+        self.assertTrue(fs.backend.can_cache(fs.qs, 'genre'))
+        self.assertTrue(fs.backend.can_cache(fs.qs, 'authors'))
+        self.assertFalse(fs.backend.can_cache(Book.objects.all(), 'genre'))
@@ -0,0 +1,141 @@
+from django.db import connections
+from django.http import QueryDict
+from django.test import TestCase
+
+from django_easyfilters.backends import SQLBackend
+from django_easyfilters.caching import get_cache
+from django_easyfilters.filters import FILTER_REMOVE
+from django_easyfilters.filterset import FilterSet
+from django_easyfilters.signals import facet_timeout
+from django_easyfilters.timeouts import FacetTimeout, statement_timeout
+
+from test_app.models import Book
+
+
+def slow_query(qs):
+    # Far more than SQLITE_PROGRESS_STEPS instructions, even on small tables.
+    cursor = connections[qs.db].cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM test_app_book a, test_app_book b,"
+                       " test_app_book c")
+    finally:
+        cursor.close()
+
+
+class SlowCountsBackend(SQLBackend):
+    # Counts are slow, values without counts are not.
+
+    def value_counts(self, qs, fieldname):
+        slow_query(qs)
+        return super(SlowCountsBackend, self).value_counts(qs, fieldname)
+
+
+class SlowBackend(SlowCountsBackend):
+
+    def distinct_values(self, qs, fieldname):
+        slow_query(qs)
+        return super(SlowBackend, self).distinct_values(qs, fieldname)
+
+
+class BookFilterSet(FilterSet):
+    fields = [
+        ('edition', dict(multiselect=True)),
+    ]
+
+
+class SlowCountsBookFilterSet(BookFilterSet):
+    backend_class = SlowCountsBackend
+    facet_timeout = 0
+
+
+class SlowBookFilterSet(BookFilterSet):
+    backend_class = SlowBackend
+    facet_timeout = 0
+
+
+class TestStatementTimeout(TestCase):
+
+    fixtures = ['django_easyfilters_tests']
+
+    def test_timeout(self):
+        qs = Book.objects.all()
+        with self.assertRaises(FacetTimeout):
+            with statement_timeout(connections[qs.db], 0):
+                slow_query(qs)
+        # The connection can still be used.
+        self.assertEqual(Book.objects.count(), 17)
+
+    def test_within_timeout(self):
+        qs = Book.objects.all()
+        with statement_timeout(connections[qs.db], 60):
+            slow_query(qs)
+
+
+class TestFacetTimeout(TestCase):
+
+    fixtures = ['django_easyfilters_tests']
+
+    def setUp(self):
+        get_cache('default').clear()
+
+    def test_no_counts(self):
+        expected = BookFilterSet(Book.objects.all(), QueryDict(''))
+        fs = SlowCountsBookFilterSet(Book.objects.all(), QueryDict(''))
+        choices = fs.get_filter_choices('edition')
+        self.assertEqual(sorted(c.label for c in choices),
+                         sorted(c.label for c in expected.get_filter_choices('edition')))
+        self.assertEqual(set(c.count for c in choices), set([None]))
+        self.assertEqual(fs.timeouts, ['edition'])
+
+    def test_remove_only(self):
+        fs = SlowBookFilterSet(Book.objects.all(), QueryDict('edition=1'))
+        choices = fs.get_filter_choices('edition')
+        self.assertEqual([(c.label, c.link_type) for c in choices],
+                         [('1', FILTER_REMOVE)])
+
+    def test_within_timeout(self):
+        class FilterSet(BookFilterSet):
+            facet_timeout = 60
+        expected = BookFilterSet(Book.objects.all(), QueryDict(''))
+        fs = FilterSet(Book.objects.all(), QueryDict(''))
+        self.assertEqual(fs.get_filter_choices('edition'),
+                         expected.get_filter_choices('edition'))
+        self.assertEqual(fs.timeouts, [])
+
+    def test_filter_option(self):
+        class FilterSet(SlowCountsBookFilterSet):
+            fields = [('edition', dict(timeout=None))]
+        fs = FilterSet(Book.objects.all(), QueryDict(''))
+        self.assertTrue(all(c.count for c in fs.get_filter_choices('edition')))
+        self.assertEqual(fs.timeouts, [])
+
+    def test_signal(self):
+        received = []
+
+        def handler(sender, **kwargs):
+            received.append((sender, kwargs['field'], kwargs['timeout']))
+        facet_timeout.connect(handler)
+        try:
+            SlowCountsBookFilterSet(Book.objects.all(), QueryDict('')).render()
+        finally:
+            facet_timeout.disconnect(handler)
+        self.assertEqual(received, [(SlowCountsBookFilterSet, 'edition', 0)])
+
+    def test_not_cached(self):
+        class FilterSet(SlowCountsBookFilterSet):
+            cache_timeout = 60
+        fs = FilterSet(Book.objects.all(), QueryDict(''))
+        fs.render()
+        self.assertEqual(fs.get_cached('edition', 'choices'), None)
+        self.assertEqual(fs.get_cached('edition', 'html'), None)
+
+    def test_cached_choices(self):
+        class FilterSet(SlowCountsBookFilterSet):
+            cache_timeout = 60
+        expected = BookFilterSet(Book.objects.all(), QueryDict(''))
+        expected_choices = expected.get_filter_choices('edition')
+        fs = FilterSet(Book.objects.all(), QueryDict(''))
+        # As if another request had computed them meanwhile.
+        fs.set_cached('edition', 'choices', expected_choices)
+        choices = fs.get_degraded_choices(fs.get_filter('edition'), fs.qs)
+        self.assertEqual(choices, expected_choices)
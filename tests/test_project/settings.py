@@ -3,6 +3,11 @@ DATABASES = {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': 'tests.db',
     },
+    # For FilterSet.facet_using
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'tests_replica.db',
+    },
 }
 
 INSTALLED_APPS = [